@@ -22,21 +22,58 @@ describe a workload that can actually run":
   - a container reading YOLAB_FQDN/YOLAB_URL mounts /yolab AND has an init
     container that writes it
   - every `sh -c` container command is valid shell
+  - (with --sizes) no object, and no release as helm stores it, is over budget
 
 Renders against the yolab-common in this working tree, not the published one, so
 a library change is checked against the charts before it is released.
 
 Usage:
     check_charts.py [chart-dir ...]     # default: every chart in this directory
+    check_charts.py --jobs 1            # one chart at a time (default: one per core)
+    check_charts.py --no-cache          # re-render everything, ignore earlier runs
+    check_charts.py --umbrella          # one helm call per value profile, not per chart
+    check_charts.py --values default    # only the default value profile
+    check_charts.py --since origin/main # only charts a change since then can affect
+    check_charts.py --shard 2/4         # the second of four slices, for parallel CI
+    check_charts.py --list-charts       # what would be checked, as JSON
+    check_charts.py --watch             # re-check what each save affects, staying warm
+    check_charts.py --diff origin/main  # what each render would change, object by object
+    check_charts.py --rule-times        # where the assertion time goes, rule by rule
+    check_charts.py --report json       # per-chart phase timings + failures, to a file
+    check_charts.py --images images.json --prepull prepull-images.txt
+                                        # which images the catalog runs, and which to pre-pull
+    check_charts.py --capacity node-profiles.toml   # which apps fit on which box
+    check_charts.py --cold-start cold-start.toml    # install-to-Ready estimates, budgeted
+    check_charts.py --sizes size-budgets.toml       # largest objects and releases, budgeted
+    check_charts.py --index catalog-index.json      # one-read catalog for UI/local-api
+    check_charts.py --profile           # serial run under cProfile; slowest charts/rules
 """
+import argparse
+import base64
+import contextlib
+import cProfile
+import ctypes
+import ctypes.util
+import difflib
 import glob
+import hashlib
 import json
 import os
+import pstats
 import re
+import select
 import shutil
+import struct
 import subprocess
 import sys
+import tarfile
 import tempfile
+import threading
+import time
+import tomllib
+import xml.etree.ElementTree as ET
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 
 import yaml
 
@@ -62,6 +99,41 @@ LINT_VALUES = {
     "config.subdomain": "example",
 }
 
+# Value profiles each chart is rendered under, on top of LINT_VALUES. Rendering
+# only the defaults meant every bug on a non-default path — Authelia switched on,
+# the values local-api actually injects — shipped unseen, because the one render
+# never took that branch.
+PROFILES = {
+    "default": {"values": {}},
+    # What an install looks like once local-api has filled in `yolab`
+    # (build_values in local-api's apps.rs), on a subdomain other than the default.
+    "installed": {"values": {
+        "config.subdomain": "example-two",
+        "yolab.platformApiUrl": "https://api.example.com",
+        "yolab.serviceName": "example-two",
+    }},
+    # No "authelia" profile (config.auth_enabled with one user) yet: it renders
+    # yolab-common.image.authelia, which is still a bare tag, and the images rule
+    # would fail every chart that includes autheliaInit. It goes back in here
+    # together with the digest pin in _authelia.tpl and prepull-images.txt, and
+    # only for the charts that include autheliaInit (see chart_includes).
+}
+# Profiles only one chart has a use for, by chart directory name.
+CHART_PROFILES = {
+    # Both blocks are omitted entirely when empty, so only this renders them.
+    "minecraft": {"operators": {"values": {"config.ops": "alice", "config.whitelist": "alice,bob"}}},
+    "valheim": {"public": {"values": {"config.server_public": "true"}}},
+}
+
+# Rendered charts are kept between runs, keyed by everything that can change a
+# render, so the cache never needs clearing by hand. Only the helm call is
+# skipped on a hit; the assertions always run, so a new rule still sees every chart.
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "yolab", "check-charts",
+)
+CACHE_MAX_MB = 256
+
 # Containers the platform injects into the gateway pod, as opposed to the app's own.
 GATEWAY_CONTAINERS = ("wireguard", "caddy")
 # The only containers allowed to see the platform account token.
@@ -69,88 +141,779 @@ TOKEN_CONTAINERS = ("wg-register", "cleanup")
 
 
 class Failures:
-    def __init__(self):
+    def __init__(self, shell=None):
         self.items = []
+        self.shell = shell
 
     def __call__(self, app, msg):
         self.items.append(f"{app}: {msg}")
 
+    def script(self, app, where, script):
+        """Queue `script` for the batched shell-syntax stage.
+
+        Its slot in the report is reserved now and filled by resolve() once the
+        ShellSyntax has run, so a failure lands exactly where checking it inline
+        would have put it. With no ShellSyntax attached it is checked on the spot.
+        """
+        if self.shell is None:
+            err = ShellSyntax.validate(script)
+            if err is not None:
+                self(app, f"{where} command is not valid shell: {err}")
+            return
+        self.items.append((app, where, self.shell.submit(script)))
+
+    def resolve(self, shell):
+        items, self.items = self.items, []
+        for item in items:
+            if isinstance(item, str):
+                self.items.append(item)
+                continue
+            app, where, digest = item
+            err = shell.error(digest)
+            if err is not None:
+                self(app, f"{where} command is not valid shell: {err}")
+
     def __len__(self):
         return len(self.items)
 
+    def extend(self, other):
+        self.items += other.items
+
+
+class ShellSyntax:
+    """Every `sh -c` script in the catalog, syntax-checked once per distinct script.
+
+    Most of them come from yolab-common and are byte-identical across charts, so
+    validating per container meant the same few scripts parsed hundreds of times.
+    Scripts are collected while the charts are checked, deduplicated by hash, and
+    the distinct ones go through a small pool of `sh -n` at the end. Verdicts are
+    remembered in `memo_path` across runs: a script seen before costs nothing.
+
+    `sh -n` is still one process per distinct script. Parsing several scripts in
+    one `sh -n` is not sound: two scripts that each leave a quote open can close
+    each other's and pass together.
+
+    A verdict is only as good as the `sh` that gave it, so the memo is keyed on
+    the shell too: its resolved path and a hash of the binary (dash has no
+    --version to ask). A cache shared between hosts, or kept across a shell
+    upgrade, re-checks rather than replaying another shell's answers.
+    """
+
+    def __init__(self, memo_path=None):
+        self.memo_path = memo_path
+        self.shell = self.identify()
+        self.results = {}  # sha256 -> stderr of `sh -n`, or None when valid
+        self.pending = {}
+        self._lock = threading.Lock()
+        if memo_path and os.path.exists(memo_path):
+            try:
+                with open(memo_path) as f:
+                    self.results = json.load(f)
+            except ValueError:
+                pass  # a torn write from an interrupted run; start over
+
+    @staticmethod
+    def identify():
+        path = os.path.realpath(shutil.which("sh") or "sh")
+        try:
+            with open(path, "rb") as f:
+                return f"{path}:{hashlib.sha256(f.read()).hexdigest()}"
+        except OSError:
+            return path
+
+    def submit(self, script):
+        digest = hashlib.sha256(f"{self.shell}\0{script}".encode()).hexdigest()
+        with self._lock:
+            if digest not in self.results:
+                self.pending[digest] = script
+        return digest
+
+    @staticmethod
+    def validate(script):
+        out = subprocess.run(["sh", "-n"], input=script, capture_output=True, text=True)
+        return out.stderr.strip() if out.returncode != 0 else None
+
+    def run(self, jobs):
+        pending, self.pending = self.pending, {}
+        with ThreadPoolExecutor(max_workers=jobs) as pool:
+            for digest, err in zip(pending, pool.map(self.validate, pending.values())):
+                self.results[digest] = err
+        if self.memo_path and pending:
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.memo_path), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self.results, f)
+            os.replace(tmp, self.memo_path)
+
+    def error(self, digest):
+        return self.results[digest]
+
+
+def tree_digest(path):
+    """sha256 over every file under `path`: relative names and contents, in a
+    stable order, so the same tree hashes the same wherever it is checked out."""
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            full = os.path.join(root, name)
+            h.update(os.path.relpath(full, path).encode() + b"\0")
+            with open(full, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+
+class Library:
+    """The yolab-common in this tree, packaged on first use.
+
+    Packaging is deferred because a run served entirely from the render cache
+    never needs the tarball. The digest is taken over the library's sources, not
+    the .tgz: helm stamps the tar headers with the time of packaging, so the
+    tarball's bytes differ on every run even when its contents do not.
+    """
+
+    def __init__(self, path, version, destination):
+        self.path = path
+        self.version = version
+        self.destination = destination
+        self.digest = tree_digest(path)
+        self.seconds = 0.0  # spent in `helm package`; stays 0 on a fully cached run
+        self._tgz = None
+        self._lock = threading.Lock()
+
+    def tgz(self):
+        with self._lock:
+            if self._tgz is None:
+                start = time.perf_counter()
+                subprocess.run(
+                    ["helm", "package", self.path, "--version", self.version,
+                     "--destination", self.destination],
+                    check=True, capture_output=True,
+                )
+                self._tgz = glob.glob(os.path.join(self.destination, "yolab-common-*.tgz"))[0]
+                self.seconds = time.perf_counter() - start
+            return self._tgz
+
+
+class RenderCache:
+    """Rendered YAML on disk, content-addressed, evicted least-recently-used.
+
+    A hit bumps the entry's mtime, so mtime order is use order and eviction can
+    drop from the oldest end until the cache fits its cap again.
+    """
+
+    def __init__(self, path, max_bytes, library, helm_version):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(path, exist_ok=True)
+        # Everything a render depends on besides the chart itself, hashed once.
+        self._base = hashlib.sha256(json.dumps(
+            [library.digest, library.version, helm_version, LINT_VALUES], sort_keys=True,
+        ).encode()).hexdigest()
+
+    def key(self, chart, values):
+        profile = json.dumps(values, sort_keys=True)
+        return hashlib.sha256(f"{self._base}:{chart.digest}:{profile}".encode()).hexdigest()
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self.path, f"{key}.yaml"))
+
+    def open(self, key):
+        """The cached render as an open file to stream lines from, or None."""
+        path = os.path.join(self.path, f"{key}.yaml")
+        try:
+            f = open(path)
+        except FileNotFoundError:
+            return None
+        os.utime(path)
+        return f
+
+    @contextlib.contextmanager
+    def writer(self, key):
+        """A file to tee a render into as it streams past. The entry only appears
+        once `commit()` has been called on it; otherwise it is discarded.
+
+        Write-then-rename, so a concurrent run never reads half an entry.
+        """
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        f = os.fdopen(fd, "w")
+        f.committed = False
+        f.commit = lambda: setattr(f, "committed", True)
+        try:
+            yield f
+        finally:
+            f.close()
+            if f.committed:
+                os.replace(tmp, os.path.join(self.path, f"{key}.yaml"))
+            else:
+                os.remove(tmp)
+
+    def evict(self):
+        # Only finished renders: a `.tmp` is another run's entry still being
+        # written, and the shell-syntax memo shares this directory.
+        entries = []
+        for name in os.listdir(self.path):
+            if not name.endswith(".yaml"):
+                continue
+            try:
+                st = os.stat(os.path.join(self.path, name))
+            except FileNotFoundError:
+                continue  # another run evicted it first
+            entries.append((st.st_mtime, st.st_size, name))
+        total = sum(size for _, size, _ in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(os.path.join(self.path, name))
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+def helm_version():
+    out = subprocess.run(["helm", "version", "--short"], capture_output=True, text=True)
+    return out.stdout.strip()
 
-def chart_field(chart_yaml, field):
-    for line in chart_yaml.splitlines():
-        if line.startswith(f"{field}:"):
-            return line.split(":", 1)[1].strip().strip('"')
-    return None
 
+DEFINE_RE = re.compile(r'\{\{-?\s*define\s+"(yolab-common\.[^"]+)"')
+INCLUDE_RE = re.compile(r'\b(?:include|template)\s+"(yolab-common\.[^"]+)"')
 
-def render(chart_dir, library_tgz, workdir):
-    """helm template the chart against the local library. Returns the YAML text.
 
-    Renders from a copy: the chart has to gain a `charts/` directory holding the
-    library, and the source tree is read-only when this runs from the nix store.
+def library_helpers(tpl_text):
+    """{helper: its source} for every `define` in one .tpl file.
+
+    A helper's source runs up to the next define, so the comment introducing the
+    next helper is counted as part of this one. That can only ever widen the set
+    of charts an edit is thought to affect, never narrow it.
+    """
+    starts = [(m.start(), m.group(1)) for m in DEFINE_RE.finditer(tpl_text)]
+    ends = [pos for pos, _ in starts[1:]] + [len(tpl_text)]
+    return {name: tpl_text[pos:end] for (pos, name), end in zip(starts, ends)}
+
+
+def chart_includes(chart_dir):
+    """The yolab-common helpers a chart's own templates call directly."""
+    used = set()
+    for path in glob.glob(os.path.join(chart_dir, "templates", "*")):
+        with open(path) as f:
+            used.update(INCLUDE_RE.findall(f.read()))
+    return used
+
+
+def git(*args):
+    return subprocess.run(
+        ["git", *args], cwd=HERE, capture_output=True, text=True, check=True,
+    ).stdout
+
+
+def changed_helpers(old, new):
+    """The helpers whose definition differs between two versions of one .tpl."""
+    before, after = library_helpers(old), library_helpers(new)
+    return {h for h in before.keys() | after.keys() if before.get(h) != after.get(h)}
+
+
+def charts_using(chart_dirs, helpers):
+    """The subset of chart_dirs calling any of `helpers`, directly or through
+    other library helpers that call them."""
+    # Propagate up the library's own include graph: a helper that includes a
+    # changed helper renders differently too.
+    callers = {}
+    for path in glob.glob(os.path.join(LIBRARY, "templates", "*.tpl")):
+        with open(path) as f:
+            defined = library_helpers(f.read())
+        for name, body in defined.items():
+            for callee in INCLUDE_RE.findall(body):
+                callers.setdefault(callee, set()).add(name)
+    dirty = set(helpers)
+    pending = list(dirty)
+    while pending:
+        for caller in callers.get(pending.pop(), ()):
+            if caller not in dirty:
+                dirty.add(caller)
+                pending.append(caller)
+    return [d for d in chart_dirs if chart_includes(d) & dirty]
+
+
+def affected_charts(chart_dirs, ref):
+    """The subset of chart_dirs whose render can differ from what it was at `ref`.
+
+    A chart is affected when a file in its own directory changed, or when it calls
+    (directly, or through other helpers) a yolab-common helper whose definition
+    changed. Helpers are compared body by body, so an edit to the Authelia init
+    container re-checks the charts that use Authelia, not every chart that merely
+    shares _authelia.tpl's `auth.enabled` with the Caddy ConfigMap.
+    """
+    changed = git("diff", "--name-only", "--relative", ref, "--", ".").split()
+    changed += git("ls-files", "--others", "--exclude-standard", "--", ".").split()
+
+    library = os.path.basename(LIBRARY)
+    tpl_prefix = f"{library}/templates/"
+    dirty_helpers = set()
+    for path in changed:
+        if path == os.path.basename(__file__) or (
+            path.startswith(f"{library}/") and not path.startswith(tpl_prefix)
+        ):
+            # The rules themselves, or the library's Chart.yaml: everything.
+            return list(chart_dirs)
+        if not path.startswith(tpl_prefix):
+            continue
+        try:
+            old = git("show", f"{ref}:./{path}")
+        except subprocess.CalledProcessError:
+            old = ""  # added since ref
+        full = os.path.join(HERE, path)
+        new = open(full).read() if os.path.exists(full) else ""
+        dirty_helpers |= changed_helpers(old, new)
+
+    changed_dirs = {p.split("/", 1)[0] for p in changed}
+    using = set(charts_using(chart_dirs, dirty_helpers))
+    return [
+        d for d in chart_dirs
+        if os.path.basename(d.rstrip("/")) in changed_dirs or d in using
+    ]
+
+
+class Chart:
+    """One chart directory, its Chart.yaml read and parsed once, and shared by
+    every profile it renders under and every report written about it."""
+
+    def __init__(self, path):
+        self.path = os.path.abspath(path)
+        self.app = os.path.basename(self.path)
+        with open(os.path.join(path, "Chart.yaml")) as f:
+            self.meta = yaml.load(f, Loader=YAML_LOADER) or {}
+        self.version = str(self.meta.get("version", ""))
+        self.is_library = self.meta.get("type") == "library"
+        # The yolab-common version this chart asks for, if it depends on it.
+        self.wants_library = next(
+            (str(d.get("version")) for d in self.meta.get("dependencies") or []
+             if d.get("name") == "yolab-common"),
+            None,
+        )
+        self._digest = None
+        self._lock = threading.Lock()
+
+    @property
+    def digest(self):
+        # Hashed on first use by whichever profile gets there first; a run with
+        # no cache never needs it.
+        with self._lock:
+            if self._digest is None:
+                self._digest = tree_digest(self.path)
+            return self._digest
+
+    def profiles(self, only=None):
+        """[(name, values)] this chart renders under, "default" first."""
+        candidates = {**PROFILES, **CHART_PROFILES.get(self.app, {})}
+        return [(name, p["values"]) for name, p in candidates.items()
+                if only is None or name in only]
+
+
+class Stager:
+    """A writable chart root per chart, for helm to render from.
+
+    The chart has to gain a `charts/` directory holding the library, and the
+    source tree is read-only when this runs from the nix store, so helm cannot be
+    pointed at it directly. Copying the whole chart in just to add one file was
+    most of the filesystem traffic of a run. By default the staged root is a real
+    directory whose entries are symlinks back to the source, plus a `charts/`
+    linking the one packaged library every chart shares; helm follows both.
+
+      copy      the chart's files are copied (the old behaviour)
+      symlink   top-level entries are symlinks into the source tree
+      hardlink  files are hardlinked, falling back to a copy across filesystems
+
+    A chart is staged once per run and reused by every render of it.
     """
-    staged = os.path.join(workdir, os.path.basename(chart_dir.rstrip("/")))
-    shutil.copytree(chart_dir, staged, dirs_exist_ok=True)
-    os.makedirs(os.path.join(staged, "charts"), exist_ok=True)
-    shutil.copy(library_tgz, os.path.join(staged, "charts"))
 
+    MODES = ("copy", "symlink", "hardlink")
+
+    def __init__(self, root, library, mode="symlink"):
+        self.root = root
+        self.library = library
+        self.mode = mode
+        self._staged = {}
+        self._lock = threading.Lock()
+
+    def stage(self, chart_dir):
+        chart_dir = os.path.abspath(chart_dir)
+        with self._lock:
+            entry = self._staged.setdefault(chart_dir, {"lock": threading.Lock(), "path": None})
+        # Staging one chart must not hold up staging another.
+        with entry["lock"]:
+            if entry["path"] is None:
+                entry["path"] = self._build(chart_dir)
+            return entry["path"]
+
+    def _build(self, chart_dir):
+        # Keyed on the full path: two charts with one basename must not collide.
+        tag = hashlib.sha256(chart_dir.encode()).hexdigest()[:12]
+        staged = os.path.join(self.root, tag, os.path.basename(chart_dir))
+        os.makedirs(staged)
+        charts = os.path.join(staged, "charts")
+        tgz = self.library.tgz()
+
+        if self.mode == "copy":
+            shutil.copytree(chart_dir, staged, dirs_exist_ok=True)
+            os.makedirs(charts, exist_ok=True)
+            shutil.copy(tgz, charts)
+            return staged
+
+        link = os.symlink if self.mode == "symlink" else self._hardlink
+        for name in os.listdir(chart_dir):
+            src = os.path.join(chart_dir, name)
+            if name == "charts":
+                continue
+            if self.mode == "symlink" or not os.path.isdir(src):
+                link(src, os.path.join(staged, name))
+            else:
+                shutil.copytree(src, os.path.join(staged, name), copy_function=self._hardlink)
+        os.makedirs(charts)
+        # Vendored dependencies, if a chart ever has any, ride along by link too.
+        if os.path.isdir(os.path.join(chart_dir, "charts")):
+            for name in os.listdir(os.path.join(chart_dir, "charts")):
+                link(os.path.join(chart_dir, "charts", name), os.path.join(charts, name))
+        link(tgz, os.path.join(charts, os.path.basename(tgz)))
+        return staged
+
+    def forget(self, chart_dir):
+        """Drop a chart's staging so the next stage() builds it afresh — after an
+        edit that added or removed one of its files, say."""
+        with self._lock:
+            entry = self._staged.pop(os.path.abspath(chart_dir), None)
+        if entry and entry["path"]:
+            shutil.rmtree(os.path.dirname(entry["path"]), ignore_errors=True)
+
+    @staticmethod
+    def _hardlink(src, dst):
+        try:
+            os.link(src, dst)
+        except OSError:
+            shutil.copy2(src, dst)  # different filesystem, or links not allowed
+        return dst
+
+
+def helm_template(staged, values=None, lint=True):
+    """Start `helm template` on a staged chart, with a profile's `values` set over
+    LINT_VALUES (or, with lint=False, `values` alone). Its stdout is the render,
+    to be read as it arrives; stderr goes to a file so a chatty helm cannot fill
+    the pipe and stall while stdout is still being read."""
     cmd = ["helm", "template", "release", staged]
-    for k, v in LINT_VALUES.items():
-        cmd += ["--set", f"{k}={v}"]
-    out = subprocess.run(cmd, capture_output=True, text=True)
-    shutil.rmtree(staged, ignore_errors=True)
-    if out.returncode != 0:
-        return None, out.stderr.strip()
-    return out.stdout, None
-
-
-def check(app, docs, fail):
-    kinds = {}
-    for d in docs:
-        kinds.setdefault(d["kind"], []).append(d)
-
-    # Game servers expose raw TCP/UDP through WireGuard and run no Caddy at all,
-    # so "has a Caddyfile" is a property of the shape, not a requirement.
-    has_caddy = any(
-        "Caddyfile" in (c.get("data") or {}) for c in kinds.get("ConfigMap", [])
-    )
+    for k, v in {**(LINT_VALUES if lint else {}), **(values or {})}.items():
+        # A value is a literal, but --set would read "alice,bob" as a second key.
+        literal = str(v).replace("\\", "\\\\").replace(",", "\\,")
+        cmd += ["--set", f"{k}={literal}"]
+    err = tempfile.TemporaryFile(mode="w+")
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=err, text=True)
+    proc.errfile = err
+    return proc
+
+
+def finish(proc):
+    """Wait for a helm_template() process. Returns None on success, else its stderr."""
+    proc.stdout.close()
+    code = proc.wait()
+    proc.errfile.seek(0)
+    err = proc.errfile.read().strip()
+    proc.errfile.close()
+    return None if code == 0 else err
+
+
+def render(staged, values=None):
+    """helm template a staged chart in one go. Returns the YAML text, or None and
+    helm's stderr."""
+    proc = helm_template(staged, values)
+    text = proc.stdout.read()
+    err = finish(proc)
+    return (None, err) if err is not None else (text, None)
+
+
+UMBRELLA = "catalog"
+UMBRELLA_SOURCE = f"# Source: {UMBRELLA}/charts/"
+
+
+def render_umbrella(session, profile, members):
+    """Render many charts under one profile in a single `helm template`, as the
+    subcharts of a throwaway umbrella chart. Returns {chart path: render text},
+    each text as that chart's own render would have been; {} when the umbrella
+    as a whole did not render, so the caller falls back to one helm per chart.
 
+    Starting helm, and having it load and unpack yolab-common, was a fixed cost
+    paid once per chart. Here it is paid once. Each subchart is the chart's
+    usual staging, so the one packaged library is shared by all of them, and
+    every value is scoped under the subchart's name (`ntfy.config.password`),
+    which is exactly where helm hands it to that chart as `.Values`.
+    """
+    # A fresh directory per render, removed after it: a later check_all on the
+    # same session (--watch) builds its own rather than tripping over this one,
+    # whose links point at stagings that may be gone by then.
+    os.makedirs(os.path.join(session.root, "umbrella"), exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f"{profile}-", dir=os.path.join(session.root, "umbrella"))
+    try:
+        return _render_umbrella(session, os.path.join(tmp, UMBRELLA), members)
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def _render_umbrella(session, umbrella, members):
+    os.makedirs(os.path.join(umbrella, "charts"))
+    with open(os.path.join(umbrella, "Chart.yaml"), "w") as f:
+        f.write(f"apiVersion: v2\nname: {UMBRELLA}\nversion: 0.0.0\n")
+    by_name, settings = {}, {}
+    for chart, values in members:
+        # Values and `# Source:` paths go by the chart's name, not its directory.
+        name = str(chart.meta.get("name") or chart.app)
+        if name in by_name or name == UMBRELLA:
+            continue  # rendered on its own instead
+        os.symlink(session.stager.stage(chart.path), os.path.join(umbrella, "charts", name))
+        by_name[name] = chart
+        for k, v in {**LINT_VALUES, **values}.items():
+            settings[f"{name}.{k}"] = v
+
+    proc = helm_template(umbrella, settings, lint=False)
+    streams = {name: [] for name in by_name}
+    split = True
+    for chunk in split_documents(proc.stdout):
+        if not chunk.strip():
+            continue
+        # "# Source: catalog/charts/ntfy/templates/app.yaml" is ntfy's, and so
+        # is ".../ntfy/charts/yolab-common/templates/..."; the header is
+        # rewritten to what ntfy rendered alone would have said.
+        name = chunk[len(UMBRELLA_SOURCE):].split("/", 1)[0]
+        if not chunk.startswith(UMBRELLA_SOURCE) or name not in streams:
+            split = False
+            continue  # drain, so helm can exit
+        streams[name].append("---\n# Source: " + chunk[len(UMBRELLA_SOURCE):])
+    if finish(proc) is not None or not split:
+        return {}
+    return {by_name[name].path: "".join(docs) for name, docs in streams.items()}
+
+
+def prerender(session, tasks, pool=None):
+    """Render every (chart, profile, values) task the cache cannot answer with
+    one umbrella per profile, into session.prerendered for check_chart to read.
+
+    A profile only one chart has stays with the per-chart path, as does every
+    chart of an umbrella that fails: one broken chart fails the whole umbrella,
+    and rendering each on its own is what pins the failure on the right chart.
+    """
+    groups = {}
+    for chart, profile, values in tasks:
+        if session.cache and session.cache.key(chart, values) in session.cache:
+            continue
+        groups.setdefault(profile, []).append((chart, values))
+    groups = {p: m for p, m in groups.items() if len(m) > 1}
+
+    def one(item):
+        profile, members = item
+        start = time.perf_counter()
+        texts = render_umbrella(session, profile, members)
+        return profile, texts, time.perf_counter() - start
+
+    results = map(one, groups.items()) if pool is None else pool.map(one, groups.items())
+    for profile, texts, seconds in results:
+        session.batch_seconds += seconds
+        for path, text in texts.items():
+            session.prerendered[(path, profile)] = text
+
+
+# libyaml's loader is several times faster than the pure-Python one, and is in
+# every pyyaml wheel and in nixpkgs' pyyaml; the fallback only covers a pyyaml
+# built without it.
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+KIND_RE = re.compile(r"^kind:[ \t]*[\"']?([A-Za-z0-9]+)", re.M)
+
+
+def split_documents(lines):
+    """Each YAML document's text, from an iterable of lines, split on `---`.
+
+    Reads one line at a time, so a render is parsed as helm writes it rather
+    than after it has all been buffered. A `---` inside a block scalar is always
+    indented, so a line starting with one is always a document boundary.
+    """
+    buf = []
+    for line in lines:
+        if line.startswith("---") and line[3:4] in ("", "\n", "\r", " ", "\t"):
+            if buf:
+                yield "".join(buf)
+            rest = line[3:].lstrip(" \t")
+            buf = [rest] if rest.strip() else []
+        else:
+            buf.append(line)
+    if buf:
+        yield "".join(buf)
+
+
+def parse_document(text, kinds=None):
+    """One document, or None when it is empty or (given `kinds`) of a kind nothing
+    reads. The kind is read from the header line alone, so a skipped document —
+    a CRD, a large ConfigMap no rule looks at — is never parsed at all."""
+    if kinds is not None:
+        m = KIND_RE.search(text)
+        if m and m.group(1) not in kinds:
+            return None
+    return yaml.load(text, Loader=YAML_LOADER)
+
+
+NAME_RE = re.compile(r"^metadata:[ \t]*\n(?:[ \t]+.*\n)*?[ \t]+name:[ \t]*[\"']?([^\"'\s]+)", re.M)
+SOURCE_RE = re.compile(r"^# Source: (\S+)", re.M)
+
+
+class RenderSizes:
+    """How big a render is, measured on the document text as it streams past:
+    every object's size, and the whole manifest's both raw and gzipped the way
+    helm compresses a release before storing it.
+
+    The text, not the parse, because most kinds are never parsed (a large
+    ConfigMap is exactly the kind no rule reads), and YAML's size is within a
+    few percent of the JSON the API server and etcd keep.
+    """
+
+    def __init__(self):
+        self.objects = []  # (bytes, kind, name, source)
+        self.manifest = 0
+        self._gzip = zlib.compressobj(9, zlib.DEFLATED, 31)  # gzip.BestCompression
+        self._packed = 0
+        self._done = None
+
+    def add(self, chunk):
+        data = chunk.encode()
+        self.manifest += len(data)
+        self._packed += len(self._gzip.compress(data))
+        kind = KIND_RE.search(chunk)
+        if not kind:
+            return
+        name, source = NAME_RE.search(chunk), SOURCE_RE.search(chunk)
+        # The manifest keeps helm's `# Source:` comment; the object does not.
+        n = len(data) - (len(source.group(0).encode()) + 1 if source else 0)
+        self.objects.append((n, kind.group(1), name.group(1) if name else "?",
+                             source.group(1) if source else "?"))
+
+    @property
+    def packed(self):
+        if self._done is None:
+            self._done = self._packed + len(self._gzip.flush())
+        return self._done
+
+
+def tee_lines(lines, f):
+    for line in lines:
+        f.write(line)
+        yield line
+
+
+def load_documents(lines, kinds=None):
+    return [d for d in (parse_document(t, kinds) for t in split_documents(lines)) if d]
+
+
+class Pod:
+    """One pod template (a Deployment's or a Job's), with its containers sorted once."""
+
+    def __init__(self, kind, name, doc):
+        self.kind = kind
+        self.name = name
+        self.spec = doc["spec"]["template"]["spec"]
+        self.labels = (doc["spec"]["template"].get("metadata") or {}).get("labels") or {}
+        self.containers = self.spec.get("containers") or []
+        self.inits = self.spec.get("initContainers") or []
+        self.all = self.containers + self.inits
+        self.volumes = {v["name"] for v in self.spec.get("volumes") or []}
+        self.replicas = doc["spec"].get("replicas", 1)
+        annotations = (doc.get("metadata") or {}).get("annotations") or {}
+        self.hooks = {h.strip() for h in annotations.get("helm.sh/hook", "").split(",") if h.strip()}
+
+
+class Index:
+    """A chart's rendered documents, walked once and shared by every rule."""
+
+    def __init__(self, docs):
+        self.kinds = {}
+        for d in docs:
+            self.kinds.setdefault(d["kind"], []).append(d)
+
+        self.deploys = [Pod("Deployment", d["metadata"]["name"], d)
+                        for d in self.kinds.get("Deployment", [])]
+        self.jobs = [Pod("Job", d["metadata"]["name"], d) for d in self.kinds.get("Job", [])]
+        self.services = {s["metadata"]["name"]: s for s in self.kinds.get("Service", [])}
+        self.secrets = self.kinds.get("Secret", [])
+        self.pvcs = self.kinds.get("PersistentVolumeClaim", [])
+        self.configmaps = self.kinds.get("ConfigMap", [])
+
+        # Game servers expose raw TCP/UDP through WireGuard and run no Caddy at all,
+        # so "has a Caddyfile" is a property of the shape, not a requirement.
+        self.caddyfile = next(
+            (c["data"]["Caddyfile"] for c in self.configmaps
+             if "Caddyfile" in (c.get("data") or {})),
+            None,
+        )
+
+        # The tunnel pod is wherever wg-register runs — usually a Deployment named
+        # "gateway", but some charts fold the gateway containers into their own.
+        self.tunnel_pods = [
+            p for p in self.deploys if any(c["name"] == "wg-register" for c in p.inits)
+        ]
+        self.gateway = self.tunnel_pods[0] if len(self.tunnel_pods) == 1 else None
+        self.gateway_containers = (
+            {c["name"]: c for c in self.gateway.containers} if self.gateway else {}
+        )
+
+        # Every container of every workload, as (pod, container): what the image
+        # rules check, and what the image inventory is built from.
+        self.images = [(p, c) for p in self.deploys + self.jobs for c in p.all]
+
+        # One serialisation per container, not one per variable looked for.
+        self.reads_yolab = set()
+        for p in self.deploys:
+            for c in p.containers:
+                text = json.dumps(c)
+                if "YOLAB_FQDN" in text or "YOLAB_URL" in text:
+                    self.reads_yolab.add(id(c))
+
+
+# (name, function) in the order they run, which is the order failures are
+# reported in. A rule reads the shared Index and reports through `fail`; one that
+# returns False leaves nothing for the rules after it to judge.
+RULES = []
+# Every kind some rule reads. Documents of any other kind are skipped unparsed.
+RULE_KINDS = set()
+
+
+def rule(name, kinds):
+    def register(fn):
+        RULES.append((name, fn))
+        RULE_KINDS.update(kinds)
+        return fn
+    return register
+
+
+@rule("counts", kinds=("PersistentVolumeClaim", "Job"))
+def rule_counts(app, ix, fail):
     for kind, want in (("PersistentVolumeClaim", 1), ("Job", 1)):
-        got = len(kinds.get(kind, []))
+        got = len(ix.kinds.get(kind, []))
         if got != want:
             fail(app, f"expected {want} {kind}, got {got}")
 
+
+@rule("uninstall-hook", kinds=("Job",))
+def rule_uninstall_hook(app, ix, fail):
     # The uninstall hook must run before the release's resources are torn down;
     # as a normal manifest it would be deleted along with everything else and the
     # tunnel would leak.
-    job = (kinds.get("Job") or [{}])[0]
+    job = (ix.kinds.get("Job") or [{}])[0]
     if job.get("metadata", {}).get("annotations", {}).get("helm.sh/hook") != "pre-delete":
         fail(app, "uninstall Job is not a pre-delete hook")
 
-    deploys = {d["metadata"]["name"]: d for d in kinds.get("Deployment", [])}
 
-    # The tunnel pod is wherever wg-register runs — usually a Deployment named
-    # "gateway", but some charts fold the gateway containers into their own.
-    tunnel_pods = [
-        (n, d["spec"]["template"]["spec"])
-        for n, d in deploys.items()
-        if any(
-            c["name"] == "wg-register"
-            for c in d["spec"]["template"]["spec"].get("initContainers") or []
-        )
-    ]
-    if len(tunnel_pods) != 1:
-        fail(app, f"expected exactly one pod running wg-register, found {len(tunnel_pods)}")
-        return
-    gw_name, gw = tunnel_pods[0]
-    conts = {c["name"]: c for c in gw.get("containers") or []}
+@rule("gateway", kinds=("Deployment", "ConfigMap"))
+def rule_gateway(app, ix, fail):
+    if ix.gateway is None:
+        fail(app, f"expected exactly one pod running wg-register, found {len(ix.tunnel_pods)}")
+        return False
+    conts = ix.gateway_containers
 
-    for req in GATEWAY_CONTAINERS if has_caddy else ("wireguard",):
+    for req in GATEWAY_CONTAINERS if ix.caddyfile is not None else ("wireguard",):
         if req not in conts:
-            fail(app, f"pod {gw_name} missing {req} container")
+            fail(app, f"pod {ix.gateway.name} missing {req} container")
 
     if conts.get("wireguard", {}).get("securityContext", {}).get("privileged") is not True:
         fail(app, "wireguard sidecar is not privileged (the tunnel cannot come up)")
@@ -159,108 +922,120 @@ def check(app, docs, fail):
         if name != "wireguard" and c.get("securityContext", {}).get("privileged"):
             fail(app, f"container {name} is privileged but is not the tunnel sidecar")
 
-    for dname, d in deploys.items():
-        spec = d["spec"]["template"]["spec"]
-
-        # An app that needs its own public URL learns it by sourcing /yolab/env,
-        # which something has to write first: wg-register in the gateway pod, or
-        # yolab-env in a pod of its own. Reference the variable without both the
-        # mount and a writer and the app starts with it empty — which for these
-        # apps means a permanent install record built around a blank hostname,
-        # not a crash. Nothing else in the rendered YAML would show it.
-        inits = {c["name"]: c for c in spec.get("initContainers") or []}
-        writes_yolab_env = any(n in inits for n in ("wg-register", "yolab-env"))
-        for c in spec.get("containers") or []:
-            uses = "YOLAB_FQDN" in json.dumps(c) or "YOLAB_URL" in json.dumps(c)
-            if not uses:
+
+@rule("yolab-env", kinds=("Deployment",))
+def rule_yolab_env(app, ix, fail):
+    # An app that needs its own public URL learns it by sourcing /yolab/env,
+    # which something has to write first: wg-register in the gateway pod, or
+    # yolab-env in a pod of its own. Reference the variable without both the
+    # mount and a writer and the app starts with it empty — which for these
+    # apps means a permanent install record built around a blank hostname,
+    # not a crash. Nothing else in the rendered YAML would show it.
+    for p in ix.deploys:
+        writes_yolab_env = any(c["name"] in ("wg-register", "yolab-env") for c in p.inits)
+        for c in p.containers:
+            if id(c) not in ix.reads_yolab:
                 continue
             if not any(m["mountPath"] == "/yolab" for m in c.get("volumeMounts") or []):
-                fail(app, f"pod {dname}: container {c['name']} reads YOLAB_* but does "
+                fail(app, f"pod {p.name}: container {c['name']} reads YOLAB_* but does "
                           f"not mount /yolab")
             if not writes_yolab_env:
-                fail(app, f"pod {dname}: container {c['name']} reads YOLAB_* but no init "
+                fail(app, f"pod {p.name}: container {c['name']} reads YOLAB_* but no init "
                           f"container writes /yolab/env (needs wg-register or yolab-env)")
 
-        # Several containers start with a `sh -c` script that sources /yolab/env,
-        # exports the app's own-URL variables, then execs the image's entrypoint.
-        # Those scripts carry nested quoting (Linkwarden's reproduces a CMD that
-        # itself contains an `sh -c "…"`), and a quoting mistake renders as
-        # perfectly valid YAML and crashloops the container. Parse them.
-        for c in (spec.get("containers") or []) + (spec.get("initContainers") or []):
+
+@rule("shell", kinds=("Deployment",))
+def rule_shell(app, ix, fail):
+    # Several containers start with a `sh -c` script that sources /yolab/env,
+    # exports the app's own-URL variables, then execs the image's entrypoint.
+    # Those scripts carry nested quoting (Linkwarden's reproduces a CMD that
+    # itself contains an `sh -c "…"`), and a quoting mistake renders as
+    # perfectly valid YAML and crashloops the container. Parse them.
+    for p in ix.deploys:
+        for c in p.all:
             cmd = c.get("command") or []
             if len(cmd) >= 3 and cmd[0] in ("/bin/sh", "sh", "/bin/bash") and cmd[1] == "-c":
-                syntax = subprocess.run(
-                    ["sh", "-n"], input=cmd[2], capture_output=True, text=True
-                )
-                if syntax.returncode != 0:
-                    fail(app, f"pod {dname}: container {c['name']} command is not valid "
-                              f"shell: {syntax.stderr.strip()}")
+                fail.script(app, f"pod {p.name}: container {c['name']}", cmd[2])
+
 
-        # Containers in a pod share one network namespace, so two claiming the
-        # same port means whichever starts second fails to bind — silently.
+@rule("ports", kinds=("Deployment",))
+def rule_ports(app, ix, fail):
+    # Containers in a pod share one network namespace, so two claiming the
+    # same port means whichever starts second fails to bind — silently.
+    for p in ix.deploys:
         seen = {}
-        for c in spec.get("containers") or []:
-            for p in c.get("ports") or []:
-                cp = p["containerPort"]
+        for c in p.containers:
+            for port in c.get("ports") or []:
+                cp = port["containerPort"]
                 if cp in seen:
-                    fail(app, f"pod {dname}: containerPort {cp} claimed by both "
+                    fail(app, f"pod {p.name}: containerPort {cp} claimed by both "
                               f"{seen[cp]} and {c['name']}")
                 seen[cp] = c["name"]
 
-        vols = {v["name"] for v in spec.get("volumes") or []}
-        for c in (spec.get("containers") or []) + (spec.get("initContainers") or []):
+
+@rule("volumes", kinds=("Deployment",))
+def rule_volumes(app, ix, fail):
+    for p in ix.deploys:
+        for c in p.all:
             for m in c.get("volumeMounts") or []:
-                if m["name"] not in vols:
-                    fail(app, f"pod {dname}: container {c['name']} mounts undeclared "
+                if m["name"] not in p.volumes:
+                    fail(app, f"pod {p.name}: container {c['name']} mounts undeclared "
                               f"volume {m['name']}")
 
+
+@rule("upstreams", kinds=("ConfigMap", "Service", "Deployment"))
+def rule_upstreams(app, ix, fail):
     # Every Caddy upstream must resolve to this pod or to a Service that exists.
-    if has_caddy:
-        caddyfile = next(
-            c["data"]["Caddyfile"] for c in kinds["ConfigMap"] if "Caddyfile" in (c.get("data") or {})
-        )
-        ups = re.findall(r"reverse_proxy\s+(\S+)", caddyfile)
-        if not ups:
-            fail(app, "Caddyfile has no reverse_proxy directive")
-        svcs = {s["metadata"]["name"]: s for s in kinds.get("Service", [])}
-        for up in ups:
-            # Helm does not re-render values, so a `{{ … }}` left in a value is
-            # emitted literally and Caddy proxies to a host that cannot resolve.
-            if "{{" in up or "}}" in up:
-                fail(app, f"upstream {up!r} still contains an unrendered template expression")
-                continue
-            host, _, port = up.rpartition(":")
-            if host == "localhost":
-                if not [n for n in conts if n not in GATEWAY_CONTAINERS]:
-                    fail(app, f"upstream {up} is localhost but no app container runs in {gw_name}")
-                if port in ("80", "443"):
-                    fail(app, f"upstream port {port} collides with Caddy in the same pod")
-            elif host not in svcs:
-                fail(app, f"upstream {up} names Service '{host}' which the chart does not create")
-            else:
-                exposed = {str(p["port"]) for p in svcs[host]["spec"]["ports"]}
-                if port not in exposed:
-                    fail(app, f"upstream {up}: Service {host} exposes {sorted(exposed)}, not {port}")
+    if ix.caddyfile is None:
+        return
+    ups = re.findall(r"reverse_proxy\s+(\S+)", ix.caddyfile)
+    if not ups:
+        fail(app, "Caddyfile has no reverse_proxy directive")
+    for up in ups:
+        # Helm does not re-render values, so a `{{ … }}` left in a value is
+        # emitted literally and Caddy proxies to a host that cannot resolve.
+        if "{{" in up or "}}" in up:
+            fail(app, f"upstream {up!r} still contains an unrendered template expression")
+            continue
+        host, _, port = up.rpartition(":")
+        if host == "localhost":
+            if not [n for n in ix.gateway_containers if n not in GATEWAY_CONTAINERS]:
+                fail(app, f"upstream {up} is localhost but no app container runs in "
+                          f"{ix.gateway.name}")
+            if port in ("80", "443"):
+                fail(app, f"upstream port {port} collides with Caddy in the same pod")
+        elif host not in ix.services:
+            fail(app, f"upstream {up} names Service '{host}' which the chart does not create")
+        else:
+            exposed = {str(p["port"]) for p in ix.services[host]["spec"]["ports"]}
+            if port not in exposed:
+                fail(app, f"upstream {up}: Service {host} exposes {sorted(exposed)}, not {port}")
 
-    pod_labels = [
-        tuple(sorted(d["spec"]["template"]["metadata"]["labels"].items()))
-        for d in deploys.values()
-    ]
-    for s in kinds.get("Service", []):
+
+@rule("selectors", kinds=("Service", "Deployment"))
+def rule_selectors(app, ix, fail):
+    pod_labels = [tuple(sorted(p.labels.items())) for p in ix.deploys]
+    for s in ix.kinds.get("Service", []):
         sel = tuple(sorted(s["spec"]["selector"].items()))
         if not any(all(kv in lbl for kv in sel) for lbl in pod_labels):
             fail(app, f"Service {s['metadata']['name']} selector {dict(sel)} matches no pod")
 
-    for d in list(deploys.values()) + kinds.get("Job", []):
-        spec = d["spec"]["template"]["spec"]
-        for c in (spec.get("containers") or []) + (spec.get("initContainers") or []):
-            # An unpinned tag means two nodes can run different code from the same
-            # release, and a restore can never reproduce what wrote the data.
-            if "@sha256:" not in c["image"]:
-                fail(app, f"image not digest-pinned: {c['image']}")
-            if c.get("imagePullPolicy") != "IfNotPresent":
-                fail(app, f"{c['name']}: imagePullPolicy is {c.get('imagePullPolicy')}")
 
+@rule("images", kinds=("Deployment", "Job"))
+def rule_images(app, ix, fail):
+    for _, c in ix.images:
+        # An unpinned tag means two nodes can run different code from the same
+        # release, and a restore can never reproduce what wrote the data.
+        if "@sha256:" not in c["image"]:
+            fail(app, f"image not digest-pinned: {c['image']}")
+        if c.get("imagePullPolicy") != "IfNotPresent":
+            fail(app, f"{c['name']}: imagePullPolicy is {c.get('imagePullPolicy')}")
+
+
+@rule("account-token", kinds=("Deployment", "Job"))
+def rule_account_token(app, ix, fail):
+    for p in ix.deploys + ix.jobs:
+        for c in p.all:
             for e in c.get("env") or []:
                 if e.get("name") != "ACCOUNT_TOKEN":
                     continue
@@ -269,60 +1044,1598 @@ def check(app, docs, fail):
                 if "value" in e:
                     fail(app, f"ACCOUNT_TOKEN passed by value in {c['name']}")
 
+
+@rule("secrets", kinds=("Secret",))
+def rule_secrets(app, ix, fail):
     # An empty credential is worse than a missing one: the app starts, and the
     # blank password is accepted.
-    for s in kinds.get("Secret", []):
+    for s in ix.secrets:
         for k, v in (s.get("stringData") or {}).items():
             if v == "":
                 fail(app, f"Secret key {k} rendered empty")
 
 
-def main(argv):
-    chart_dirs = argv[1:] or sorted(
-        d for d in glob.glob(os.path.join(HERE, "*/"))
-        if os.path.isfile(os.path.join(d, "Chart.yaml"))
-        and "type: library" not in open(os.path.join(d, "Chart.yaml")).read()
-    )
-    if not chart_dirs:
-        print("no charts found", file=sys.stderr)
-        return 1
+def check(app, docs, fail, timings=None):
+    """Index the chart's documents once, then run every rule over the index.
 
-    lib_version = chart_field(open(os.path.join(LIBRARY, "Chart.yaml")).read(), "version")
-    fail = Failures()
+    With `timings`, each rule's wall time (and the indexing's, as "index") is
+    added to it by name, so a slow rule shows up as itself rather than as a slow
+    chart. Returns the Index.
+    """
+    start = time.perf_counter()
+    ix = Index(docs)
+    if timings is not None:
+        timings["index"] = timings.get("index", 0.0) + time.perf_counter() - start
+    for name, fn in RULES:
+        start = time.perf_counter()
+        verdict = fn(app, ix, fail)
+        if timings is not None:
+            timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+        if verdict is False:
+            break
+    return ix
 
-    with tempfile.TemporaryDirectory() as tmp:
-        subprocess.run(
-            ["helm", "package", LIBRARY, "--version", lib_version, "--destination", tmp],
-            check=True, capture_output=True,
-        )
-        library_tgz = glob.glob(os.path.join(tmp, "yolab-common-*.tgz"))[0]
 
-        for chart_dir in chart_dirs:
-            app = os.path.basename(chart_dir.rstrip("/"))
-            text = open(os.path.join(chart_dir, "Chart.yaml")).read()
+class ChartRun:
+    """One chart's outcome: its failures, and where its time went."""
+
+    def __init__(self, app, profile, shell):
+        # Failures under any profile but the default name it, as `app[profile]`.
+        self.app = app if profile == "default" else f"{app}[{profile}]"
+        self.chart = app
+        self.profile = profile
+        self.fail = Failures(shell)
+        self.images = []  # (pod, container, image) for every container rendered
+        self.resources = None  # chart_resources(), once the chart has rendered
+        self.startup = None  # chart_startup(), likewise
+        self.sizes = None  # RenderSizes, likewise
+        self.phases = {}  # phase -> seconds, in the order the phases ran
+        self.rules = {}  # rule -> seconds
+        self.cached = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    @property
+    def seconds(self):
+        return sum(self.phases.values())
+
+
+def check_chart(chart, profile, values, library, cache, shell, stager, prerendered=None,
+                measure_sizes=False):
+    """Render and check one chart under one value profile into a ChartRun of its
+    own, so renders checked in parallel never interleave their messages. Shell
+    scripts are only queued on `shell`; the caller resolves them once every
+    chart has been seen. `prerendered` is the render's text when an umbrella
+    render already produced it. Document sizes are only measured, into
+    `run.sizes`, with `measure_sizes` (--sizes)."""
+    lib_version = library.version
+    run = ChartRun(chart.app, profile, shell)
+    app, fail = run.app, run.fail
+
+    # A chart pinned to a library version other than the one in this tree
+    # is rendered against something that is not what would ship with it.
+    # A property of the chart, not of a render: reported once.
+    if profile == "default" and chart.wants_library not in (None, lib_version):
+        fail(app, f"depends on yolab-common {chart.wants_library}, "
+                  f"but this tree has {lib_version}")
 
-            # A chart pinned to a library version other than the one in this tree
-            # is rendered against something that is not what would ship with it.
-            declared = re.search(r"- name: yolab-common\s*\n\s*version:\s*\"?([^\"\n]+)", text)
-            if declared and declared.group(1).strip() != lib_version:
-                fail(app, f"depends on yolab-common {declared.group(1).strip()}, "
-                          f"but this tree has {lib_version}")
+    with run.phase("cache"):
+        key = cache.key(chart, values) if cache else None
+        cached = cache.open(key) if cache else None
+    run.cached = cached is not None
 
-            rendered, err = render(chart_dir, library_tgz, tmp)
-            if rendered is None:
+    with contextlib.ExitStack() as stack:
+        if cached:
+            source, lines = "cache", stack.enter_context(cached)
+        elif prerendered is not None:
+            proc = None
+            source, lines = "umbrella", iter(prerendered.splitlines(keepends=True))
+            if cache:
+                tee = stack.enter_context(cache.writer(key))
+                lines = tee_lines(lines, tee)
+        else:
+            # Waiting on the one `helm package` counts against whoever waited for it.
+            with run.phase("package"):
+                library.tgz()
+            with run.phase("stage"):
+                staged = stager.stage(chart.path)
+            proc = helm_template(staged, values)
+            source, lines = "template", proc.stdout
+            if cache:
+                tee = stack.enter_context(cache.writer(key))
+                lines = tee_lines(lines, tee)
+
+        # Reading the next document is time spent waiting on helm (or the disk);
+        # turning it into objects is parsing. Both happen as the render streams.
+        docs, invalid = [], None
+        sizes = RenderSizes() if measure_sizes else None
+        chunks = split_documents(lines)
+        while True:
+            with run.phase(source):
+                chunk = next(chunks, None)
+            if chunk is None:
+                break
+            if invalid:
+                continue  # drain, so helm can exit
+            if sizes is not None:
+                with run.phase("size"):
+                    sizes.add(chunk)
+            with run.phase("parse"):
+                try:
+                    doc = parse_document(chunk, RULE_KINDS)
+                except yaml.YAMLError as e:
+                    invalid = e
+                    continue
+            if doc:
+                docs.append(doc)
+
+        if not cached:
+            err = None
+            if proc is not None:
+                with run.phase("template"):
+                    err = finish(proc)
+            if err is not None:
                 fail(app, f"helm template failed: {err.splitlines()[-1] if err else 'unknown'}")
+                return run
+            if cache:
+                tee.commit()
+    if invalid:
+        fail(app, f"rendered invalid YAML: {invalid}")
+        return run
+    with run.phase("rules"):
+        ix = check(app, docs, fail, run.rules)
+    run.images = [(p.name, c["name"], c["image"]) for p, c in ix.images]
+    try:
+        run.resources = chart_resources(ix)
+    except ValueError as e:
+        # The API server refuses the object; --capacity leaves the chart out.
+        fail(app, f"resources: {e}")
+    run.startup = chart_startup(ix)
+    run.sizes = sizes
+    return run
+
+
+class Session:
+    """What rendering needs before it renders anything: the packaged library, the
+    staging root and the render cache. A normal run builds one and uses it once;
+    --watch keeps it between edits and replaces it only when the library changes.
+    """
+
+    def __init__(self, args, root, lib_version, library_path=LIBRARY):
+        self.jobs = args.jobs
+        self.values = args.values
+        self.root = root
+        os.makedirs(root)
+        self.library = Library(library_path, lib_version, root)
+        self.cache = None
+        if not args.no_cache:
+            self.cache = RenderCache(
+                args.cache_dir, args.cache_size * 1024 * 1024, self.library, helm_version(),
+            )
+        # Each chart is staged into a directory of its own under root, once, and
+        # every profile renders from that same staging.
+        self.stager = Stager(os.path.join(root, "staged"), self.library, args.staging)
+        self.umbrella = args.umbrella
+        self.sizes = bool(args.sizes)
+        self.prerendered = {}  # (chart path, profile) -> render text
+        self.batch_seconds = 0.0
+
+
+def shell_syntax(args):
+    if args.no_cache:
+        return ShellSyntax()
+    return ShellSyntax(os.path.join(args.cache_dir, "shell-syntax.json"))
+
+
+def check_all(session, shell, charts, pool=None):
+    """Render and check `charts` under each of their value profiles, on `pool`
+    or (without one) on this thread. Returns {chart path: [ChartRun per profile]}
+    in chart order, with shell verdicts resolved, and the time the shell stage
+    took."""
+    # One task per (chart, profile), not per chart: a chart with four profiles
+    # renders on four workers at once instead of four times in a row on one, so
+    # the extra profiles mostly fill cores that would otherwise sit idle.
+    tasks = [(chart, name, values) for chart in charts
+             for name, values in chart.profiles(session.values)]
+
+    if session.umbrella:
+        prerender(session, tasks, pool)
+
+    def worker(task):
+        chart, profile, values = task
+        return check_chart(chart, profile, values, session.library, session.cache, shell,
+                           session.stager, session.prerendered.pop((chart.path, profile), None),
+                           session.sizes)
+
+    if pool is None:
+        # On this thread, which is the only one --profile can see.
+        runs = [worker(t) for t in tasks]
+    else:
+        # map() yields in submission order, so the report is identical to a
+        # serial run whatever order the renders finish in.
+        runs = list(pool.map(worker, tasks))
+    start = time.perf_counter()
+    shell.run(session.jobs)
+    shell_seconds = time.perf_counter() - start
+
+    by_chart = {chart.path: [] for chart in charts}
+    for (chart, *_), run in zip(tasks, runs):
+        run.fail.resolve(shell)
+        by_chart[chart.path].append(run)
+    return by_chart, shell_seconds
+
+
+def run_catalog(args, charts, lib_version):
+    """Render and check every chart under each of its value profiles. Returns the
+    ChartRuns in chart order (profiles in order within a chart), and the run-wide
+    costs no single chart owns."""
+    with tempfile.TemporaryDirectory() as tmp:
+        session = Session(args, os.path.join(tmp, "run"), lib_version)
+        shell = shell_syntax(args)
+        # helm does the work in a subprocess, so threads are enough to keep every
+        # core busy.
+        with contextlib.ExitStack() as stack:
+            pool = None
+            if args.jobs > 1:
+                pool = stack.enter_context(ThreadPoolExecutor(max_workers=args.jobs))
+            by_chart, shell_seconds = check_all(session, shell, charts, pool)
+        if session.cache:
+            session.cache.evict()
+    runs = [run for runs in by_chart.values() for run in runs]
+    totals = {"package": session.library.seconds, "shell": shell_seconds}
+    if session.umbrella:
+        totals["umbrella"] = session.batch_seconds
+    return runs, totals
+
+
+class Watcher:
+    """Files changed under some directories, as they change.
+
+    inotify where there is one, through libc, so a save is seen the moment the
+    editor closes the file. Anywhere else (macOS) it falls back to comparing
+    mtimes every half second, which is slower to notice but sees the same edits.
+    """
+
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_CREATE = 0x100
+    IN_DELETE = 0x200
+    IN_IGNORED = 0x8000
+    IN_ISDIR = 0x40000000
+    MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+    POLL_SECONDS = 0.5
+
+    def __init__(self, roots):
+        self.roots = roots
+        self._fd = -1
+        try:
+            self._libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            self._fd = self._libc.inotify_init1(os.O_CLOEXEC | os.O_NONBLOCK)
+        except (OSError, AttributeError):
+            pass  # no libc to speak of, or one without inotify
+        self._wds = {}
+        if self._fd >= 0:
+            for root in roots:
+                self._watch_tree(root)
+        else:
+            self._seen = self._scan()
+
+    @staticmethod
+    def ignored(name):
+        # Editor droppings: swap and backup files, vim's write probe, dotfiles.
+        return (name.startswith(".") or name.endswith(("~", ".swp", ".swx"))
+                or name in ("4913", "__pycache__"))
+
+    def _walk(self, root):
+        for path, dirs, files in os.walk(root):
+            dirs[:] = [d for d in dirs if not self.ignored(d)]
+            yield path, [f for f in files if not self.ignored(f)]
+
+    def _watch_tree(self, root):
+        added = set()
+        for path, files in self._walk(root):
+            wd = self._libc.inotify_add_watch(self._fd, path.encode(), self.MASK)
+            if wd >= 0:
+                self._wds[wd] = path
+            added.update(os.path.join(path, f) for f in files)
+        return added
+
+    def _scan(self):
+        seen = {}
+        for root in self.roots:
+            # The directories right under a root too, by existence alone: a chart
+            # directory created under the catalog is news before anything in it is.
+            try:
+                entries = os.listdir(root)
+            except FileNotFoundError:
+                entries = []  # a chart deleted while watching
+            for d in entries:
+                if not self.ignored(d) and os.path.isdir(os.path.join(root, d)):
+                    seen[os.path.join(root, d)] = "dir"
+            for path, files in self._walk(root):
+                for f in files:
+                    full = os.path.join(path, f)
+                    try:
+                        st = os.stat(full)
+                    except FileNotFoundError:
+                        continue
+                    seen[full] = (st.st_mtime_ns, st.st_size)
+        return seen
+
+    def _read(self, timeout):
+        if self._fd < 0:
+            time.sleep(self.POLL_SECONDS if timeout is None else timeout)
+            now = self._scan()
+            changed = {p for p in now.keys() | self._seen.keys()
+                       if now.get(p) != self._seen.get(p)}
+            self._seen = now
+            return changed
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+        data = os.read(self._fd, 64 * 1024)
+        changed = set()
+        i = 0
+        while i < len(data):
+            wd, mask, _, length = struct.unpack_from("iIII", data, i)
+            name = data[i + 16:i + 16 + length].rstrip(b"\0").decode(errors="replace")
+            i += 16 + length
+            base = self._wds.get(wd)
+            if mask & self.IN_IGNORED:
+                self._wds.pop(wd, None)  # its directory is gone
+            if base is None or self.ignored(name):
                 continue
+            path = os.path.join(base, name)
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                # Whatever landed in it before the watch existed counts as new.
+                changed |= self._watch_tree(path)
+            changed.add(path)
+        return changed
+
+    def wait(self, settle=0.05):
+        """Block until something changes, then until nothing has for `settle`
+        seconds — an editor's save is often several events — and return every
+        path touched."""
+        changed = set()
+        while not changed:
+            changed = self._read(None)
+        while True:
+            more = self._read(settle)
+            if not more:
+                return changed
+            changed |= more
+
+
+def chart_dir_of(path, root=HERE):
+    """The chart directory directly under `root` that `path` is or is inside,
+    once it has a Chart.yaml; else None."""
+    rel = os.path.relpath(path, root)
+    if rel == os.curdir or rel.startswith(os.pardir + os.sep) or rel == os.pardir:
+        return None
+    top = os.path.join(root, rel.split(os.sep, 1)[0])
+    return top if os.path.isfile(os.path.join(top, "Chart.yaml")) else None
+
+
+def watch(args, charts, lib_version):
+    """--watch: check every chart once, then after each edit re-check only the
+    charts it can affect, printing their failures as they stand.
+
+    The packaged library, every chart's staging, the render cache and the last
+    result for every chart stay in memory between edits. A change inside a chart
+    re-stages and re-renders that chart alone; a change to a library template
+    re-packages the library once and re-checks the charts using a helper whose
+    definition actually changed. Returns True when check_charts.py itself was
+    edited, so the caller can restart with the new rules.
+    """
+    chart_dirs = [chart.path for chart in charts]
+    watcher = Watcher(sorted({HERE, *chart_dirs}))
+    shell = shell_syntax(args)
+    templates_dir = os.path.join(LIBRARY, "templates")
+
+    def templates():
+        return {p: open(p).read() for p in glob.glob(os.path.join(templates_dir, "*"))}
+
+    with tempfile.TemporaryDirectory() as tmp, \
+            ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        generation = 0
+        session = Session(args, os.path.join(tmp, str(generation)), lib_version)
+        tpls = templates()
+        results = {}
+        todo = list(chart_dirs)
+        while True:
+            start = time.perf_counter()
+            if todo:
+                # Read afresh: the edit may have been to Chart.yaml.
+                by_chart, _ = check_all(session, shell, [Chart(d) for d in todo], pool)
+                results.update(by_chart)
+                if session.cache:
+                    session.cache.evict()
+            took = (time.perf_counter() - start) * 1000
+            names = ", ".join(os.path.basename(d) for d in todo)
+            if len(todo) > 8:
+                names = f"{len(todo)} charts"
+            print(f"[{time.strftime('%H:%M:%S')}] checked {names or 'nothing'} in {took:.0f}ms")
+            for d in todo:
+                for run in results[d]:
+                    for f in run.fail.items:
+                        print("FAIL " + f)
+            total = sum(len(r.fail) for d in chart_dirs for r in results.get(d, []))
+            print(f"FAILURES: {total} in the catalog" if total else "all assertions passed",
+                  flush=True)
+
             try:
-                docs = [d for d in yaml.safe_load_all(rendered) if d]
-            except yaml.YAMLError as e:
-                fail(app, f"rendered invalid YAML: {e}")
+                changed = watcher.wait()
+            except KeyboardInterrupt:
+                return False
+            if os.path.abspath(__file__) in changed:
+                return True
+
+            todo = set()
+            library_changed = False
+            for path in changed:
+                if path.startswith(LIBRARY + os.sep):
+                    library_changed = True
+                    if not path.startswith(templates_dir + os.sep):
+                        # The library's Chart.yaml: its version, and so everything.
+                        todo.update(chart_dirs)
+                    continue
+                owner = next((d for d in chart_dirs
+                              if path == d or path.startswith(d + os.sep)), None)
+                if owner is None and not args.charts:
+                    # A chart directory added while watching: the directory
+                    # itself, or whatever in it is seen first.
+                    owner = chart_dir_of(path)
+                    if owner is not None:
+                        chart_dirs = sorted(chart_dirs + [owner])
+                if owner is not None:
+                    todo.add(owner)
+
+            if library_changed:
+                now = templates()
+                dirty = set()
+                for p in tpls.keys() | now.keys():
+                    dirty |= changed_helpers(tpls.get(p, ""), now.get(p, ""))
+                tpls = now
+                todo.update(charts_using(chart_dirs, dirty))
+                lib_version = Chart(LIBRARY).version
+                # A fresh session packages the edited library once, on the first
+                # render that needs it, and every chart re-checked shares it.
+                shutil.rmtree(session.root, ignore_errors=True)
+                generation += 1
+                session = Session(args, os.path.join(tmp, str(generation)), lib_version)
+            else:
+                for d in todo:
+                    session.stager.forget(d)
+
+            for d in list(todo):
+                if not os.path.isfile(os.path.join(d, "Chart.yaml")):
+                    # Deleted, or half-way through being renamed.
+                    todo.discard(d)
+                    results.pop(d, None)
+                    if d in chart_dirs:
+                        chart_dirs.remove(d)
+            todo = [d for d in chart_dirs if d in todo]
+
+
+WORKLOAD_KINDS = ("Deployment", "StatefulSet", "DaemonSet")
+_MISSING = object()
+
+
+def checkout(ref, dest):
+    """Extract the catalog as it was at `ref` into `dest`: a git archive of this
+    directory, without touching the working tree or the index."""
+    try:
+        commit = git("rev-parse", "--verify", "--quiet", f"{ref}^{{commit}}").strip()
+    except subprocess.CalledProcessError:
+        raise SystemExit(f"--diff: {ref} is not a commit")
+    top = git("rev-parse", "--show-toplevel").strip()
+    prefix = git("rev-parse", "--show-prefix").strip()
+    try:
+        git("cat-file", "-e", f"{commit}:{prefix}")
+    except subprocess.CalledProcessError:
+        # From before the catalog: every chart in this tree is an addition.
+        print(f"--diff: no {prefix.rstrip('/')} at {ref}; diffing against an empty catalog",
+              file=sys.stderr)
+        os.makedirs(dest)
+        return commit
+    proc = subprocess.Popen(["git", "archive", "--format=tar", f"{commit}:{prefix}"],
+                            cwd=top, stdout=subprocess.PIPE)
+    unreadable = None
+    try:
+        with tarfile.open(fileobj=proc.stdout, mode="r|") as tar:
+            tar.extractall(dest, filter="data")
+    except tarfile.ReadError as e:
+        unreadable = e  # git's exit status says why, if it failed
+        proc.stdout.read()  # drain, so git can exit
+    if proc.wait() != 0 or unreadable:
+        raise SystemExit(f"--diff: git archive {ref} failed" +
+                         (f": {unreadable}" if unreadable else ""))
+    return commit
+
+
+def rendered(chart, values, session):
+    """A chart's render under `values`, as text, from the session's cache when it
+    has one; (None, helm's stderr) when it does not render."""
+    cache = session.cache
+    key = cache.key(chart, values) if cache else None
+    cached = cache.open(key) if cache else None
+    if cached:
+        with cached:
+            return cached.read(), None
+    session.library.tgz()
+    text, err = render(session.stager.stage(chart.path), values)
+    if text is not None and cache:
+        with cache.writer(key) as f:
+            f.write(text)
+            f.commit()
+    return text, err
+
+
+def objects_by_name(text):
+    """{"Kind/name": object} for every document in a render. A name that
+    appears twice under one kind (a hook and its twin) gets a #2."""
+    objects = {}
+    for chunk in split_documents(text.splitlines(keepends=True)):
+        doc = parse_document(chunk)
+        if not isinstance(doc, dict):
+            continue
+        key = f"{doc.get('kind')}/{(doc.get('metadata') or {}).get('name')}"
+        n, unique = 1, key
+        while unique in objects:
+            n += 1
+            unique = f"{key}#{n}"
+        objects[unique] = doc
+    return objects
+
+
+def _named(items):
+    names = [i.get("name") for i in items if isinstance(i, dict)]
+    return len(names) == len(items) and None not in names and len(set(names)) == len(names)
+
+
+def diff_values(old, new, path="", out=None):
+    """[(path, old, new)] for every leaf that differs between two objects.
+
+    Lists of named things (containers, volumes, env, ports) are matched by name,
+    not position, so inserting an init container reads as one addition rather
+    than every container after it changing. A side that lacks a key is _MISSING.
+    """
+    out = [] if out is None else out
+    if old == new:
+        return out
+    if isinstance(old, dict) and isinstance(new, dict):
+        for k in list(old) + [k for k in new if k not in old]:
+            diff_values(old.get(k, _MISSING), new.get(k, _MISSING),
+                        f"{path}.{k}" if path else str(k), out)
+    elif isinstance(old, list) and isinstance(new, list) and _named(old) and _named(new):
+        before = {i["name"]: i for i in old}
+        after = {i["name"]: i for i in new}
+        for name in list(before) + [n for n in after if n not in before]:
+            diff_values(before.get(name, _MISSING), after.get(name, _MISSING),
+                        f"{path}[{name}]", out)
+        # Order is meaning for init containers, which run one after another.
+        kept_before = [n for n in before if n in after]
+        kept_after = [n for n in after if n in before]
+        if kept_before != kept_after:
+            out.append((f"{path} (order)", kept_before, kept_after))
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for i, (a, b) in enumerate(zip(old, new)):
+            diff_values(a, b, f"{path}[{i}]", out)
+    else:
+        out.append((path, old, new))
+    return out
+
+
+def _show(value):
+    if isinstance(value, str):
+        return value
+    return json.dumps(value, sort_keys=True)
+
+
+def format_change(path, old, new):
+    """One changed leaf as indented lines: a line diff for multi-line strings (a
+    Caddyfile, an init script), old -> new for anything else."""
+    if isinstance(old, str) and isinstance(new, str) and "\n" in old + new:
+        lines = difflib.unified_diff(old.splitlines(), new.splitlines(), n=1, lineterm="")
+        return [f"    {path}:"] + [f"      {l}" for l in list(lines)[2:]]
+    if old is _MISSING:
+        return [f"    + {path}: {_show(new)}"]
+    if new is _MISSING:
+        return [f"    - {path}: {_show(old)}"]
+    return [f"    {path}: {_show(old)} -> {_show(new)}"]
+
+
+def diff_render(old_text, new_text):
+    """(lines, rolls) for one chart's two renders: each object added, removed or
+    changed, with unchanged objects folded into a count, and the workloads whose
+    pod template changed — the ones an upgrade would restart."""
+    before, after = objects_by_name(old_text), objects_by_name(new_text)
+    lines, rolls, same = [], [], 0
+    for key in list(before) + [k for k in after if k not in before]:
+        if key not in after:
+            lines.append(f"  - {key}")
+        elif key not in before:
+            lines.append(f"  + {key}")
+        else:
+            changes = diff_values(before[key], after[key])
+            if not changes:
+                same += 1
+                continue
+            rolls_here = key.split("/", 1)[0] in WORKLOAD_KINDS and any(
+                p.startswith("spec.template") for p, _, _ in changes)
+            if rolls_here:
+                rolls.append(key)
+            lines.append(f"  ~ {key}" + ("  (rolls)" if rolls_here else ""))
+            for change in changes:
+                lines += format_change(*change)
+    if lines and same:
+        lines.append(f"  ({same} unchanged)")
+    return lines, rolls
+
+
+def diff_catalog(args, charts, lib_version):
+    """--diff: render every chart at `args.diff` and in this tree and print what
+    differs, object by object.
+
+    Both sides go through the render cache, whose keys are content hashes, so
+    the base revision is rendered once and then read back on every later diff
+    against it; a chart whose inputs are byte-identical on both sides is not
+    rendered at all.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        base_dir = os.path.join(tmp, "base")
+        commit = checkout(args.diff, base_dir)
+        base_lib = os.path.join(base_dir, os.path.basename(LIBRARY))
+        base_version = Chart(base_lib).version if os.path.isdir(base_lib) else lib_version
+        head = Session(args, os.path.join(tmp, "head"), lib_version)
+        base = Session(args, os.path.join(tmp, "base-run"), base_version, base_lib)
+
+        wanted = {c.app for c in charts}
+        base_charts = {}
+        for d in sorted(glob.glob(os.path.join(base_dir, "*/"))):
+            if os.path.isfile(os.path.join(d, "Chart.yaml")):
+                chart = Chart(d)
+                if not chart.is_library and (chart.app in wanted or not args.charts):
+                    base_charts[chart.app] = chart
+        head_charts = {c.app: c for c in charts}
+        apps = sorted(head_charts.keys() | base_charts.keys())
+
+        # One task per (app, profile) that exists on either side.
+        tasks = []
+        for app in apps:
+            old, new = base_charts.get(app), head_charts.get(app)
+            profiles = {}
+            for side, chart in ((0, old), (1, new)):
+                for name, values in chart.profiles(args.values) if chart else ():
+                    profiles.setdefault(name, [None, None])[side] = values
+            tasks += [(app, name, old, new, values) for name, values in profiles.items()]
+
+        def worker(task):
+            app, profile, old, new, (old_values, new_values) = task
+            if (old and new and old_values == new_values
+                    and old.digest == new.digest
+                    and base.library.digest == head.library.digest):
+                return "", "", None  # same inputs, same render
+            texts = ["", ""]
+            for i, (chart, values, session) in enumerate(
+                    ((old, old_values, base), (new, new_values, head))):
+                if chart is not None and values is not None:
+                    text, err = rendered(chart, values, session)
+                    if text is None:
+                        side = "base" if i == 0 else "working tree"
+                        return None, None, f"{side} does not render: " + (
+                            err.splitlines()[-1] if err else "unknown")
+                    texts[i] = text
+            return texts[0], texts[1], None
+
+        with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+            results = list(pool.map(worker, tasks))
+        for session in (head, base):
+            if session.cache:
+                session.cache.evict()
+
+    failed, unchanged, rolls = 0, 0, []
+    for (app, profile, *_), (old_text, new_text, err) in zip(tasks, results):
+        label = app if profile == "default" else f"{app}[{profile}]"
+        if err:
+            failed += 1
+            print(f"=== {label}\n  ! {err}")
+            continue
+        try:
+            lines, rolled = diff_render(old_text, new_text)
+        except yaml.YAMLError as e:
+            failed += 1
+            print(f"=== {label}\n  ! rendered invalid YAML: {e}")
+            continue
+        if not lines:
+            unchanged += 1
+            continue
+        print(f"=== {label}")
+        print("\n".join(lines))
+        rolls += [f"{label} {key}" for key in rolled]
+
+    print(f"\ndiff against {args.diff} ({commit[:12]}): {len(tasks) - unchanged - failed} "
+          f"renders differ, {unchanged} unchanged" + (f", {failed} failed" if failed else ""))
+    if rolls:
+        print(f"would roll ({len(rolls)}):")
+        for r in rolls:
+            print(f"  {r}")
+    return 1 if failed else 0
+
+
+# Kubernetes' own grammar: a signed decimal, then a binary or decimal SI suffix
+# or a decimal exponent. "1E" is an exabyte, "1E3" a thousand.
+QUANTITY_RE = re.compile(r"^([+-]?(?:[0-9]+\.?[0-9]*|\.[0-9]+))(?:[eE]([+-]?[0-9]+)|([a-zA-Z]*))$")
+QUANTITY_SUFFIXES = {
+    "": 1, "n": 1e-9, "u": 1e-6, "m": 1e-3,
+    "k": 1e3, "M": 1e6, "G": 1e9, "T": 1e12, "P": 1e15, "E": 1e18,
+    "Ki": 2 ** 10, "Mi": 2 ** 20, "Gi": 2 ** 30, "Ti": 2 ** 40, "Pi": 2 ** 50, "Ei": 2 ** 60,
+}
+
+
+def quantity(value):
+    """A Kubernetes quantity ("250m", "1.5Gi", "1e3", 2) as a plain number: cores
+    for cpu, bytes for memory and storage. Raises ValueError when it is not one,
+    which the API server would reject too."""
+    m = QUANTITY_RE.match(str(value).strip())
+    if not m or (m.group(3) or "") not in QUANTITY_SUFFIXES:
+        raise ValueError(f"{value!r} is not a Kubernetes quantity")
+    number, exponent, suffix = m.groups()
+    if exponent is not None:
+        return float(number) * 10 ** int(exponent)
+    return float(number) * QUANTITY_SUFFIXES[suffix]
+
+
+def chart_resources(ix):
+    """What one rendered chart asks of a node, as declared: per Deployment pod,
+    each container's and init container's cpu/memory requests and limits (None
+    where undeclared), and the storage its PVCs request.
+
+    Jobs are left out. The only one is the pre-delete hook, which runs for
+    seconds at uninstall and is not part of what an installed app occupies.
+    """
+    def declared(c):
+        res = c.get("resources") or {}
+        out = {}
+        for kind in ("requests", "limits"):
+            given = res.get(kind) or {}
+            out[kind] = {r: None if given.get(r) is None else quantity(given[r])
+                         for r in ("cpu", "memory")}
+        return out
+
+    return {
+        "pods": [
+            {"pod": p.name, "replicas": p.replicas,
+             "containers": [declared(c) for c in p.containers],
+             "inits": [declared(c) for c in p.inits]}
+            for p in ix.deploys
+        ],
+        "storage": sum(
+            quantity(((pvc.get("spec") or {}).get("resources") or {})
+                     .get("requests", {}).get("storage", 0))
+            for pvc in ix.pvcs
+        ),
+    }
+
+
+def chart_usage(resources, assume):
+    """A chart's steady-state footprint from chart_resources().
+
+    Per pod and per resource, Kubernetes schedules on the larger of the sum over
+    the containers and the largest single init container, since init containers
+    run one at a time and before the rest. A container with no request counts
+    as `assume`; a limit anywhere left undeclared makes the chart's limit None,
+    meaning unbounded. The same sums per pod, replicas included, are in
+    "by_pod".
+    """
+    usage = {"requests": {"cpu": 0.0, "memory": 0.0}, "limits": {"cpu": 0.0, "memory": 0.0},
+             "storage": resources["storage"], "pods": len(resources["pods"]),
+             "containers": 0, "inits": 0,
+             "assumed": 0, "declares": False, "by_pod": []}
+    for pod in resources["pods"]:
+        everything = pod["containers"] + pod["inits"]
+        row = {"pod": pod["pod"], "replicas": pod["replicas"],
+               "containers": len(pod["containers"]) * pod["replicas"],
+               "inits": len(pod["inits"]) * pod["replicas"], "requests": {}, "limits": {}}
+        usage["containers"] += row["containers"]
+        usage["inits"] += row["inits"]
+        usage["assumed"] += sum(1 for c in everything
+                                if None in c["requests"].values()) * pod["replicas"]
+        usage["declares"] |= any(v is not None for c in everything
+                                 for kind in c.values() for v in kind.values())
+        for kind in ("requests", "limits"):
+            for r in ("cpu", "memory"):
+                def value(c):
+                    v = c[kind][r]
+                    return assume[r] if v is None and kind == "requests" else v
+                main = [value(c) for c in pod["containers"]]
+                init = [value(c) for c in pod["inits"]]
+                row[kind][r] = (None if None in main + init else
+                                max(sum(main), max(init, default=0)) * pod["replicas"])
+                if usage[kind][r] is None or row[kind][r] is None:
+                    usage[kind][r] = None
+                else:
+                    usage[kind][r] += row[kind][r]
+        usage["by_pod"].append(row)
+    return usage
+
+
+def load_node_profiles(path):
+    """The --capacity config: node profiles, the assumed request, and plans."""
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    # Each resource on its own: an [assume] that sets only memory still plans cpu.
+    assumed = config.get("assume", {})
+    assume = {r: quantity(assumed.get(r, 0)) for r in ("cpu", "memory")}
+    nodes = {}
+    for name, p in config.get("profiles", {}).items():
+        nodes[name] = {
+            "cpu": quantity(p["cpu"]) - quantity(p.get("reserved_cpu", 0)),
+            "memory": quantity(p["memory"]) - quantity(p.get("reserved_memory", 0)),
+            "storage": quantity(p.get("storage", 0)) or None,
+        }
+    return assume, nodes, config.get("plans", [])
+
+
+def fmt_cpu(cores):
+    return "unbounded" if cores is None else f"{cores * 1000:.0f}m"
+
+
+def fmt_bytes(n):
+    if n is None:
+        return "unbounded"
+    for unit in ("Ti", "Gi", "Mi", "Ki"):
+        if n >= QUANTITY_SUFFIXES[unit]:
+            return f"{n / QUANTITY_SUFFIXES[unit]:.1f}{unit}"
+    return f"{n:.0f}"
+
+
+def fits(usages, node):
+    """Does this set of chart usages fit in a node's allocatable resources?
+    Returns (fits, {resource: total wanted})."""
+    want = {
+        "cpu": sum(u["requests"]["cpu"] for u in usages),
+        "memory": sum(u["requests"]["memory"] for u in usages),
+        "storage": sum(u["storage"] for u in usages),
+    }
+    ok = want["cpu"] <= node["cpu"] and want["memory"] <= node["memory"] and (
+        node["storage"] is None or want["storage"] <= node["storage"])
+    return ok, want
+
+
+def capacity_report(runs, path):
+    """What every chart asks of a node, and which sets of them fit on the node
+    profiles in `path`. Planned from the default value profile only: the others
+    are alternative renders of the same app, not extra apps."""
+    assume, nodes, plans = load_node_profiles(path)
+    usage = {r.chart: chart_usage(r.resources, assume)
+             for r in runs if r.profile == "default" and r.resources is not None}
+    out = [f"capacity, with undeclared requests assumed {fmt_cpu(assume['cpu'])} cpu / "
+           f"{fmt_bytes(assume['memory'])} memory per container:",
+           f"  {'app':<18}{'pods':>5}{'ctrs':>5}{'init':>5}{'cpu req':>10}{'mem req':>10}"
+           f"{'cpu lim':>11}{'mem lim':>11}{'storage':>10}"]
+    for app, u in usage.items():
+        out.append(
+            f"  {app:<18}{u['pods']:>5}{u['containers']:>5}{u['inits']:>5}"
+            f"{fmt_cpu(u['requests']['cpu']):>10}{fmt_bytes(u['requests']['memory']):>10}"
+            f"{fmt_cpu(u['limits']['cpu']):>11}{fmt_bytes(u['limits']['memory']):>11}"
+            f"{fmt_bytes(u['storage']):>10}"
+        )
+        # Each pod beneath its chart, with its replica count where the chart has
+        # its pod count: which pod a chart's total comes from.
+        for p in u["by_pod"]:
+            out.append(
+                f"    {p['pod']:<16}{p['replicas']:>5}{p['containers']:>5}{p['inits']:>5}"
+                f"{fmt_cpu(p['requests']['cpu']):>10}{fmt_bytes(p['requests']['memory']):>10}"
+                f"{fmt_cpu(p['limits']['cpu']):>11}{fmt_bytes(p['limits']['memory']):>11}"
+            )
+
+    # These are what overcommit a single-node box: the scheduler places them
+    # as if they were free, and the first sign is the OOM killer.
+    bare = [app for app, u in usage.items() if not u["declares"]]
+    if bare:
+        out.append(f"no requests or limits at all ({len(bare)} charts): {', '.join(bare)}")
+
+    for name, node in nodes.items():
+        out.append(f"node {name}: allocatable {fmt_cpu(node['cpu'])} cpu, "
+                   f"{fmt_bytes(node['memory'])} memory, {fmt_bytes(node['storage'])} storage")
+        alone = [app for app, u in usage.items() if not fits([u], node)[0]]
+        if alone:
+            out.append(f"  does not fit even alone: {', '.join(alone)}")
+        # Smallest first, so this is the most apps this node can hold at once.
+        room = []
+        for app, u in sorted(usage.items(), key=lambda kv: (kv[1]["requests"]["memory"],
+                                                             kv[1]["requests"]["cpu"])):
+            if fits([*room, u], node)[0]:
+                room.append(u)
+        out.append(f"  at most {len(room)} of {len(usage)} apps fit at once")
+        for plan in plans:
+            if plan.get("node") != name:
+                continue
+            missing = [a for a in plan["apps"] if a not in usage]
+            if missing:
+                out.append(f"  plan {plan['name']}: unknown app(s) {', '.join(missing)}")
                 continue
-            check(app, docs, fail)
+            ok, want = fits([usage[a] for a in plan["apps"]], node)
+            out.append(
+                f"  plan {plan['name']}: {'fits' if ok else 'DOES NOT FIT'} — "
+                f"cpu {fmt_cpu(want['cpu'])}/{fmt_cpu(node['cpu'])}, memory "
+                f"{fmt_bytes(want['memory'])}/{fmt_bytes(node['memory'])}, storage "
+                f"{fmt_bytes(want['storage'])}/{fmt_bytes(node['storage'])}"
+            )
+    return "\n".join(out) + "\n"
 
-    print(f"checked {len(chart_dirs)} charts")
+
+# What Kubernetes assumes for a probe field the chart leaves out.
+PROBE_DEFAULTS = {"initialDelaySeconds": 0, "periodSeconds": 10, "successThreshold": 1}
+# Hooks that run on the way up. Anything else (the pre-delete cleanup) is not
+# between `helm install` and a usable app.
+INSTALL_HOOKS = {"pre-install", "post-install"}
+
+
+def _probe(c, kind):
+    p = c.get(kind)
+    return {k: int(p.get(k, d)) for k, d in PROBE_DEFAULTS.items()} if p else None
+
+
+def chart_startup(ix):
+    """What stands between `helm install` and a Ready app, per pod, as declared:
+    the images it pulls, its init containers in the order they run, and each
+    container's startup and readiness probes."""
+    pods = []
+    for p in ix.deploys + ix.jobs:
+        if p.hooks and not p.hooks & INSTALL_HOOKS:
+            continue
+        pods.append({
+            "pod": p.name, "kind": p.kind, "hook": "pre-install" in p.hooks,
+            "images": list(dict.fromkeys(c["image"] for c in p.all)),
+            "inits": [{"name": c["name"], "image": c["image"]} for c in p.inits],
+            "containers": [{"name": c["name"], "startup": _probe(c, "startupProbe"),
+                            "readiness": _probe(c, "readinessProbe")} for c in p.containers],
+        })
+    return pods
+
+
+def probe_floor(container):
+    """(earliest Ready, polling period) a container's probes impose, in seconds
+    from its start. The readiness probe does not run until the startup probe
+    has passed, and neither looks before its initialDelaySeconds; after that,
+    an app that is up just after a probe waits a whole period to be noticed."""
+    probes = [p for p in (container["startup"], container["readiness"]) if p]
+    if not probes:
+        return 0, 0
+    floor = max(p["initialDelaySeconds"] + (p["successThreshold"] - 1) * p["periodSeconds"]
+                for p in probes)
+    return floor, max(p["periodSeconds"] for p in probes)
+
+
+def image_digest(image):
+    """The digest a reference pins, else the reference: what a node pulls once."""
+    return image.split("@", 1)[1] if "@sha256:" in image else image
+
+
+def cold_start(pods, model, warm):
+    """One app's estimated cold start from chart_startup(), under `model`'s
+    per-step costs. `warm` is the digests every node already has.
+
+    install: every image no node has yet, pulled one at a time (the kubelet
+    serialises pulls), then any pre-install hook, then the slowest of the pods
+    that start side by side: its init containers one after another, a start,
+    and the wait its probes impose. restart: the same pods with the images
+    already on the node, which is what a reboot or an upgrade sees.
+
+    avoidable: seconds the slowest-to-fix pod spends on its shape rather than
+    on its app — probes that look late or seldom compared with polling every
+    `probe_period` from the start, and init containers that could be one.
+    """
+    pulls = [d for d in dict.fromkeys(image_digest(i) for p in pods for i in p["images"])
+             if d not in warm]
+    out = {"pods": len(pods), "pulls": len(pulls), "inits": 0, "probe": 0,
+           "install": 0.0, "restart": 0.0, "avoidable": 0.0, "findings": []}
+    hooks = 0.0
+    for pod in pods:
+        inits = len(pod["inits"]) * model["init_seconds"]
+        path = inits + model["start_seconds"]
+        avoidable, findings = 0.0, []
+        images = [i["image"] for i in pod["inits"]]
+        for image in dict.fromkeys(images):
+            if images.count(image) > 1:
+                names = [i["name"] for i in pod["inits"] if i["image"] == image]
+                saved = (len(names) - 1) * model["init_seconds"]
+                avoidable += saved
+                findings.append((saved, f"{pod['pod']}: init containers {', '.join(names)} "
+                                        f"run the same image one after another; as one "
+                                        f"container they would save ~{saved:.0f}s"))
+        # Containers become Ready side by side, so only the latest one's lag
+        # is on the path.
+        floor, lag = 0, 0
+        for c in pod["containers"]:
+            f, p = probe_floor(c)
+            floor = max(floor, f)
+            late = max(f, p) - model["probe_period"]
+            if late > 0:
+                lag = max(lag, late)
+                findings.append((late, f"{pod['pod']}/{c['name']}: probes cannot pass before {f}s "
+                                       f"and then poll every {p}s; every "
+                                       f"{model['probe_period']}s from the start would notice "
+                                       f"Ready up to {late}s sooner"))
+        avoidable += lag
+        path += floor
+        out["inits"] = max(out["inits"], len(pod["inits"]))
+        out["probe"] = max(out["probe"], floor)
+        if pod["hook"]:
+            hooks += path
+        else:
+            out["install"] = max(out["install"], path)
+        if pod["kind"] == "Deployment":
+            out["restart"] = max(out["restart"], path)
+        out["avoidable"] = max(out["avoidable"], avoidable)
+        out["findings"] += findings
+    out["install"] += len(pulls) * model["pull_seconds"] + hooks
+    out["findings"] = [msg for _, msg in sorted(out["findings"], key=lambda f: -f[0])]
+    return out
+
+
+def load_cold_start(path):
+    """The --cold-start config: per-step costs, the images every node is
+    assumed to have already, and the budgets."""
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    model = {"pull_seconds": 15, "init_seconds": 3, "start_seconds": 2, "probe_period": 2,
+             **config.get("assume", {})}
+    warm = set()
+    if model.get("prepulled"):
+        # Relative to the config, like everything else in it.
+        with open(os.path.join(os.path.dirname(os.path.abspath(path)), model["prepulled"])) as f:
+            warm = {image_digest(line.strip()) for line in f if line.strip()}
+    budget = config.get("budget", {})
+    return model, warm, budget
+
+
+def cold_start_report(runs, path):
+    """Estimate every render's cold start, fail each one over its budget, and
+    return the catalog ranked slowest first. Ranked on the default value
+    profile, as --capacity plans are; budgets hold for every profile, since an
+    alternative render can add pods of its own."""
+    model, warm, budget = load_cold_start(path)
+    ranked = []
+    for run in runs:
+        if run.startup is None:
+            continue
+        est = cold_start(run.startup, model, warm)
+        limits = {**{k: v for k, v in budget.items() if k != "apps"},
+                  **budget.get("apps", {}).get(run.chart, {})}
+        for key, what in (("install", "cold start"), ("restart", "restart"),
+                          ("avoidable", "avoidable start-up time")):
+            if key in limits and est[key] > limits[key]:
+                worst = f" ({est['findings'][0]})" if key == "avoidable" and est["findings"] else ""
+                run.fail(run.app, f"{what} ~{est[key]:.0f}s is over its {limits[key]}s "
+                                  f"budget{worst}")
+        if run.profile == "default":
+            ranked.append((run.chart, est))
+    ranked.sort(key=lambda kv: (-kv[1]["install"], kv[0]))
+
+    out = [f"cold start, assuming {model['pull_seconds']}s per image pull, "
+           f"{model['init_seconds']}s per init container, {model['start_seconds']}s "
+           f"per start, {len(warm)} images pre-pulled:",
+           f"  {'app':<18}{'pods':>5}{'pulls':>6}{'inits':>6}{'probe':>7}"
+           f"{'install':>9}{'restart':>9}{'avoidable':>11}"]
+    for app, est in ranked:
+        out.append(f"  {app:<18}{est['pods']:>5}{est['pulls']:>6}{est['inits']:>6}"
+                   f"{est['probe']:>6}s{est['install']:>8.0f}s{est['restart']:>8.0f}s"
+                   f"{est['avoidable']:>10.0f}s")
+    worst = sorted((kv for kv in ranked if kv[1]["findings"]),
+                   key=lambda kv: (-kv[1]["avoidable"], kv[0]))[:10]
+    if worst:
+        out.append("most avoidable start-up time:")
+        for app, est in worst:
+            out.append(f"  {app}: {est['findings'][0]}")
+    return "\n".join(out) + "\n"
+
+
+def chart_payload(*paths):
+    """What a chart's own files add to a release as helm stores it, gzipped: each
+    file goes into the release JSON base64-encoded, templates, values and the
+    library subchart alike."""
+    gz = zlib.compressobj(9, zlib.DEFLATED, 31)
+    n = 0
+    for path in paths:
+        for root, dirs, files in os.walk(path):
+            dirs[:] = sorted(d for d in dirs if d != "charts")
+            for name in sorted(files):
+                with open(os.path.join(root, name), "rb") as f:
+                    n += len(gz.compress(base64.b64encode(f.read())))
+    return n + len(gz.flush())
+
+
+def stored(packed):
+    """The release Secret's payload: helm base64-encodes the gzip."""
+    return 4 * -(-packed // 3)
+
+
+def load_size_budgets(path):
+    with open(path, "rb") as f:
+        config = tomllib.load(f)
+    budget = config.get("budget", {})
+    return {
+        "object": quantity(budget.get("object", 0)) or None,
+        "release": quantity(budget.get("release", 0)) or None,
+        "largest": config.get("report", {}).get("largest", 15),
+        "apps": {app: {k: quantity(v) for k, v in b.items()}
+                 for app, b in budget.get("apps", {}).items()},
+    }
+
+
+def size_report(runs, charts, library, path):
+    """Fail every object and release over the budgets in `path`, and return the
+    largest of both across the catalog.
+
+    A release is what `helm install` writes to a Secret and re-reads on every
+    upgrade, rollback and `helm list`: the manifest and the chart's files,
+    gzipped and base64-encoded. It is estimated here from the manifest's own
+    gzip and the files' gzip summed, which slightly overstates it, since the
+    two are really compressed as one stream.
+    """
+    budgets = load_size_budgets(path)
+    payloads = {c.app: chart_payload(c.path, library.path) for c in charts}
+    objects, releases = {}, []
+    for run in runs:
+        if run.sizes is None:
+            continue
+        limits = {"object": budgets["object"], "release": budgets["release"],
+                  **budgets["apps"].get(run.chart, {})}
+        size = stored(run.sizes.packed + payloads.get(run.chart, 0))
+        for n, kind, name, source in run.sizes.objects:
+            if limits["object"] and n > limits["object"]:
+                run.fail(run.app, f"{kind} {name} ({source}) renders to {fmt_bytes(n)}, over "
+                                  f"the {fmt_bytes(limits['object'])} object budget")
+            # Largest across the profiles an object renders under, once.
+            key = (run.chart, kind, name, source)
+            if n > objects.get(key, (0, ""))[0]:
+                objects[key] = (n, run.app)
+        if limits["release"] and size > limits["release"]:
+            run.fail(run.app, f"release is ~{fmt_bytes(size)} as helm stores it "
+                              f"({fmt_bytes(run.sizes.manifest)} of manifest), over the "
+                              f"{fmt_bytes(limits['release'])} release budget")
+        releases.append((size, run))
+
+    largest = budgets["largest"]
+    out = [f"largest objects (budget {fmt_bytes(budgets['object'])}):"]
+    for (chart, kind, name, source), (n, app) in sorted(
+            objects.items(), key=lambda kv: (-kv[1][0], kv[0]))[:largest]:
+        out.append(f"  {fmt_bytes(n):>9}  {app:<28}{kind} {name}  ({source})")
+    out.append(f"largest releases as helm stores them (budget {fmt_bytes(budgets['release'])}):")
+    out.append(f"  {'stored':>9}  {'app':<28}{'manifest':>10}{'gzipped':>10}{'objects':>9}")
+    for size, run in sorted(releases, key=lambda r: (-r[0], r[1].app))[:largest]:
+        out.append(f"  {fmt_bytes(size):>9}  {run.app:<28}{fmt_bytes(run.sizes.manifest):>10}"
+                   f"{fmt_bytes(run.sizes.packed):>10}{len(run.sizes.objects):>9}")
+    return "\n".join(out) + "\n"
+
+
+# Bumped whenever a field of the index changes meaning or goes away; adding one
+# does not. A client that finds a format it does not know reads the charts
+# themselves instead.
+INDEX_FORMAT = 1
+# Annotations whose value is a JSON document, parsed once here so no client has to.
+JSON_ANNOTATIONS = ("uischema", "outputs")
+
+
+def catalog_index(charts, library):
+    """Everything the storefront shows about every chart, in one compact JSON
+    document: the `yolab.io/*` annotations (JSON ones already parsed), the
+    install form's schema (values.schema.json's `properties.config`), the
+    library version, and a content hash per chart.
+
+    `digest` covers the whole index, and each chart's `hash` covers its directory,
+    so a client holding an older copy can tell in one comparison whether
+    anything changed and then which charts did.
+    """
+    entries = {}
+    for chart in charts:
+        annotations = {}
+        for k, v in (chart.meta.get("annotations") or {}).items():
+            if not k.startswith("yolab.io/"):
+                continue
+            k = k[len("yolab.io/"):]
+            if k in JSON_ANNOTATIONS:
+                try:
+                    v = json.loads(v)
+                except ValueError:
+                    v = None  # what local-api falls back to for a malformed one
+            annotations[k] = v
+        schema_path = os.path.join(chart.path, "values.schema.json")
+        schema = None
+        if os.path.exists(schema_path):
+            with open(schema_path) as f:
+                schema = (json.load(f).get("properties") or {}).get("config")
+        entries[chart.meta.get("name", chart.app)] = {
+            "hash": chart.digest,
+            "version": chart.version,
+            "description": chart.meta.get("description", ""),
+            "annotations": annotations,
+            "schema": schema,
+            "library": chart.wants_library,
+        }
+    index = {
+        "format": INDEX_FORMAT,
+        "library": {"version": library.version, "hash": library.digest},
+        "charts": entries,
+    }
+    index["digest"] = hashlib.sha256(
+        json.dumps(index, sort_keys=True).encode()
+    ).hexdigest()
+    # Compact, and in a stable order, so an unchanged catalog is byte-identical.
+    return json.dumps(index, sort_keys=True, separators=(",", ":"), ensure_ascii=False) + "\n"
+
+
+def image_inventory(runs):
+    """Every distinct image the catalog can run, by digest, with who runs it.
+
+    Keyed on the digest, not the reference: `redis:7-alpine@sha256:X` and
+    `redis:7.4-alpine@sha256:X` are one pull and one copy on disk. `apps` counts
+    charts, not containers or profiles, because a node pays for an image once
+    per node however many pods use it.
+    """
+    by_digest = {}
+    for run in runs:
+        for pod, container, image in run.images:
+            digest = image_digest(image)
+            entry = by_digest.setdefault(digest, {"refs": {}, "users": {}})
+            entry["refs"][image] = entry["refs"].get(image, 0) + 1
+            user = entry["users"].setdefault(
+                (run.chart, pod, container),
+                {"app": run.chart, "pod": pod, "container": container, "profiles": []},
+            )
+            if run.profile not in user["profiles"]:
+                user["profiles"].append(run.profile)
+    images = []
+    for digest, entry in by_digest.items():
+        images.append({
+            "digest": digest,
+            # Most used first: the one a pre-pull asks for.
+            "refs": sorted(entry["refs"], key=lambda r: (-entry["refs"][r], r)),
+            # How many containers use each ref, so inventories of separate runs
+            # can be merged into the order one run over all of them gives.
+            "ref_counts": entry["refs"],
+            "apps": len({app for app, _, _ in entry["users"]}),
+            "users": list(entry["users"].values()),
+        })
+    images.sort(key=lambda i: (-i["apps"], i["refs"][0]))
+    return {"format": 1, "images": images}
+
+
+def merge_inventories(inventories):
+    """One inventory from several image_inventory() outputs over disjoint sets
+    of charts — the per-chart checks nix runs separately — identical to what a
+    single run over all of those charts would have written."""
+    by_digest = {}
+    for inventory in inventories:
+        for image in inventory["images"]:
+            entry = by_digest.setdefault(image["digest"], {"refs": {}, "users": []})
+            for ref, n in image["ref_counts"].items():
+                entry["refs"][ref] = entry["refs"].get(ref, 0) + n
+            entry["users"] += image["users"]
+    images = [{
+        "digest": digest,
+        "refs": sorted(entry["refs"], key=lambda r: (-entry["refs"][r], r)),
+        "ref_counts": entry["refs"],
+        "apps": len({u["app"] for u in entry["users"]}),
+        "users": entry["users"],
+    } for digest, entry in by_digest.items()]
+    images.sort(key=lambda i: (-i["apps"], i["refs"][0]))
+    return {"format": 1, "images": images}
+
+
+def shard(value):
+    """argparse type for --shard: "i/n", 1-based."""
+    m = re.fullmatch(r"(\d+)/(\d+)", value)
+    if not m or not 1 <= int(m.group(1)) <= int(m.group(2)):
+        raise argparse.ArgumentTypeError(f"expected i/n with 1 <= i <= n, got {value!r}")
+    return int(m.group(1)), int(m.group(2))
+
+
+def chart_list(charts, library):
+    """--list-charts: what this invocation would check, for a CI matrix or a
+    build system to fan out over."""
+    return json.dumps({
+        "format": 1,
+        "library": {"path": os.path.relpath(library.path, HERE), "version": library.version},
+        "charts": [{
+            "name": c.app,
+            "path": os.path.relpath(c.path, HERE),
+            "version": c.version,
+            "profiles": [name for name, _ in c.profiles()],
+        } for c in charts],
+    }, indent=2) + "\n"
+
+
+def prepull_list(inventory, min_apps):
+    """The references worth having on every node before anything is installed:
+    those at least `min_apps` charts share. One per line, the format k3s reads
+    from a .txt in its agent/images directory."""
+    return "".join(
+        i["refs"][0] + "\n" for i in inventory["images"]
+        if i["apps"] >= min_apps and "@sha256:" in i["refs"][0]
+    )
+
+
+def write_images(args, inventory):
+    if args.images:
+        with open(args.images, "w") as f:
+            json.dump(inventory, f, indent=2)
+            f.write("\n")
+    if args.prepull:
+        with open(args.prepull, "w") as f:
+            f.write(prepull_list(inventory, args.prepull_min_apps))
+
+
+def json_report(runs, totals):
+    return json.dumps({
+        "charts": [
+            {
+                "app": r.app,
+                "profile": r.profile,
+                "cached": r.cached,
+                "seconds": round(r.seconds, 6),
+                "phases": {k: round(v, 6) for k, v in r.phases.items()},
+                "rules": {k: round(v, 6) for k, v in r.rules.items()},
+                "failures": r.fail.items,
+            }
+            for r in runs
+        ],
+        "totals": {k: round(v, 6) for k, v in totals.items()},
+        "failures": sum(len(r.fail) for r in runs),
+    }, indent=2) + "\n"
+
+
+def junit_report(runs, totals):
+    """One testcase per chart, so a CI dashboard can chart each chart's time."""
+    suite = ET.Element(
+        "testsuite", name="check_charts", tests=str(len(runs)),
+        failures=str(sum(1 for r in runs if len(r.fail))),
+        time=f"{totals['wall']:.3f}",
+    )
+    props = ET.SubElement(suite, "properties")
+    for name, t in totals.items():
+        ET.SubElement(props, "property", name=f"{name}_seconds", value=f"{t:.6f}")
+    for r in runs:
+        case = ET.SubElement(suite, "testcase", classname="catalog", name=r.app,
+                             time=f"{r.seconds:.3f}")
+        if len(r.fail):
+            failure = ET.SubElement(case, "failure", message=f"{len(r.fail)} assertion(s) failed")
+            failure.text = "\n".join(r.fail.items)
+        ET.SubElement(case, "system-out").text = " ".join(
+            f"{k}={v * 1000:.1f}ms" for k, v in r.phases.items()
+        )
+    return ET.tostring(suite, encoding="unicode", xml_declaration=True) + "\n"
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog=os.path.basename(argv[0]))
+    parser.add_argument("charts", nargs="*", metavar="chart-dir")
+    parser.add_argument(
+        "--jobs", "-j", type=int, default=os.cpu_count() or 1,
+        help="charts rendered and checked concurrently (default: one per core)",
+    )
+    parser.add_argument(
+        "--cache-dir", default=CACHE_DIR,
+        help=f"where rendered charts are kept between runs (default: {CACHE_DIR})",
+    )
+    parser.add_argument(
+        "--cache-size", type=int, default=CACHE_MAX_MB, metavar="MB",
+        help=f"evict least-recently-used renders beyond this (default: {CACHE_MAX_MB})",
+    )
+    parser.add_argument("--no-cache", action="store_true", help="always call helm")
+    parser.add_argument(
+        "--staging", choices=Stager.MODES, default="symlink",
+        help="how a chart is laid out for helm (default: symlink)",
+    )
+    parser.add_argument(
+        "--umbrella", action="store_true",
+        help="render each value profile's charts in one helm call, as subcharts of "
+             "one umbrella chart; a chart that breaks it is re-rendered on its own",
+    )
+    parser.add_argument(
+        "--values", metavar="PROFILE,...", type=lambda s: set(s.split(",")),
+        help="only render these value profiles (default: every profile a chart has)",
+    )
+    parser.add_argument(
+        "--rule-times", action="store_true",
+        help="print each rule's total time across the catalog to stderr",
+    )
+    parser.add_argument(
+        "--report", choices=("json", "junit"),
+        help="also write per-chart phase timings and failures in this format",
+    )
+    parser.add_argument(
+        "--report-file", metavar="PATH",
+        help="where --report goes (default: check-charts.json or check-charts.xml)",
+    )
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="run under cProfile (serially) and print the slowest charts, rules "
+             "and functions to stderr",
+    )
+    parser.add_argument(
+        "--images", metavar="PATH",
+        help="write the image inventory (each digest, who uses it, how many apps) as JSON",
+    )
+    parser.add_argument(
+        "--prepull", metavar="PATH",
+        help="write the images shared by --prepull-min-apps or more charts, one per line",
+    )
+    parser.add_argument(
+        "--prepull-min-apps", type=int, default=2, metavar="N",
+        help="how many charts must share an image for --prepull to list it (default: 2)",
+    )
+    parser.add_argument(
+        "--images-from", metavar="PATH", nargs="+",
+        help="render nothing: merge these --images outputs (from separate runs "
+             "over disjoint charts) and write --images/--prepull from them",
+    )
+    parser.add_argument(
+        "--index", metavar="PATH",
+        help="write the catalog index (metadata, form schemas, hashes) as JSON",
+    )
+    parser.add_argument(
+        "--capacity", metavar="PROFILES.toml",
+        help="print what each chart asks of a node and which app sets fit the node "
+             "profiles in this file (see node-profiles.toml)",
+    )
+    parser.add_argument(
+        "--cold-start", metavar="MODEL.toml",
+        help="estimate each app's install-to-Ready time from its pod shapes, rank "
+             "the catalog, and fail apps over the budgets in this file (see cold-start.toml)",
+    )
+    parser.add_argument(
+        "--sizes", metavar="BUDGETS.toml",
+        help="print the largest rendered objects and releases, and fail any over "
+             "the budgets in this file (see size-budgets.toml)",
+    )
+    parser.add_argument(
+        "--shard", metavar="I/N", type=shard,
+        help="only the I-th of N equal slices of the charts (1-based; round-robin "
+             "over the chart list, so every shard gets a similar mix)",
+    )
+    parser.add_argument(
+        "--list-charts", action="store_true",
+        help="print the charts this invocation would check as JSON, and exit",
+    )
+    parser.add_argument(
+        "--since", metavar="REF",
+        help="only check charts affected by changes since this git ref",
+    )
+    parser.add_argument(
+        "--diff", metavar="REF",
+        help="print what would change, object by object, in every render "
+             "between this git ref and the working tree",
+    )
+    parser.add_argument(
+        "--watch", action="store_true",
+        help="keep running, re-checking whatever each edit under the catalog affects",
+    )
+    args = parser.parse_args(argv[1:])
+    if args.watch and (args.since or args.report or args.profile or args.diff):
+        parser.error("--watch cannot be combined with --since, --report, --profile or --diff")
+    if args.diff and (args.since or args.shard or args.report or args.profile):
+        # A chart removed since REF is in no shard of this tree's chart list, so
+        # a sharded diff would either drop removals or report them in every shard.
+        parser.error("--diff cannot be combined with --since, --shard, --report or --profile")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    known = set(PROFILES).union(*CHART_PROFILES.values())
+    if args.values and not args.values <= known:
+        parser.error(f"unknown value profile(s): {', '.join(sorted(args.values - known))}")
+    if args.profile:
+        # cProfile only sees the thread it was enabled on.
+        args.jobs = 1
+
+    if args.images_from:
+        inventories = []
+        for path in args.images_from:
+            with open(path) as f:
+                inventories.append(json.load(f))
+        write_images(args, merge_inventories(inventories))
+        return 0
+
+    # Every Chart.yaml is read once, here; everything after shares the parse.
+    if args.charts:
+        charts = [Chart(d) for d in args.charts]
+    else:
+        charts = [c for c in (Chart(d) for d in sorted(
+            d for d in glob.glob(os.path.join(HERE, "*/"))
+            if os.path.isfile(os.path.join(d, "Chart.yaml"))
+        )) if not c.is_library]
+    if not charts:
+        print("no charts found", file=sys.stderr)
+        return 1
+    library = Chart(LIBRARY)
+    lib_version = library.version
+    if args.index:
+        # Metadata only: written before, and whatever the outcome of, rendering;
+        # and before --shard, so every shard writes the whole catalog's index.
+        with open(args.index, "w") as f:
+            f.write(catalog_index(charts, library))
+    if args.shard:
+        # Before --since, so a chart's shard depends only on the chart list and
+        # not on what changed.
+        i, n = args.shard
+        charts = charts[i - 1::n]
+
+    if args.diff:
+        return diff_catalog(args, charts, lib_version)
+    if args.since:
+        affected = set(affected_charts([c.path for c in charts], args.since))
+        charts = [c for c in charts if c.path in affected]
+        if not charts and not args.list_charts:
+            print(f"no chart affected since {args.since}")
+            return 0
+    if args.list_charts:
+        sys.stdout.write(chart_list(charts, library))
+        return 0
+
+    if args.watch:
+        if watch(args, charts, lib_version):
+            print("check_charts.py changed; restarting", flush=True)
+            os.execv(sys.executable, [sys.executable, os.path.abspath(__file__), *argv[1:]])
+        return 0
+
+    profiler = cProfile.Profile() if args.profile else None
+    start = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    runs, totals = run_catalog(args, charts, lib_version)
+    if profiler:
+        profiler.disable()
+    totals["wall"] = time.perf_counter() - start
+    # Before the failures are gathered: an app over its budget fails the check.
+    cold = cold_start_report(runs, args.cold_start) if args.cold_start else None
+    sizes = size_report(runs, charts, library, args.sizes) if args.sizes else None
+
+    fail = Failures()
+    rule_times = {}
+    for run in runs:
+        fail.extend(run.fail)
+        for name, t in run.rules.items():
+            rule_times[name] = rule_times.get(name, 0.0) + t
+
+    renders = f" ({len(runs)} renders)" if len(runs) != len(charts) else ""
+    print(f"checked {len(charts)} charts{renders}")
     for f in fail.items:
         print("FAIL " + f)
     print(f"FAILURES: {len(fail)}" if len(fail) else "all assertions passed")
+
+    # Everything below goes to stderr or a file, so the report itself stays
+    # byte-identical whichever of these are asked for.
+    if args.report:
+        path = args.report_file or f"check-charts.{'json' if args.report == 'json' else 'xml'}"
+        with open(path, "w") as f:
+            f.write((json_report if args.report == "json" else junit_report)(runs, totals))
+    if args.images or args.prepull:
+        write_images(args, image_inventory(runs))
+    if args.capacity:
+        print(capacity_report(runs, args.capacity), end="", file=sys.stderr)
+    if cold:
+        print(cold, end="", file=sys.stderr)
+    if sizes:
+        print(sizes, end="", file=sys.stderr)
+    if args.rule_times or profiler:
+        for name, t in sorted(rule_times.items(), key=lambda kv: -kv[1]):
+            print(f"{t * 1000:9.1f}ms  {name}", file=sys.stderr)
+    if profiler:
+        print("\nslowest charts:", file=sys.stderr)
+        for run in sorted(runs, key=lambda r: -r.seconds)[:10]:
+            phases = " ".join(f"{k}={v * 1000:.0f}ms" for k, v in run.phases.items())
+            print(f"{run.seconds * 1000:9.1f}ms  {run.app}  ({phases})", file=sys.stderr)
+        print("", file=sys.stderr)
+        pstats.Stats(profiler, stream=sys.stderr).sort_stats("cumulative").print_stats(25)
     return 1 if len(fail) else 0
 
 
@@ -0,0 +1,773 @@
+#!/usr/bin/env python3
+"""Tests for check_charts.py, against a stub helm and a small catalog of its own.
+
+The stub stands in for helm the way scripts/bench-charts.py's does: `template`
+replays the rendered.yaml each test chart carries instead of rendering, so no
+real helm and no real chart is needed. It does what the checker relies on helm
+for, though. It adds a ConfigMap of the values it was given, so a value scoped
+to the wrong chart shows. It orders documents by kind across the whole render,
+so an umbrella interleaves its subcharts as helm's does. And it prefixes
+`# Source:` with the umbrella's path. A chart whose rendered.yaml says
+`# stub: fail` fails to render, and takes any umbrella it is in down with it.
+
+Run:  python3 apps/catalog/check_charts_test.py
+"""
+
+import argparse
+import io
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import unittest
+from contextlib import redirect_stderr, redirect_stdout
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+# A __pycache__ here would be taken for an app by fetch-icons.py.
+sys.dont_write_bytecode = True
+sys.path.insert(0, HERE)
+import check_charts  # noqa: E402
+
+STUB_HELM = '''#!{python}
+import json, os, re, sys
+
+ORDER = ["Secret", "ConfigMap", "PersistentVolumeClaim", "Service", "Deployment", "Job"]
+
+
+def rank(doc):
+    m = re.search(r"^kind: (\\w+)", doc, re.M)
+    return ORDER.index(m.group(1)) if m and m.group(1) in ORDER else len(ORDER)
+
+
+def chart(path, values):
+    with open(os.path.join(path, "Chart.yaml")) as f:
+        name = re.search(r"^name: (\\S+)", f.read(), re.M).group(1)
+    with open(os.path.join(path, "rendered.yaml")) as f:
+        text = f.read()
+    if "# stub: fail" in text:
+        sys.exit(f"Error: {{name}} does not render")
+    docs = [d for d in re.split(r"^---\\n", text, flags=re.M) if d.strip()]
+    data = "".join(f"  {{k}}: {{json.dumps(v)}}\\n" for k, v in sorted(values.items()))
+    docs.append(f"# Source: {{name}}/templates/values.yaml\\n"
+                f"apiVersion: v1\\nkind: ConfigMap\\nmetadata:\\n  name: values\\ndata:\\n{{data}}")
+    return name, docs
+
+
+args = sys.argv[1:]
+if args[0] == "version":
+    print("v0.0.0-stub")
+elif args[0] == "package":
+    dest, version = args[args.index("--destination") + 1], args[args.index("--version") + 1]
+    open(os.path.join(dest, f"yolab-common-{{version}}.tgz"), "w").close()
+elif args[0] == "template":
+    staged = args[2]
+    # Split and unescaped as helm does: "," ends a value unless escaped.
+    sets = [s for a in args[4::2] for s in re.split(r"(?<!\\\\),", a)]
+    values = {{k: re.sub(r"\\\\(.)", r"\\1", v) for k, v in (s.split("=", 1) for s in sets)}}
+    if os.path.exists(os.path.join(staged, "rendered.yaml")):
+        docs = chart(staged, values)[1]
+    else:
+        with open(os.path.join(staged, "Chart.yaml")) as f:
+            umbrella = re.search(r"^name: (\\S+)", f.read(), re.M).group(1)
+        docs = []
+        for sub in sorted(os.listdir(os.path.join(staged, "charts"))):
+            prefix = sub + "."
+            name, own = chart(os.path.join(staged, "charts", sub),
+                              {{k[len(prefix):]: v for k, v in values.items() if k.startswith(prefix)}})
+            docs += [d.replace("# Source: ", f"# Source: {{umbrella}}/charts/", 1) for d in own]
+    for doc in sorted(docs, key=rank):
+        sys.stdout.write("---\\n" + doc)
+else:
+    sys.exit(f"stub helm: {{args[0]}} is not stubbed")
+'''
+
+
+def fixture(name, caddy="      reverse_proxy localhost:8000\n", requests="{cpu: 10m, memory: 32Mi}",
+            storage="1Gi"):
+    """A render in the catalog's shape that passes every rule: the gateway pod,
+    its Caddyfile, a PVC, a Service and the pre-delete cleanup Job."""
+    return textwrap.dedent("""\
+        ---
+        # Source: {name}/templates/app.yaml
+        apiVersion: apps/v1
+        kind: Deployment
+        metadata:
+          name: gateway
+        spec:
+          template:
+            metadata:
+              labels:
+                app: gateway
+            spec:
+              initContainers:
+              - name: wg-register
+                image: reg/wg-register@sha256:aaaa
+                imagePullPolicy: IfNotPresent
+                env:
+                - name: ACCOUNT_TOKEN
+                  valueFrom:
+                    secretKeyRef: {{name: t, key: k}}
+                volumeMounts:
+                - name: yolab
+                  mountPath: /yolab
+              containers:
+              - name: wireguard
+                image: reg/wg@sha256:bbbb
+                imagePullPolicy: IfNotPresent
+                securityContext:
+                  privileged: true
+              - name: caddy
+                image: reg/caddy@sha256:cccc
+                imagePullPolicy: IfNotPresent
+                ports:
+                - containerPort: 80
+                resources:
+                  requests: {requests}
+              - name: {name}
+                image: reg/{name}@sha256:{name}
+                imagePullPolicy: IfNotPresent
+                command: ["/bin/sh", "-c", ". /yolab/env\\nexec /entrypoint.sh\\n"]
+                env:
+                - name: X
+                  value: "$YOLAB_URL"
+                readinessProbe:
+                  httpGet: {{path: /, port: 8000}}
+                  initialDelaySeconds: 10
+                  periodSeconds: 10
+                volumeMounts:
+                - name: yolab
+                  mountPath: /yolab
+              volumes:
+              - name: yolab
+                emptyDir: {{}}
+        ---
+        # Source: {name}/templates/app.yaml
+        apiVersion: v1
+        kind: Service
+        metadata:
+          name: gateway
+        spec:
+          selector:
+            app: gateway
+          ports:
+          - port: 80
+        ---
+        # Source: {name}/templates/app.yaml
+        apiVersion: v1
+        kind: ConfigMap
+        metadata:
+          name: caddy
+        data:
+          Caddyfile: |
+            :80 {{
+        {caddy}    }}
+        ---
+        # Source: {name}/templates/app.yaml
+        apiVersion: v1
+        kind: PersistentVolumeClaim
+        metadata:
+          name: release-data
+        spec:
+          resources:
+            requests:
+              storage: {storage}
+        ---
+        # Source: {name}/charts/yolab-common/templates/_uninstall.tpl
+        apiVersion: batch/v1
+        kind: Job
+        metadata:
+          name: cleanup
+          annotations:
+            helm.sh/hook: pre-delete
+        spec:
+          template:
+            spec:
+              containers:
+              - name: cleanup
+                image: reg/wg-register@sha256:aaaa
+                imagePullPolicy: IfNotPresent
+        """).format(name=name, caddy=caddy, requests=requests, storage=storage)
+
+
+class StubHelmTest(unittest.TestCase):
+    """A throwaway catalog, and the stub helm first on PATH."""
+
+    def tempdir(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+    def setUp(self):
+        self.tmp = self.tempdir()
+        bindir = os.path.join(self.tmp, "bin")
+        os.makedirs(bindir)
+        helm = os.path.join(bindir, "helm")
+        with open(helm, "w") as f:
+            f.write(STUB_HELM.format(python=sys.executable))
+        os.chmod(helm, 0o755)
+        patcher = mock.patch.dict(os.environ, {"PATH": bindir + os.pathsep + os.environ["PATH"]})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.catalog = os.path.join(self.tmp, "catalog")
+        self.charts = [
+            self.chart("alpha", fixture("alpha"), ["gatewayContainers", "uninstallHook"]),
+            # Named apart from its directory: values and `# Source:` go by the name.
+            self.chart("beta", fixture("beta-app", caddy="      # ---\n      reverse_proxy localhost:8000\n"),
+                       ["auth.enabled"], name="beta-app"),
+            self.chart("gamma", fixture("gamma", requests="{cpu: 250m, memory: 1Gi}",
+                                        storage="20Gi"), ["uninstallHook"]),
+        ]
+
+    def chart(self, app, rendered, includes=(), name=None):
+        path = os.path.join(self.catalog, app)
+        os.makedirs(os.path.join(path, "templates"))
+        with open(os.path.join(path, "Chart.yaml"), "w") as f:
+            f.write(f"apiVersion: v2\nname: {name or app}\nversion: 0.1.0\n")
+        with open(os.path.join(path, "templates", "app.yaml"), "w") as f:
+            f.writelines(f'{{{{ include "yolab-common.{h}" . }}}}\n' for h in includes)
+        with open(os.path.join(path, "rendered.yaml"), "w") as f:
+            f.write(rendered)
+        return path
+
+    def args(self, **overrides):
+        args = argparse.Namespace(
+            jobs=2, values=None, no_cache=True, cache_dir=os.path.join(self.tmp, "cache"),
+            cache_size=256, staging="symlink", umbrella=False, sizes=None,
+        )
+        vars(args).update(overrides)
+        return args
+
+    def session(self, **overrides):
+        args = self.args(**overrides)
+        root = tempfile.mkdtemp(dir=self.tmp)
+        os.rmdir(root)
+        return check_charts.Session(args, root, check_charts.Chart(check_charts.LIBRARY).version)
+
+    def check_all(self, session):
+        shell = check_charts.shell_syntax(session_args(session))
+        by_chart, _ = check_charts.check_all(
+            session, shell, [check_charts.Chart(c) for c in self.charts])
+        return by_chart
+
+    def main(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        with redirect_stdout(out), redirect_stderr(err):
+            code = check_charts.main(["check_charts.py", "--no-cache", "--jobs", "2",
+                                      *args, *self.charts])
+        return code, out.getvalue(), err.getvalue()
+
+    def write(self, name, text):
+        path = os.path.join(self.tmp, name)
+        with open(path, "w") as f:
+            f.write(textwrap.dedent(text))
+        return path
+
+
+def session_args(session):
+    # shell_syntax() only wants to know whether there is a cache, and where.
+    return argparse.Namespace(no_cache=session.cache is None,
+                              cache_dir=session.cache.path if session.cache else None)
+
+
+class UmbrellaTest(StubHelmTest):
+    def members(self, profile):
+        charts = [check_charts.Chart(c) for c in self.charts]
+        return [(c, dict(c.profiles())[profile]) for c in charts]
+
+    def test_split_is_byte_identical_to_each_charts_own_render(self):
+        session = self.session()
+        for profile in ("default", "installed"):
+            members = self.members(profile)
+            texts = check_charts.render_umbrella(session, profile, members)
+            self.assertEqual(set(texts), {c.path for c, _ in members}, profile)
+            for chart, values in members:
+                alone, err = check_charts.render(session.stager.stage(chart.path), values)
+                self.assertIsNone(err)
+                self.assertEqual(texts[chart.path], alone, f"{chart.app}[{profile}]")
+
+    def test_a_value_with_a_comma_is_one_value(self):
+        session = self.session()
+        values = {"config.whitelist": "alice,bob", "config.path": "C:\\"}
+        alpha = check_charts.Chart(self.charts[0])
+        alone, err = check_charts.render(session.stager.stage(alpha.path), values)
+        self.assertIsNone(err)
+        texts = check_charts.render_umbrella(session, "default", [(alpha, values)])
+        for text in (alone, texts[alpha.path]):
+            self.assertIn('config.whitelist: "alice,bob"', text)
+            self.assertIn('config.path: "C:\\\\"', text)
+            self.assertNotIn("bob:", text)
+
+    def test_umbrella_fills_the_cache_exactly_as_per_chart_renders_do(self):
+        caches = []
+        for umbrella in (False, True):
+            cache_dir = os.path.join(self.tmp, f"cache-{umbrella}")
+            self.check_all(self.session(no_cache=False, cache_dir=cache_dir, umbrella=umbrella))
+            entries = {}
+            for name in os.listdir(cache_dir):
+                if name.endswith(".yaml"):
+                    with open(os.path.join(cache_dir, name)) as f:
+                        entries[name] = f.read()
+            caches.append(entries)
+        self.assertEqual(len(caches[0]), 6)  # three charts, two profiles each
+        self.assertEqual(caches[0], caches[1])
+
+    def test_umbrella_directory_is_removed_after_each_render(self):
+        session = self.session()
+        check_charts.render_umbrella(session, "default", self.members("default"))
+        self.assertEqual(os.listdir(os.path.join(session.root, "umbrella")), [])
+
+    def test_a_broken_chart_fails_alone(self):
+        with open(os.path.join(self.charts[2], "rendered.yaml"), "a") as f:
+            f.write("# stub: fail\n")
+        session = self.session(umbrella=True)
+        self.assertEqual(check_charts.render_umbrella(session, "default",
+                                                      self.members("default")), {})
+        by_chart = self.check_all(session)
+        failed = {run.app for runs in by_chart.values() for run in runs if len(run.fail)}
+        self.assertEqual(failed, {"gamma", "gamma[installed]"})
+
+    def test_a_document_it_cannot_attribute_falls_back(self):
+        # No `# Source:` header, so nothing says whose it is.
+        with open(os.path.join(self.charts[0], "rendered.yaml"), "a") as f:
+            f.write("---\napiVersion: v1\nkind: Secret\nmetadata:\n  name: stray\n")
+        texts = check_charts.render_umbrella(self.session(), "default", self.members("default"))
+        self.assertEqual(texts, {})
+
+
+class RenderSizesTest(unittest.TestCase):
+    def test_objects_are_measured_without_their_source_header(self):
+        sizes = check_charts.RenderSizes()
+        docs = list(check_charts.split_documents(io.StringIO(fixture("alpha"))))
+        for chunk in docs:
+            sizes.add(chunk)
+        self.assertEqual(sizes.manifest, sum(len(d.encode()) for d in docs))
+        kinds = [(kind, name) for _, kind, name, _ in sizes.objects]
+        self.assertEqual(kinds, [("Deployment", "gateway"), ("Service", "gateway"),
+                                 ("ConfigMap", "caddy"), ("PersistentVolumeClaim", "release-data"),
+                                 ("Job", "cleanup")])
+        n, _, _, source = sizes.objects[1]
+        header = "# Source: alpha/templates/app.yaml\n"
+        self.assertEqual(source, "alpha/templates/app.yaml")
+        self.assertEqual(n, len(docs[1]) - len(header))
+        self.assertLess(sizes.packed, sizes.manifest)
+        self.assertEqual(sizes.packed, sizes.packed)  # flushed once, then remembered
+
+    def test_a_document_without_a_kind_counts_only_towards_the_manifest(self):
+        sizes = check_charts.RenderSizes()
+        sizes.add("# Source: alpha/templates/notes.txt\n# nothing here\n")
+        self.assertGreater(sizes.manifest, 0)
+        self.assertEqual(sizes.objects, [])
+
+    def test_stored_is_the_base64_of_the_gzip(self):
+        self.assertEqual([check_charts.stored(n) for n in (0, 1, 3, 4)], [0, 4, 4, 8])
+
+
+class DiffTest(unittest.TestCase):
+    def test_named_lists_are_matched_by_name(self):
+        old = {"initContainers": [{"name": "a", "image": "x"}, {"name": "b", "image": "y"}]}
+        new = {"initContainers": [{"name": "z", "image": "w"}, {"name": "a", "image": "x"},
+                                  {"name": "b", "image": "y2"}]}
+        self.assertEqual(check_charts.diff_values(old, new), [
+            ("initContainers[b].image", "y", "y2"),
+            ("initContainers[z]", check_charts._MISSING, {"name": "z", "image": "w"}),
+        ])
+
+    def test_reordering_named_items_is_reported(self):
+        old = {"c": [{"name": "a"}, {"name": "b"}]}
+        new = {"c": [{"name": "b"}, {"name": "a"}]}
+        self.assertEqual(check_charts.diff_values(old, new),
+                         [("c (order)", ["a", "b"], ["b", "a"])])
+
+    def test_other_lists_are_compared_by_position_or_whole(self):
+        self.assertEqual(check_charts.diff_values({"args": ["a", "b"]}, {"args": ["a", "c"]}),
+                         [("args[1]", "b", "c")])
+        self.assertEqual(check_charts.diff_values({"args": ["a"]}, {"args": ["a", "c"]}),
+                         [("args", ["a"], ["a", "c"])])
+
+    def test_missing_keys_on_either_side(self):
+        self.assertEqual(check_charts.diff_values({"a": 1}, {"b": 2}), [
+            ("a", 1, check_charts._MISSING), ("b", check_charts._MISSING, 2)])
+
+    def test_render_diff_knows_what_would_roll(self):
+        old = fixture("alpha")
+        new = old.replace("periodSeconds: 10", "periodSeconds: 5").replace("- port: 80",
+                                                                           "- port: 81")
+        lines, rolls = check_charts.diff_render(old, new)
+        self.assertEqual(rolls, ["Deployment/gateway"])
+        self.assertIn("  ~ Deployment/gateway  (rolls)", lines)
+        self.assertIn("  ~ Service/gateway", lines)
+        self.assertIn("    spec.template.spec.containers[alpha].readinessProbe.periodSeconds: "
+                      "10 -> 5", lines)
+        self.assertEqual(lines[-1], "  (3 unchanged)")
+
+    def test_render_diff_adds_removes_and_shows_text_as_lines(self):
+        old = fixture("alpha")
+        new = fixture("alpha", caddy="      reverse_proxy localhost:9000\n").replace(
+            "kind: PersistentVolumeClaim", "kind: PersistentVolumeClaimX")
+        lines, rolls = check_charts.diff_render(old, new)
+        self.assertEqual(rolls, [])
+        self.assertIn("  - PersistentVolumeClaim/release-data", lines)
+        self.assertIn("  + PersistentVolumeClaimX/release-data", lines)
+        self.assertIn("      -  reverse_proxy localhost:8000", lines)
+        self.assertIn("      +  reverse_proxy localhost:9000", lines)
+
+    def test_identical_renders_have_nothing_to_say(self):
+        self.assertEqual(check_charts.diff_render(fixture("alpha"), fixture("alpha")), ([], []))
+
+    def test_twin_names_are_kept_apart(self):
+        text = "---\nkind: Job\nmetadata: {name: x}\n---\nkind: Job\nmetadata: {name: x}\n"
+        self.assertEqual(list(check_charts.objects_by_name(text)), ["Job/x", "Job/x#2"])
+
+
+@unittest.skipUnless(shutil.which("git"), "git not installed")
+class CheckoutTest(unittest.TestCase):
+    """--diff's baseline, from a repository whose first commit has no catalog."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        repo = os.path.join(self.tmp, "repo")
+        catalog = os.path.join(repo, "apps", "catalog")
+        os.makedirs(os.path.join(catalog, "app"))
+        self.git(repo, "init", "-q")
+        with open(os.path.join(repo, "README"), "w") as f:
+            f.write("before the catalog\n")
+        self.git(repo, "add", "README")
+        self.git(repo, "commit", "-qm", "first")
+        with open(os.path.join(catalog, "app", "Chart.yaml"), "w") as f:
+            f.write("apiVersion: v2\nname: app\nversion: 0.1.0\n")
+        self.git(repo, "add", "apps")
+        self.git(repo, "commit", "-qm", "second")
+        patcher = mock.patch.object(check_charts, "HERE", catalog)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def git(repo, *args):
+        subprocess.run(["git", "-c", "user.name=test", "-c", "user.email=test@example.com",
+                        *args], cwd=repo, check=True, capture_output=True)
+
+    def test_the_catalog_is_extracted(self):
+        dest = os.path.join(self.tmp, "base")
+        check_charts.checkout("HEAD", dest)
+        self.assertTrue(os.path.isfile(os.path.join(dest, "app", "Chart.yaml")))
+
+    def test_a_ref_from_before_the_catalog_is_an_empty_baseline(self):
+        dest = os.path.join(self.tmp, "base")
+        err = io.StringIO()
+        with redirect_stderr(err):
+            commit = check_charts.checkout("HEAD~1", dest)
+        self.assertEqual(os.listdir(dest), [])
+        self.assertEqual(len(commit), 40)
+        self.assertIn("no apps/catalog at HEAD~1", err.getvalue())
+
+    def test_not_a_commit(self):
+        with self.assertRaisesRegex(SystemExit, "--diff: nope is not a commit"):
+            check_charts.checkout("nope", os.path.join(self.tmp, "base"))
+
+
+class CapacityTest(unittest.TestCase):
+    def test_quantity(self):
+        for text, value in [("250m", 0.25), ("2", 2), (2, 2), ("1.5Gi", 1.5 * 2 ** 30),
+                            ("64Mi", 64 * 2 ** 20), ("1k", 1000), (".5", 0.5), ("1.", 1),
+                            ("+3", 3), ("1e3", 1000), ("1E3", 1000), ("5e-1", 0.5),
+                            ("1Pi", 2 ** 50), ("1Ei", 2 ** 60), ("2P", 2e15), ("1E", 1e18)]:
+            self.assertEqual(check_charts.quantity(text), value, text)
+        for text in ("", "lots", "1Zi", "1e", "1.5.0", "Mi"):
+            with self.assertRaisesRegex(ValueError, "is not a Kubernetes quantity"):
+                check_charts.quantity(text)
+
+    def resources(self, containers, inits=(), replicas=1, storage=0):
+        def declared(req=None, lim=None):
+            return {"requests": {"cpu": (req or {}).get("cpu"), "memory": (req or {}).get("memory")},
+                    "limits": {"cpu": (lim or {}).get("cpu"), "memory": (lim or {}).get("memory")}}
+        return {"pods": [{"pod": "gateway", "replicas": replicas,
+                          "containers": [declared(*c) for c in containers],
+                          "inits": [declared(*c) for c in inits]}],
+                "storage": storage}
+
+    def test_an_init_container_counts_only_when_it_is_larger(self):
+        assume = {"cpu": 0.1, "memory": 100}
+        usage = check_charts.chart_usage(self.resources(
+            [({"cpu": 0.5, "memory": 10}, {"cpu": 1, "memory": 20})],
+            [({"cpu": 0.2, "memory": 50}, {"cpu": 1, "memory": 20})]), assume)
+        self.assertEqual(usage["requests"], {"cpu": 0.5, "memory": 50})
+        self.assertEqual(usage["limits"], {"cpu": 1, "memory": 20})
+        self.assertEqual(usage["assumed"], 0)
+        self.assertTrue(usage["declares"])
+
+    def test_undeclared_requests_are_assumed_and_limits_unbounded(self):
+        usage = check_charts.chart_usage(
+            self.resources([({"cpu": 0.5}, None), (None, None)], replicas=2, storage=5),
+            {"cpu": 0.1, "memory": 100})
+        self.assertAlmostEqual(usage["requests"]["cpu"], 1.2)
+        self.assertEqual(usage["requests"]["memory"], 400)
+        self.assertEqual(usage["limits"], {"cpu": None, "memory": None})
+        self.assertEqual((usage["containers"], usage["assumed"], usage["storage"]), (4, 4, 5))
+
+    def test_each_pod_is_summed_on_its_own(self):
+        resources = self.resources([({"cpu": 0.5, "memory": 10}, {"cpu": 1, "memory": 20})])
+        resources["pods"].append({**self.resources([(None, None)], replicas=3)["pods"][0],
+                                  "pod": "worker"})
+        usage = check_charts.chart_usage(resources, {"cpu": 0.1, "memory": 100})
+        self.assertEqual([(p["pod"], p["replicas"], p["containers"]) for p in usage["by_pod"]],
+                         [("gateway", 1, 1), ("worker", 3, 3)])
+        self.assertEqual(usage["by_pod"][0]["limits"], {"cpu": 1, "memory": 20})
+        self.assertEqual(usage["by_pod"][1]["requests"]["memory"], 300)
+        self.assertEqual(usage["by_pod"][1]["limits"], {"cpu": None, "memory": None})
+        self.assertEqual(usage["requests"]["memory"], 310)
+        self.assertEqual(usage["limits"]["cpu"], None)
+
+    def test_assume_defaults_each_resource_on_its_own(self):
+        path = os.path.join(tempfile.mkdtemp(), "nodes.toml")
+        self.addCleanup(os.remove, path)
+        with open(path, "w") as f:
+            f.write('[assume]\nmemory = "64Mi"\n[profiles.small]\ncpu = 1\nmemory = "1Gi"\n')
+        assume, nodes, plans = check_charts.load_node_profiles(path)
+        self.assertEqual(assume, {"cpu": 0, "memory": 64 * 2 ** 20})
+        self.assertEqual(nodes["small"], {"cpu": 1, "memory": 2 ** 30, "storage": None})
+
+    def test_fits(self):
+        node = {"cpu": 1, "memory": 100, "storage": None}
+        small = {"requests": {"cpu": 0.4, "memory": 40}, "storage": 10}
+        self.assertEqual(check_charts.fits([small, small], node),
+                         (True, {"cpu": 0.8, "memory": 80, "storage": 20}))
+        self.assertFalse(check_charts.fits([small] * 3, node)[0])
+
+
+class ColdStartTest(unittest.TestCase):
+    MODEL = {"pull_seconds": 10, "init_seconds": 3, "start_seconds": 2, "probe_period": 2}
+
+    def pod(self, name="gateway", kind="Deployment", hook=False, images=(), inits=(),
+            probes=()):
+        probe = {"initialDelaySeconds": 0, "periodSeconds": 2, "successThreshold": 1}
+        return {"pod": name, "kind": kind, "hook": hook, "images": list(images),
+                "inits": [{"name": n, "image": i} for n, i in inits],
+                "containers": [{"name": f"c{n}", "startup": None,
+                                "readiness": {**probe, **p}} for n, p in enumerate(probes)]}
+
+    def test_pulls_are_counted_once_per_digest_and_skip_warm_images(self):
+        pods = [self.pod(images=["a:1@sha256:x", "a:2@sha256:x", "b@sha256:y", "c:3"])]
+        est = check_charts.cold_start(pods, self.MODEL, {"sha256:y"})
+        self.assertEqual(est["pulls"], 2)
+        self.assertEqual(est["install"], 2 * 10 + 2)
+        self.assertEqual(est["restart"], 2)
+
+    def test_inits_run_in_turn_and_the_slowest_probe_is_on_the_path(self):
+        pods = [self.pod(inits=[("one", "i"), ("two", "j")],
+                         probes=[{"initialDelaySeconds": 10, "periodSeconds": 10},
+                                 {"initialDelaySeconds": 4}])]
+        est = check_charts.cold_start(pods, self.MODEL, set())
+        self.assertEqual((est["inits"], est["probe"]), (2, 10))
+        self.assertEqual(est["restart"], 2 * 3 + 2 + 10)
+        self.assertEqual(est["avoidable"], 8)
+        self.assertIn("gateway/c0: probes cannot pass before 10s", est["findings"][0])
+
+    def test_inits_sharing_an_image_are_avoidable(self):
+        pods = [self.pod(inits=[("a", "same"), ("b", "same"), ("c", "other")])]
+        est = check_charts.cold_start(pods, self.MODEL, set())
+        self.assertEqual(est["avoidable"], 3)
+        self.assertIn("init containers a, b run the same image", est["findings"][0])
+
+    def test_an_install_hook_runs_before_the_pods_and_not_on_restart(self):
+        pods = [self.pod(), self.pod("migrate", kind="Job", hook=True, inits=[("m", "x")])]
+        est = check_charts.cold_start(pods, self.MODEL, set())
+        self.assertEqual(est["install"], 2 + (3 + 2))
+        self.assertEqual(est["restart"], 2)
+
+    def test_image_digest(self):
+        self.assertEqual(check_charts.image_digest("redis:7@sha256:abc"), "sha256:abc")
+        self.assertEqual(check_charts.image_digest("redis:7"), "redis:7")
+
+
+class HelpersTest(StubHelmTest):
+    def test_only_helpers_whose_definition_changed(self):
+        old = ('{{- define "yolab-common.a" -}}\nA\n{{- end }}\n'
+               '{{- define "yolab-common.b" -}}\nB\n{{- end }}\n')
+        new = old.replace("B\n", "B2\n") + '{{- define "yolab-common.c" -}}\n{{- end }}\n'
+        self.assertEqual(check_charts.changed_helpers(old, new),
+                         {"yolab-common.b", "yolab-common.c"})
+        self.assertEqual(check_charts.changed_helpers(old, old), set())
+
+    def test_charts_using_follows_the_librarys_own_includes(self):
+        # image.caddy is only ever included through caddyContainer, which
+        # gatewayContainers includes; alpha calls the latter.
+        self.assertEqual(check_charts.charts_using(self.charts, {"yolab-common.image.caddy"}),
+                         [self.charts[0]])
+        self.assertEqual(check_charts.charts_using(self.charts, {"yolab-common.uninstallHook"}),
+                         [self.charts[0], self.charts[2]])
+        self.assertEqual(check_charts.charts_using(self.charts, {"yolab-common.nothing"}), [])
+
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        self.file = self.touch("app", "values.yaml")
+
+    def touch(self, *parts, text="x"):
+        path = os.path.join(self.root, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+    def polling(self):
+        with mock.patch.object(check_charts.ctypes, "CDLL", side_effect=OSError):
+            watcher = check_charts.Watcher([self.root])
+        self.assertLess(watcher._fd, 0)
+        return watcher
+
+    def edits(self, watcher):
+        new = self.touch("app", "templates", "new.yaml")
+        self.touch("app", ".values.yaml.swp")
+        with open(self.file, "a") as f:
+            f.write("more")
+        # Some filesystems keep mtimes to the second: the size moves too.
+        st = os.stat(self.file)
+        os.utime(self.file, ns=(st.st_atime_ns, st.st_mtime_ns + 10 ** 9))
+        return {new, self.file}
+
+    def test_polling_sees_edits_and_new_files(self):
+        watcher = self.polling()
+        expected = self.edits(watcher)
+        self.assertEqual(watcher._read(0), expected)
+        os.remove(self.file)
+        self.assertEqual(watcher._read(0), {self.file})
+        self.assertEqual(watcher._read(0), set())
+
+    def test_polling_sees_a_new_directory_before_anything_in_it(self):
+        watcher = self.polling()
+        chart = os.path.join(self.root, "new-app")
+        os.mkdir(chart)
+        self.assertEqual(watcher._read(0), {chart})
+        self.touch("new-app", "Chart.yaml")
+        self.assertEqual(watcher._read(0), {os.path.join(chart, "Chart.yaml")})
+
+    def test_a_new_directory_maps_to_its_chart_once_it_has_a_chart_yaml(self):
+        chart = os.path.join(self.root, "new-app")
+        os.mkdir(chart)
+        self.assertIsNone(check_charts.chart_dir_of(chart, self.root))
+        self.touch("new-app", "Chart.yaml")
+        for path in (chart, os.path.join(chart, "Chart.yaml"),
+                     os.path.join(chart, "templates", "app.yaml")):
+            self.assertEqual(check_charts.chart_dir_of(path, self.root), chart, path)
+        self.assertIsNone(check_charts.chart_dir_of(self.root, self.root))
+        self.assertIsNone(check_charts.chart_dir_of(os.path.dirname(self.root), self.root))
+
+    def test_inotify_sees_edits_and_new_files(self):
+        watcher = check_charts.Watcher([self.root])
+        if watcher._fd < 0:
+            self.skipTest("no inotify here")
+        self.addCleanup(os.close, watcher._fd)
+        expected = self.edits(watcher)
+        changed = watcher.wait()
+        self.assertTrue(expected <= changed, changed)
+        self.assertFalse(any(p.endswith(".swp") for p in changed))
+
+
+class MainTest(StubHelmTest):
+    """The optional modes, end to end through main()."""
+
+    def test_plain_run_passes(self):
+        code, out, _ = self.main()
+        self.assertEqual(code, 0, out)
+        self.assertIn("checked 3 charts (6 renders)\nall assertions passed", out)
+
+    def test_umbrella_reports_what_per_chart_renders_do(self):
+        self.assertEqual(self.main("--umbrella")[:2], self.main()[:2])
+
+    def test_a_failure_is_reported(self):
+        with open(os.path.join(self.charts[0], "rendered.yaml"), "a") as f:
+            f.write("# stub: fail\n")
+        code, out, _ = self.main()
+        self.assertEqual(code, 1)
+        self.assertIn("FAIL alpha: helm template failed: Error: alpha does not render", out)
+
+    def test_capacity(self):
+        path = self.write("nodes.toml", """\
+            [assume]
+            cpu = "100m"
+            memory = "128Mi"
+            [profiles.small]
+            cpu = 1
+            memory = "2Gi"
+            [[plans]]
+            name = "all"
+            node = "small"
+            apps = ["alpha", "beta", "gamma"]
+            """)
+        code, _, err = self.main("--capacity", path)
+        self.assertEqual(code, 0)
+        # Two containers assumed at 100m/128Mi, beside caddy's 250m/1Gi.
+        self.assertRegex(err, r"\n  gamma +1 +3 +1 +450m +1\.2Gi +unbounded +unbounded +20\.0Gi\n"
+                              r"    gateway +1 +3 +1 +450m +1\.2Gi +unbounded +unbounded\n")
+        self.assertIn("  plan all: fits — cpu 870m/1000m, memory 1.8Gi/2.0Gi", err)
+
+    def test_a_quantity_the_api_server_would_refuse_fails_the_chart(self):
+        path = os.path.join(self.charts[2], "rendered.yaml")
+        with open(path) as f:
+            text = f.read()
+        with open(path, "w") as f:
+            f.write(text.replace("memory: 1Gi", "memory: 1GB"))
+        code, out, _ = self.main("--values", "default")
+        self.assertEqual(code, 1)
+        self.assertIn("FAIL gamma: resources: '1GB' is not a Kubernetes quantity", out)
+
+    def test_cold_start_budget_fails_the_run(self):
+        path = self.write("cold.toml", """\
+            [assume]
+            pull_seconds = 10
+            [budget]
+            install = 60
+            [budget.apps.gamma]
+            install = 30
+            """)
+        code, out, err = self.main("--cold-start", path)
+        self.assertEqual(code, 1)
+        fails = [line for line in out.splitlines() if line.startswith("FAIL ")]
+        self.assertEqual(fails, ["FAIL gamma: cold start ~55s is over its 30s budget",
+                                 "FAIL gamma[installed]: cold start ~55s is over its 30s budget"])
+        self.assertIn("cold start, assuming 10s per image pull", err)
+
+    def test_size_budget_fails_the_run(self):
+        path = self.write("sizes.toml", """\
+            [budget]
+            object = "1Ki"
+            [budget.apps.alpha]
+            object = "2Ki"
+            """)
+        code, out, err = self.main("--sizes", path)
+        self.assertEqual(code, 1)
+        fails = [line for line in out.splitlines() if line.startswith("FAIL ")]
+        self.assertEqual(len(fails), 4, fails)  # beta and gamma's gateway, per profile
+        self.assertTrue(all("Deployment gateway" in f and "alpha" not in f for f in fails))
+        self.assertIn("largest releases as helm stores them", err)
+
+    def test_sizes_are_only_measured_when_asked_for(self):
+        by_chart = self.check_all(self.session())
+        self.assertTrue(all(run.sizes is None and "size" not in run.phases
+                            for runs in by_chart.values() for run in runs))
+        by_chart = self.check_all(self.session(sizes="budgets.toml"))
+        self.assertTrue(all(run.sizes.objects for runs in by_chart.values() for run in runs))
+
+    def test_images(self):
+        path = os.path.join(self.tmp, "images.json")
+        code, _, _ = self.main("--images", path, "--prepull", os.path.join(self.tmp, "pre.txt"))
+        self.assertEqual(code, 0)
+        with open(path) as f:
+            images = {i["digest"]: i["apps"] for i in json.load(f)["images"]}
+        self.assertEqual(images["sha256:aaaa"], 3)
+        with open(os.path.join(self.tmp, "pre.txt")) as f:
+            self.assertEqual(f.read().split(), ["reg/caddy@sha256:cccc", "reg/wg-register@sha256:aaaa",
+                                                "reg/wg@sha256:bbbb"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -37,6 +37,7 @@
   pkgs,
   inputs,
 }: let
+  inherit (pkgs) lib;
   rustToolchain = (pkgs.extend inputs.rust-overlay.overlays.default)
     .rust-bin.fromRustupToolchainFile ./homelab/local-api/rust-toolchain.toml;
   craneLib = (inputs.crane.mkLib pkgs).overrideToolchain rustToolchain;
@@ -100,6 +101,55 @@
             | tee "$out/coverage-summary.txt"
         '';
       });
+
+  # ── Helm charts, one derivation each ───────────────────────────────────────
+  #
+  # Each chart's check sees only its own directory, the library, the checker and
+  # its budget files (lib.fileset), so its store path changes only when one of
+  # those does: editing one chart re-runs one check, and nix's own cache skips
+  # the other sixty. A library, checker or budget edit still re-runs them all,
+  # which is the point. The checks are independent derivations, so `nix run .#ci`
+  # spreads them over every core and builder it has.
+  #
+  # The cold-start model counts images every node pre-pulls as free, so the
+  # pre-pull list is in the fileset too, at its path relative to cold-start.toml.
+  catalog = ./apps/catalog;
+  chartNames =
+    builtins.filter
+    (name: name != "yolab-common" && builtins.pathExists (catalog + "/${name}/Chart.yaml"))
+    (builtins.attrNames (builtins.readDir catalog));
+  checkerPython = pkgs.python3.withPackages (ps: [ps.pyyaml]);
+  chartCheck = name:
+    pkgs.runCommand "chart-check-${name}" {
+      nativeBuildInputs = [pkgs.kubernetes-helm checkerPython];
+      src = lib.fileset.toSource {
+        root = ./.;
+        fileset = lib.fileset.unions [
+          (catalog + "/${name}")
+          (catalog + "/yolab-common")
+          (catalog + "/check_charts.py")
+          (catalog + "/cold-start.toml")
+          (catalog + "/size-budgets.toml")
+          ./homelab/nixos/k3s/prepull-images.txt
+        ];
+      };
+    } ''
+      cp -r "$src" ./src
+      chmod -R +w ./src
+      catalog=./src/apps/catalog
+      # helm insists on a writable home for its cache/config, and there is none
+      # in the build sandbox.
+      export HOME=$PWD/home
+      mkdir -p "$HOME" "$out"
+      # The sandbox is thrown away afterwards, so a render cache would only be
+      # written and never read. An app over its cold-start budget, or with an
+      # object or release over its size budget, fails here.
+      python3 "$catalog/check_charts.py" --no-cache --images "$out/images.json" \
+        --cold-start "$catalog/cold-start.toml" \
+        --sizes "$catalog/size-budgets.toml" \
+        "$catalog/${name}"
+    '';
+  chartChecks = lib.genAttrs chartNames chartCheck;
 in {
   # ── Rust ────────────────────────────────────────────────────────────────────
 
@@ -119,6 +169,40 @@ in {
     nativeBuildInputs = [pkgs.pkg-config];
   };
 
+  # The macOS setup's platform client and batch mode, against a stand-in
+  # platform API on loopback: retries, Retry-After, and configs written 0600.
+  # Its in-process WireGuard keys are checked against RFC 7748 and against what
+  # `wg pubkey` derives from the same private key.
+  macos-setup-tests =
+    pkgs.runCommand "macos-setup-tests" {
+      nativeBuildInputs = [pkgs.python3 pkgs.wireguard-tools];
+      src = ./installer/macos;
+    } ''
+      python3 "$src/setup_test.py"
+      touch $out
+    '';
+
+  # The chart checker itself, against a stub helm and a catalog of its own:
+  # umbrella renders split back into exactly what each chart renders alone (the
+  # render cache cannot tell them apart), --diff's baseline and object diff,
+  # --capacity, --cold-start and --sizes end to end, --since's helper graph, and
+  # --watch's watcher with and without inotify.
+  chart-checker-tests =
+    pkgs.runCommand "chart-checker-tests" {
+      nativeBuildInputs = [checkerPython pkgs.git];
+      src = lib.fileset.toSource {
+        root = catalog;
+        fileset = lib.fileset.unions [
+          (catalog + "/yolab-common")
+          (catalog + "/check_charts.py")
+          (catalog + "/check_charts_test.py")
+        ];
+      };
+    } ''
+      python3 "$src/check_charts_test.py"
+      touch $out
+    '';
+
   # ── wg-register ─────────────────────────────────────────────────────────────
   #
   # Runs on every app install and every app restart. Driven under busybox sh
@@ -135,27 +219,45 @@ in {
       touch $out
     '';
 
+  # ── fetch-icons ─────────────────────────────────────────────────────────────
+  #
+  # The icon fetcher's cache and conditional requests, against a stand-in CDN on
+  # loopback (which the build sandbox allows); no real CDN is reached.
+  fetch-icons-tests =
+    pkgs.runCommand "fetch-icons-tests" {
+      nativeBuildInputs = [pkgs.python3];
+      src = ./scripts;
+    } ''
+      python3 "$src/fetch_icons_test.py"
+      touch $out
+    '';
+
   # ── Helm charts ─────────────────────────────────────────────────────────────
   #
-  # `helm lint` accepts charts that cannot run — three shipped that way. This
-  # renders each chart against the yolab-common in this tree (not the published
-  # one, so a library change is checked before release) and asserts the result
-  # describes a workload that can actually start.
+  # `helm lint` accepts charts that cannot run — three shipped that way. Each
+  # chart-<name> renders one chart against the yolab-common in this tree (not
+  # the published one, so a library change is checked before release) and
+  # asserts the result describes a workload that can actually start. See
+  # chartCheck above.
+  #
+  #   nix build .#checks.x86_64-linux.chart-immich    # just one chart
+
+  # The image list the nodes pre-pull and pin must follow the charts. Built from
+  # what the per-chart checks already recorded, so it renders nothing itself.
   charts =
     pkgs.runCommand "chart-checks" {
-      nativeBuildInputs = [
-        pkgs.kubernetes-helm
-        (pkgs.python3.withPackages (ps: [ps.pyyaml]))
-      ];
-      src = ./apps/catalog;
+      nativeBuildInputs = [checkerPython];
+      checker = catalog + "/check_charts.py";
+      prepull = ./homelab/nixos/k3s/prepull-images.txt;
     } ''
-      cp -r "$src" ./catalog
-      chmod -R +w ./catalog
-      # helm insists on a writable home for its cache/config, and there is none
-      # in the build sandbox.
-      export HOME=$PWD/home
-      mkdir -p "$HOME"
-      python3 ./catalog/check_charts.py
+      python3 "$checker" --prepull prepull-images.txt --images-from ${
+        lib.concatMapStringsSep " " (name: "${chartChecks.${name}}/images.json") chartNames
+      }
+      if ! diff -u "$prepull" prepull-images.txt; then
+        echo "homelab/nixos/k3s/prepull-images.txt is stale; regenerate it with" >&2
+        echo "  apps/catalog/check_charts.py --prepull homelab/nixos/k3s/prepull-images.txt" >&2
+        exit 1
+      fi
       touch $out
     '';
 
@@ -199,3 +301,5 @@ in {
   #   nix-fmt = pkgs.runCommand "nix-fmt" { nativeBuildInputs = [pkgs.alejandra]; }
   #     '' alejandra --check ${./.}; touch $out '';
 }
+# chart-<name> for every chart in the catalog.
+// lib.mapAttrs' (name: lib.nameValuePair "chart-${name}") chartChecks
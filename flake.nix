@@ -177,7 +177,8 @@
           # the way CI does.
           busybox
           jq
-          (python3.withPackages (ps: [ps.pyyaml]))
+          # pillow: fetch-icons.py shrinks PNGs in-process with it.
+          (python3.withPackages (ps: [ps.pyyaml ps.pillow]))
         ];
 
         shellHook = ''
@@ -9,65 +9,70 @@
 // from selfh.st/icons and homarr-labs/dashboard-icons. Apps with no entry
 // here — and anything from a user-added repo — fall back to the emoji in
 // their Chart.yaml.
+//
+// Every logo is a <symbol> in one sheet, so a page of tiles costs one
+// request rather than one per app. Values are symbol ids in ICON_SPRITE.
+
+export const ICON_SPRITE = "/icons/sprite.4100e9381a68.svg";
 
 export const CATALOG_ICONS: Record<string, string> = {
-  "2fauth": "/icons/2fauth.svg",
-  "actual": "/icons/actual.svg",
-  "appflowy": "/icons/appflowy.svg",
-  "audiobookshelf": "/icons/audiobookshelf.svg",
-  "bookstack": "/icons/bookstack.svg",
-  "calibre-web": "/icons/calibre-web.svg",
-  "changedetection": "/icons/changedetection.svg",
-  "cinny": "/icons/cinny.svg",
-  "code-server": "/icons/code-server.svg",
-  "dawarich": "/icons/dawarich.svg",
-  "docmost": "/icons/docmost.svg",
-  "excalidraw": "/icons/excalidraw.svg",
-  "filebrowser": "/icons/filebrowser.svg",
-  "firefly-iii": "/icons/firefly-iii.svg",
-  "freshrss": "/icons/freshrss.svg",
-  "frigate": "/icons/frigate.svg",
-  "ghost": "/icons/ghost.png",
-  "gitea": "/icons/gitea.svg",
-  "grafana": "/icons/grafana.svg",
-  "grocy": "/icons/grocy.svg",
-  "home-assistant": "/icons/home-assistant.svg",
-  "homepage": "/icons/homepage.svg",
-  "immich": "/icons/immich.svg",
-  "it-tools": "/icons/it-tools.svg",
-  "jellyfin": "/icons/jellyfin.svg",
-  "jellyseerr": "/icons/jellyseerr.svg",
-  "karakeep": "/icons/karakeep.svg",
-  "kavita": "/icons/kavita.svg",
-  "librespeed": "/icons/librespeed.svg",
-  "linkwarden": "/icons/linkwarden.svg",
-  "mealie": "/icons/mealie.svg",
-  "memos": "/icons/memos.png",
-  "metube": "/icons/metube.svg",
-  "minecraft": "/icons/minecraft.png",
-  "miniflux": "/icons/miniflux.svg",
-  "monica": "/icons/monica.svg",
-  "n8n": "/icons/n8n.svg",
-  "navidrome": "/icons/navidrome.svg",
-  "nextcloud": "/icons/nextcloud.svg",
-  "ntfy": "/icons/ntfy.svg",
-  "open-webui": "/icons/open-webui.svg",
-  "openclaw": "/icons/openclaw.svg",
-  "paperless-ngx": "/icons/paperless-ngx.svg",
-  "photoprism": "/icons/photoprism.svg",
-  "planka": "/icons/planka.svg",
-  "qbittorrent": "/icons/qbittorrent.svg",
-  "reactive-resume": "/icons/reactive-resume.svg",
-  "romm": "/icons/romm.svg",
-  "searxng": "/icons/searxng.svg",
-  "shlink": "/icons/shlink.svg",
-  "stirling-pdf": "/icons/stirling-pdf.svg",
-  "synapse": "/icons/synapse.svg",
-  "syncthing": "/icons/syncthing.svg",
-  "umami": "/icons/umami.svg",
-  "uptime-kuma": "/icons/uptime-kuma.svg",
-  "vaultwarden": "/icons/vaultwarden.svg",
-  "vikunja": "/icons/vikunja.svg",
-  "wallabag": "/icons/wallabag.svg",
-  "wallos": "/icons/wallos.svg",
+  "2fauth": "icon-2fauth",
+  "actual": "icon-actual",
+  "appflowy": "icon-appflowy",
+  "audiobookshelf": "icon-audiobookshelf",
+  "bookstack": "icon-bookstack",
+  "calibre-web": "icon-calibre-web",
+  "changedetection": "icon-changedetection",
+  "cinny": "icon-cinny",
+  "code-server": "icon-code-server",
+  "dawarich": "icon-dawarich",
+  "docmost": "icon-docmost",
+  "excalidraw": "icon-excalidraw",
+  "filebrowser": "icon-filebrowser",
+  "firefly-iii": "icon-firefly-iii",
+  "freshrss": "icon-freshrss",
+  "frigate": "icon-frigate",
+  "ghost": "icon-ghost",
+  "gitea": "icon-gitea",
+  "grafana": "icon-grafana",
+  "grocy": "icon-grocy",
+  "home-assistant": "icon-home-assistant",
+  "homepage": "icon-homepage",
+  "immich": "icon-immich",
+  "it-tools": "icon-it-tools",
+  "jellyfin": "icon-jellyfin",
+  "jellyseerr": "icon-jellyseerr",
+  "karakeep": "icon-karakeep",
+  "kavita": "icon-kavita",
+  "librespeed": "icon-librespeed",
+  "linkwarden": "icon-linkwarden",
+  "mealie": "icon-mealie",
+  "memos": "icon-memos",
+  "metube": "icon-metube",
+  "minecraft": "icon-minecraft",
+  "miniflux": "icon-miniflux",
+  "monica": "icon-monica",
+  "n8n": "icon-n8n",
+  "navidrome": "icon-navidrome",
+  "nextcloud": "icon-nextcloud",
+  "ntfy": "icon-ntfy",
+  "open-webui": "icon-open-webui",
+  "openclaw": "icon-openclaw",
+  "paperless-ngx": "icon-paperless-ngx",
+  "photoprism": "icon-photoprism",
+  "planka": "icon-planka",
+  "qbittorrent": "icon-qbittorrent",
+  "reactive-resume": "icon-reactive-resume",
+  "romm": "icon-romm",
+  "searxng": "icon-searxng",
+  "shlink": "icon-shlink",
+  "stirling-pdf": "icon-stirling-pdf",
+  "synapse": "icon-synapse",
+  "syncthing": "icon-syncthing",
+  "umami": "icon-umami",
+  "uptime-kuma": "icon-uptime-kuma",
+  "vaultwarden": "icon-vaultwarden",
+  "vikunja": "icon-vikunja",
+  "wallabag": "icon-wallabag",
+  "wallos": "icon-wallos",
 };
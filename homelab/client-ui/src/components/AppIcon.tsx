@@ -1,7 +1,27 @@
-import { useState } from "react";
-import { CATALOG_ICONS } from "@/catalog/icons";
+import { useEffect, useState } from "react";
+import { CATALOG_ICONS, ICON_SPRITE } from "@/catalog/icons";
 import { cn } from "@/lib/utils";
 
+/**
+ * The symbol ids the sprite sheet actually holds, or null when it did not load.
+ *
+ * `<use>` has no error event: a sheet that 404s, or one that lacks a symbol the
+ * manifest names, just draws nothing. So the sheet is also fetched once per page
+ * (the same immutable URL, so the HTTP cache serves it to both) and every icon
+ * checks its symbol against it, falling back the way a failed `<img>` does.
+ */
+let spriteSymbols: Promise<Set<string> | null> | undefined;
+function loadSprite() {
+  spriteSymbols ??= fetch(ICON_SPRITE)
+    .then((r) => (r.ok ? r.text() : Promise.reject(new Error(r.statusText))))
+    .then(
+      (text) =>
+        new Set(Array.from(text.matchAll(/<symbol id="([^"]+)"/g), (m) => m[1])),
+    )
+    .catch(() => null);
+  return spriteSymbols;
+}
+
 /**
  * An app's icon: the project's own logo where we have one, otherwise the emoji
  * from its Chart.yaml, otherwise its first letter.
@@ -14,6 +34,9 @@ import { cn } from "@/lib/utils";
  * `yolab.io/icon` stays as the fallback rather than being replaced, so an app
  * from a user-added repo, or one whose logo nobody has published, still gets
  * something. strfry and valheim are the two in the official catalog.
+ *
+ * Bundled logos are symbols in one sprite sheet, drawn with `<use>`: a grid of
+ * sixty tiles is one request, fetched once and cached, instead of sixty.
  */
 export function AppIcon({
   appId,
@@ -30,8 +53,22 @@ export function AppIcon({
   className?: string;
 }) {
   const [failed, setFailed] = useState(false);
+  const [spriteMissing, setSpriteMissing] = useState(false);
 
-  const bundled = appId ? CATALOG_ICONS[appId] : undefined;
+  const symbol = appId ? CATALOG_ICONS[appId] : undefined;
+  useEffect(() => {
+    // Per symbol: one app's missing logo says nothing about the next one this
+    // instance is handed.
+    setSpriteMissing(false);
+    if (!symbol) return;
+    let live = true;
+    void loadSprite().then((symbols) => {
+      if (live && !symbols?.has(symbol)) setSpriteMissing(true);
+    });
+    return () => {
+      live = false;
+    };
+  }, [symbol]);
   // Two charts point `yolab.io/icon` at a remote PNG/SVG. Those still work, but
   // they are a fallback now — a remote image fails in the case this product is
   // most likely to be in, a house whose internet is down.
@@ -39,12 +76,19 @@ export function AppIcon({
     icon && (/^(https?:)?\/\//.test(icon) || icon.startsWith("/"))
       ? icon
       : undefined;
-  const src = bundled ?? remote;
 
-  if (src && !failed) {
+  if (symbol && !spriteMissing) {
+    return (
+      <svg className={className} role="img" aria-label={name}>
+        <use href={`${ICON_SPRITE}#${symbol}`} />
+      </svg>
+    );
+  }
+
+  if (remote && !failed) {
     return (
       <img
-        src={src}
+        src={remote}
         alt=""
         loading="lazy"
         referrerPolicy="no-referrer"
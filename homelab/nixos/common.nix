@@ -405,7 +405,12 @@ in
             header @hashed Cache-Control "public, max-age=31536000, immutable"
             @entry path / /index.html
             header @entry Cache-Control "no-cache" 
-            file_server
+            # The icon sprite sheet ships with a .gz copy beside it
+            # (scripts/fetch-icons.py); send that rather than compressing
+            # the same bytes again on every request.
+            file_server {
+              precompressed gzip
+            }
           }
         }
       '';
@@ -597,6 +602,13 @@ in
       # directory must exist before k3s's first write, hence the `d` rule.
       "d /var/lib/rancher/k3s/agent/etc/kubelet.conf.d 0700 root root -"
       "L+ /var/lib/rancher/k3s/agent/etc/kubelet.conf.d/10-yolab-image-gc.conf     - - - - ${./k3s/kubelet-image-gc.yaml}"
+      # Images most of the catalog shares (the gateway sidecars, the common
+      # databases), generated by `check_charts.py --prepull`. k3s pulls every
+      # image listed in a .txt in its images directory when it starts and labels
+      # it pinned, so a first install never waits on them and image GC never
+      # takes them back. The charts check fails when this list is stale.
+      "d /var/lib/rancher/k3s/agent/images 0755 root root -"
+      "L+ /var/lib/rancher/k3s/agent/images/yolab-prepull.txt                       - - - - ${./k3s/prepull-images.txt}"
       # Rook's operator still runs — it owns ceph-csi, which is what backs PVCs —
       # but it no longer runs the Ceph cluster itself. The CephCluster/
       # CephFilesystem manifests are deliberately NOT applied here: Ceph is a
@@ -2,15 +2,62 @@
 """
 YoLab macOS interactive setup — stdlib only, no external deps.
 Writes homelab/ignored/config.toml from user input.
+
+    setup.py <yolab_dir> [flake_target]
+    setup.py --batch fleet.toml --out-dir nodes/ <yolab_dir> [flake_target]
+
+Batch mode answers the prompts from a file describing many nodes, registers
+their tunnels side by side, and writes nodes/<hostname>/config.toml for each
+plus nodes/summary.json. The answer file is TOML (Python 3.11+) or JSON:
+
+    [defaults]                  # any per-node field, applied to every node
+    timezone = "Europe/Paris"
+    swarm = "worker"            # "manager", "worker" or "off"
+
+    [tunnel]                    # omit to provision without tunnels
+    platform_api_url = "http://188.245.104.63:5000"
+    account_token = "..."
+
+    [[nodes]]
+    hostname = "mac-1"
+    swarm = "manager"
+    service_name = "homelab"    # DNS name; defaults to the hostname
+
+    [[nodes]]
+    hostname = "mac-2"
+    tunnel = false
+
+A node whose config.toml already exists is kept, as in interactive mode, unless
+--overwrite is given. A node whose registration failed gets no config.toml, so
+running the same file again retries exactly the nodes that did not make it.
 """
 
+import argparse
+import base64
 import getpass
+import http.client
+import json
 import os
+import random
 import re
-import subprocess
+import secrets
 import sys
+import threading
+import time
+import urllib.parse
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from typing import Optional
+
+PLATFORM_API_URL = "http://188.245.104.63:5000"
+TIMEOUT_SECONDS = 10
+# A registration is two small POSTs; a handful at once is plenty and keeps a
+# fleet rollout from looking like a flood to the platform.
+JOBS = 4
+RETRIES = 4
+BACKOFF_SECONDS = 0.5
+SWARM_MODES = ("manager", "worker", "off")
 
 
 # ─── TOML writer (simple, only handles our config shape) ──────────────────────
@@ -36,7 +83,14 @@ def write_toml(data: dict, path: Path) -> None:
             lines.append(f"{k} = {_toml_value(v)}")
         lines.append("")
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text("\n".join(lines))
+    # 0600 from the moment it exists: it can hold the node's WireGuard private
+    # key and the account token, and a chmod after writing leaves a window in
+    # which they are world-readable. fchmod covers a file an earlier run left
+    # with looser permissions.
+    fd = os.open(path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write("\n".join(lines))
 
 
 # ─── Prompts ──────────────────────────────────────────────────────────────────
@@ -55,25 +109,373 @@ def prompt_bool(question: str, default: bool = True) -> bool:
     return value in ("y", "yes")
 
 
+# ─── WireGuard keys ───────────────────────────────────────────────────────────
+#
+# X25519 (RFC 7748) in process, so a key pair is not two `wg` spawns and setup
+# does not depend on wireguard-tools being installed. Python integers are not
+# constant-time; that matters for a long-lived process an attacker can time
+# over many operations, not for a one-shot key generated on the machine it is
+# for.
+
+_P = 2**255 - 19
+_A24 = 121665
+_BASEPOINT = (9).to_bytes(32, "little")
+
+# RFC 7748 §5.2 and §6.1 — the same vectors wireguard-tools checks its own
+# curve25519 against: (scalar, u-coordinate, expected output).
+_X25519_VECTORS = [
+    ("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+     "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+     "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"),
+    ("4b66e9d4d1b4673c5ad22691957d6af5c11b6421e0ea01d42ca4169e7918ba0d",
+     "e5210f12786811d3f4b7959d0538ae2c31dbe7106fc03c3efc4cd549c715a493",
+     "95cbde9476e8907d7aade45cb4b873f88b595a68799fa152e6f8f7647aac7957"),
+    # §5.2's first iteration: k = u = 9.
+    (_BASEPOINT.hex(), _BASEPOINT.hex(),
+     "422c8e7a6227d7bca1350b3e2bb7279f7897b87bb6854b783c60e80311ae3079"),
+    ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+     _BASEPOINT.hex(),
+     "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a"),
+    ("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb",
+     _BASEPOINT.hex(),
+     "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f"),
+    ("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a",
+     "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f",
+     "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742"),
+]
+_x25519_checked = False
+
+
+def _clamp(scalar: bytes) -> bytes:
+    k = bytearray(scalar)
+    k[0] &= 248
+    k[31] &= 127
+    k[31] |= 64
+    return bytes(k)
+
+
+def x25519(scalar: bytes, u: bytes) -> bytes:
+    """RFC 7748 X25519: the Montgomery ladder over Curve25519."""
+    k = int.from_bytes(_clamp(scalar), "little")
+    x1 = int.from_bytes(u, "little") & ((1 << 255) - 1)
+    x2, z2, x3, z3, swap = 1, 0, x1, 1, 0
+    for t in reversed(range(255)):
+        bit = (k >> t) & 1
+        swap ^= bit
+        if swap:
+            x2, x3, z2, z3 = x3, x2, z3, z2
+        swap = bit
+        a, b, c, d = x2 + z2, x2 - z2, x3 + z3, x3 - z3
+        aa, bb = a * a % _P, b * b % _P
+        e = aa - bb
+        da, cb = d * a % _P, c * b % _P
+        x3, z3 = (da + cb) ** 2 % _P, x1 * (da - cb) ** 2 % _P
+        x2, z2 = aa * bb % _P, e * (aa + _A24 * e) % _P
+    if swap:
+        x2, z2 = x3, z3
+    return (x2 * pow(z2, _P - 2, _P) % _P).to_bytes(32, "little")
+
+
+def _check_x25519() -> None:
+    # A wrong public key is not an error anyone sees here: the platform accepts
+    # it, and the tunnel then silently never handshakes. So the arithmetic is
+    # checked against the RFC once before it is trusted with a real key.
+    global _x25519_checked
+    if _x25519_checked:
+        return
+    for scalar, u, expected in _X25519_VECTORS:
+        if x25519(bytes.fromhex(scalar), bytes.fromhex(u)).hex() != expected:
+            raise RuntimeError("X25519 self-check failed against the RFC 7748 vectors")
+    _x25519_checked = True
+
+
+def generate_wg_keypairs(count: int) -> list[tuple[str, str]]:
+    """`count` (private, public) pairs in wg's base64 form.
+
+    Private keys are clamped before encoding, as `wg genkey` does, so the file
+    holds the same thing wg itself would have written.
+    """
+    _check_x25519()
+    pairs = []
+    for _ in range(count):
+        private = _clamp(secrets.token_bytes(32))
+        public = x25519(private, _BASEPOINT)
+        pairs.append((base64.b64encode(private).decode(),
+                      base64.b64encode(public).decode()))
+    return pairs
+
+
 def generate_wg_keypair() -> tuple[str, str]:
-    result = subprocess.run(["wg", "genkey"], capture_output=True, text=True, check=True)
-    private_key = result.stdout.strip()
-    result = subprocess.run(
-        ["wg", "pubkey"], input=private_key, capture_output=True, text=True, check=True
-    )
-    public_key = result.stdout.strip()
-    return private_key, public_key
+    return generate_wg_keypairs(1)[0]
+
+
+# ─── Platform API ─────────────────────────────────────────────────────────────
+
+class PlatformError(Exception):
+    pass
+
+
+class PlatformAPI:
+    """POSTs to the YoLab platform API over keep-alive connections, one per
+    worker thread, retrying what is worth retrying.
+
+    http.client connections are not thread-safe, so each thread keeps its own
+    and reuses it for every node it registers. A dropped connection, a 429 or a
+    502/503/504 is retried with exponential backoff and jitter, honouring
+    Retry-After; anything else — a bad token, a name already taken — is an
+    answer, and retrying it would only repeat it.
+
+    A connection that dropped mid-request may still have created the tunnel,
+    so a retry can leave an orphan behind on the platform. That is the lesser
+    evil: the alternative is a fleet rollout that stops at the first blip.
+    """
+
+    def __init__(self, base_url: str, token: str, retries: int = RETRIES) -> None:
+        u = urllib.parse.urlsplit(base_url.rstrip("/"))
+        if u.scheme not in ("http", "https") or not u.netloc:
+            raise PlatformError(f"not an http(s) URL: {base_url}")
+        self.base_url = base_url.rstrip("/")
+        self._scheme, self._netloc, self._prefix = u.scheme, u.netloc, u.path
+        self._headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {token}",
+        }
+        self.retries = retries
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            cls = (http.client.HTTPSConnection if self._scheme == "https"
+                   else http.client.HTTPConnection)
+            conn = self._local.conn = cls(self._netloc, timeout=TIMEOUT_SECONDS)
+        return conn
+
+    def _drop(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        self._local.conn = None
+        if conn is not None:
+            conn.close()
+
+    def post(self, path: str, payload: dict) -> dict:
+        body = json.dumps(payload).encode()
+        for attempt in range(self.retries + 1):
+            delay = BACKOFF_SECONDS * 2 ** attempt * random.uniform(0.5, 1.5)
+            try:
+                conn = self._connection()
+                conn.request("POST", self._prefix + path, body=body, headers=self._headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                self._drop()
+                error = f"{e.__class__.__name__}: {e}"
+            else:
+                if resp.will_close:
+                    self._drop()
+                if 200 <= resp.status < 300:
+                    return json.loads(data)
+                error = f"HTTP {resp.status}: {data.decode(errors='replace')[:200]}"
+                if resp.status not in (429, 502, 503, 504):
+                    raise PlatformError(f"POST {path}: {error}")
+                retry_after = resp.getheader("Retry-After", "")
+                if retry_after.isdigit():
+                    delay = max(delay, int(retry_after))
+            if attempt < self.retries:
+                time.sleep(delay)
+        raise PlatformError(f"POST {path}: {error} (gave up after {self.retries + 1} tries)")
+
+    def register(self, service_name: str, wg_public_key: str) -> tuple[dict, dict]:
+        """(tunnel, record) for a new tunnel with an AAAA record on it."""
+        # Step 1: create tunnel (WireGuard peer + IPv6, no DNS)
+        tunnel_data = self.post("/tunnels", {"wg_public_key": wg_public_key})
+        # Step 2: attach AAAA record for the management domain
+        record_data = self.post(f"/tunnels/{tunnel_data['tunnel_id']}/records", {
+            "record_type": "AAAA",
+            "name": service_name,
+            "value": tunnel_data["sub_ipv6"],
+        })
+        return tunnel_data, record_data
+
+
+def tunnel_config(api: PlatformAPI, account_token: str, service_name: str,
+                  wg_private_key: str, wg_public_key: str) -> dict:
+    tunnel_data, record_data = api.register(service_name, wg_public_key)
+    return {
+        "enabled": True,
+        "platform_api_url": api.base_url,
+        "account_token": account_token,
+        "tunnel_id": tunnel_data["tunnel_id"],
+        "wg_private_key": wg_private_key,
+        "wg_public_key": wg_public_key,
+        "sub_ipv6": tunnel_data["sub_ipv6"],
+        "dns_url": f"https://{record_data['fqdn']}",
+        "wg_server_endpoint": tunnel_data["wg_server_endpoint"],
+        "wg_server_public_key": tunnel_data["wg_server_public_key"],
+    }
+
+
+def node_config(hostname: str, timezone: str, flake_target: str, repo_path: str,
+                tunnel: dict, swarm: dict) -> dict:
+    return {
+        "homelab": {
+            "hostname": hostname,
+            "timezone": timezone,
+            "locale": "en_US.UTF-8",
+            "ssh_port": 22,
+            "root_ssh_key": "",
+            "allowed_ssh_keys": [],
+            "homelab_password_hash": "",
+            "git_remote": "https://github.com/DemyCode/yolab.git",
+        },
+        "system": {
+            "platform": "darwin",
+            "flake_target": flake_target,
+            "repo_path": repo_path,
+        },
+        "tunnel": tunnel,
+        "swarm": swarm,
+        "node": {"node_id": str(uuid.uuid4())},
+    }
+
+
+# ─── Batch ────────────────────────────────────────────────────────────────────
+
+def load_answers(path: Path) -> dict:
+    if path.suffix == ".json":
+        return json.loads(path.read_text())
+    try:
+        import tomllib
+    except ImportError:
+        # The Python that ships with macOS is 3.9, which has no TOML reader.
+        raise SystemExit(f"{path}: reading TOML needs Python 3.11+; use a .json answer file")
+    with path.open("rb") as f:
+        return tomllib.load(f)
+
+
+def batch_nodes(answers: dict, flake_target: str, repo_path: str) -> list[dict]:
+    """Every node in the answer file with the defaults filled in; exits on the
+    first thing wrong with it, before anything is registered."""
+    defaults = {"timezone": "UTC", "flake_target": flake_target,
+                "repo_path": repo_path, "swarm": "off", "tunnel": "tunnel" in answers}
+    defaults.update(answers.get("defaults", {}))
+    nodes, seen = [], set()
+    for i, raw in enumerate(answers.get("nodes", [])):
+        node = {**defaults, **raw}
+        hostname = node.get("hostname", "")
+        where = f"nodes[{i}]" + (f" ({hostname})" if hostname else "")
+        if not re.fullmatch(r"[a-zA-Z0-9]([a-zA-Z0-9-]{0,61}[a-zA-Z0-9])?", hostname):
+            raise SystemExit(f"{where}: hostname must be a DNS label")
+        if hostname in seen:
+            raise SystemExit(f"{where}: hostname appears twice")
+        seen.add(hostname)
+        if node["swarm"] not in SWARM_MODES:
+            raise SystemExit(f"{where}: swarm must be one of {', '.join(SWARM_MODES)}")
+        # Each node gets its own DNS record, so a fleet cannot share the
+        # interactive default of "homelab".
+        node.setdefault("service_name", hostname)
+        nodes.append(node)
+    if not nodes:
+        raise SystemExit("the answer file lists no [[nodes]]")
+    names = [n["service_name"] for n in nodes if n["tunnel"]]
+    if len(set(names)) != len(names):
+        raise SystemExit("two nodes ask for the same service_name")
+    return nodes
+
+
+def provision(node: dict, keypair: Optional[tuple[str, str]], api: Optional[PlatformAPI],
+              account_token: str, out_dir: Path, overwrite: bool) -> dict:
+    """Register one node's tunnel and write its config.toml; its summary line."""
+    hostname = node["hostname"]
+    path = out_dir / hostname / "config.toml"
+    result = {"hostname": hostname, "config": str(path)}
+    if path.exists() and not overwrite:
+        return {**result, "status": "kept"}
+
+    swarm = ({"enabled": False, "mode": "manager"} if node["swarm"] == "off"
+             else {"enabled": True, "mode": node["swarm"]})
+    tunnel: dict = {"enabled": False}
+    if keypair is not None and api is not None:
+        try:
+            tunnel = tunnel_config(api, account_token, node["service_name"], *keypair)
+        except (PlatformError, KeyError, ValueError) as e:
+            return {**result, "status": "failed", "error": str(e)}
+        result.update(sub_ipv6=tunnel["sub_ipv6"], dns_url=tunnel["dns_url"])
+
+    config = node_config(hostname, node["timezone"], node["flake_target"],
+                         node["repo_path"], tunnel, swarm)
+    write_toml(config, path)
+    return {**result, "status": "written"}
+
+
+def run_batch(args) -> int:
+    answers = load_answers(Path(args.batch))
+    nodes = batch_nodes(answers, args.flake_target, str(args.yolab_dir))
+    out_dir = Path(args.out_dir)
+
+    api, account_token = None, ""
+    if any(n["tunnel"] for n in nodes):
+        t = answers.get("tunnel", {})
+        account_token = t.get("account_token", "")
+        if not account_token:
+            raise SystemExit("nodes want a tunnel but [tunnel] has no account_token")
+        url = args.platform_url or t.get("platform_api_url") or PLATFORM_API_URL
+        try:
+            api = PlatformAPI(url, account_token)
+        except PlatformError as e:
+            raise SystemExit(str(e))
+
+    print(f"Provisioning {len(nodes)} nodes into {out_dir}...")
+    # All the keys up front: pure arithmetic, and the GIL would serialise it on
+    # the pool anyway.
+    wanted = [n["hostname"] for n in nodes if n["tunnel"]]
+    keypairs = dict(zip(wanted, generate_wg_keypairs(len(wanted))))
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        results = list(pool.map(
+            lambda n: provision(n, keypairs.get(n["hostname"]), api, account_token,
+                                out_dir, args.overwrite),
+            nodes,
+        ))
+
+    width = max(len(r["hostname"]) for r in results)
+    for r in results:
+        detail = r.get("dns_url") or r.get("error") or r["config"]
+        print(f"  {r['hostname']:<{width}}  {r['status']:<7}  {detail}")
+    out_dir.mkdir(parents=True, exist_ok=True)
+    (out_dir / "summary.json").write_text(json.dumps(results, indent=2) + "\n")
+    failed = [r["hostname"] for r in results if r["status"] == "failed"]
+    print(f"\n{len(results) - len(failed)} of {len(results)} nodes ready; "
+          f"summary in {out_dir / 'summary.json'}")
+    if failed:
+        print(f"Failed: {' '.join(failed)} — run the same file again to retry them.")
+        return 1
+    return 0
 
 
 # ─── Main ─────────────────────────────────────────────────────────────────────
 
 def main():
-    if len(sys.argv) < 2:
-        print("Usage: setup.py <yolab_dir> [flake_target]")
-        sys.exit(1)
-
-    yolab_dir = Path(sys.argv[1])
-    flake_target = sys.argv[2] if len(sys.argv) > 2 else "yolab-mac"
+    parser = argparse.ArgumentParser(
+        usage="setup.py [--batch FILE --out-dir DIR] <yolab_dir> [flake_target]")
+    parser.add_argument("yolab_dir", type=Path)
+    parser.add_argument("flake_target", nargs="?", default="yolab-mac")
+    parser.add_argument("--batch", metavar="FILE",
+                        help="provision every node in this answer file, no prompts")
+    parser.add_argument("--out-dir", default="nodes",
+                        help="batch: where <hostname>/config.toml go (default: nodes)")
+    parser.add_argument("--jobs", "-j", type=int, default=JOBS,
+                        help=f"batch: nodes registered at once (default: {JOBS})")
+    parser.add_argument("--platform-url",
+                        help="platform API URL, overriding the answer file or prompt")
+    parser.add_argument("--overwrite", action="store_true",
+                        help="batch: replace config.toml files that already exist")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.batch:
+        sys.exit(run_batch(args))
+
+    yolab_dir = args.yolab_dir
+    flake_target = args.flake_target
     config_path = yolab_dir / "homelab" / "ignored" / "config.toml"
 
     if config_path.exists():
@@ -100,93 +502,23 @@ def main():
     tunnel: dict = {"enabled": False}
 
     if wants_tunnel:
-        platform_api_url = prompt("YoLab platform API URL", "http://188.245.104.63:5000")
+        platform_api_url = args.platform_url or prompt("YoLab platform API URL", PLATFORM_API_URL)
         account_token = prompt("Account token")
         service_name = prompt("Service name", "homelab")
 
         print("Generating WireGuard key pair...")
+        wg_private_key, wg_public_key = generate_wg_keypair()
+        print("Registering tunnel with YoLab platform...")
         try:
-            wg_private_key, wg_public_key = generate_wg_keypair()
-        except FileNotFoundError:
-            print("WARNING: 'wg' not found. Install wireguard-tools to enable tunnel.")
-            wants_tunnel = False
-        else:
-            print("Registering tunnel with YoLab platform...")
-            import json
-            import urllib.request
-
-            try:
-                auth_headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {account_token}",
-                }
-
-                # Step 1: create tunnel (WireGuard peer + IPv6, no DNS)
-                payload1 = json.dumps({"wg_public_key": wg_public_key}).encode()
-                req1 = urllib.request.Request(
-                    f"{platform_api_url}/tunnels",
-                    data=payload1,
-                    headers=auth_headers,
-                    method="POST",
-                )
-                with urllib.request.urlopen(req1, timeout=10) as resp1:
-                    tunnel_data = json.loads(resp1.read())
-
-                tunnel_id = tunnel_data["tunnel_id"]
-                sub_ipv6 = tunnel_data["sub_ipv6"]
-
-                # Step 2: attach AAAA record for the management domain
-                payload2 = json.dumps({
-                    "record_type": "AAAA",
-                    "name": service_name,
-                    "value": sub_ipv6,
-                }).encode()
-                req2 = urllib.request.Request(
-                    f"{platform_api_url}/tunnels/{tunnel_id}/records",
-                    data=payload2,
-                    headers=auth_headers,
-                    method="POST",
-                )
-                with urllib.request.urlopen(req2, timeout=10) as resp2:
-                    record_data = json.loads(resp2.read())
-
-                print(f"Tunnel registered — IPv6: {sub_ipv6}")
-                tunnel = {
-                    "enabled": True,
-                    "platform_api_url": platform_api_url,
-                    "account_token": account_token,
-                    "tunnel_id": tunnel_id,
-                    "wg_private_key": wg_private_key,
-                    "wg_public_key": wg_public_key,
-                    "sub_ipv6": sub_ipv6,
-                    "dns_url": f"https://{record_data['fqdn']}",
-                    "wg_server_endpoint": tunnel_data["wg_server_endpoint"],
-                    "wg_server_public_key": tunnel_data["wg_server_public_key"],
-                }
-            except Exception as e:
-                print(f"WARNING: Tunnel registration failed: {e}")
-                print("Continuing without tunnel. You can configure it later.")
-
-    config = {
-        "homelab": {
-            "hostname": hostname,
-            "timezone": timezone,
-            "locale": "en_US.UTF-8",
-            "ssh_port": 22,
-            "root_ssh_key": "",
-            "allowed_ssh_keys": [],
-            "homelab_password_hash": "",
-            "git_remote": "https://github.com/DemyCode/yolab.git",
-        },
-        "system": {
-            "platform": "darwin",
-            "flake_target": flake_target,
-            "repo_path": str(yolab_dir),
-        },
-        "tunnel": tunnel,
-        "swarm": swarm,
-        "node": {"node_id": str(uuid.uuid4())},
-    }
+            api = PlatformAPI(platform_api_url, account_token)
+            tunnel = tunnel_config(api, account_token, service_name,
+                                   wg_private_key, wg_public_key)
+            print(f"Tunnel registered — IPv6: {tunnel['sub_ipv6']}")
+        except Exception as e:
+            print(f"WARNING: Tunnel registration failed: {e}")
+            print("Continuing without tunnel. You can configure it later.")
+
+    config = node_config(hostname, timezone, flake_target, str(yolab_dir), tunnel, swarm)
 
     write_toml(config, config_path)
     print(f"\nConfiguration written to: {config_path}")
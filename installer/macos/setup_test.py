@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""Tests for setup.py: its X25519 key generation, against RFC 7748 and (when
+installed) `wg pubkey`, and its platform client and batch mode, against a
+stand-in platform API on 127.0.0.1.
+
+The stand-in answers POST /tunnels and POST /tunnels/{id}/records the way the
+platform does, and can be told to fail the next few requests with a status and
+a Retry-After, so the retry policy is exercised without a real platform. Sleeps
+are recorded rather than slept.
+
+Run:  python3 installer/macos/setup_test.py
+"""
+
+import argparse
+import base64
+import http.server
+import importlib.util
+import io
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import threading
+import unittest
+from contextlib import redirect_stdout
+from pathlib import Path
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("yolab_setup", os.path.join(HERE, "setup.py"))
+setup = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(setup)
+
+TOKEN = "test-token"
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.failures = []  # (status, retry_after or None), one per request, first first
+        self.requests = []  # (path, body)
+        self.tunnels = 0
+        self.lock = threading.Lock()
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def reply(self, status, payload, headers=()):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        for k, v in headers:
+            self.send_header(k, v)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append((self.path, payload))
+            failure = server.failures.pop(0) if server.failures else None
+        if failure:
+            status, retry_after = failure
+            headers = [("Retry-After", str(retry_after))] if retry_after is not None else []
+            self.reply(status, {"detail": "try later"}, headers)
+            return
+        if self.headers.get("Authorization") != f"Bearer {TOKEN}":
+            self.reply(401, {"detail": "bad token"})
+            return
+        if self.path == "/tunnels":
+            with server.lock:
+                server.tunnels += 1
+                n = server.tunnels
+            self.reply(200, {
+                "tunnel_id": n, "sub_ipv6": f"2001:db8::{n:x}",
+                "wg_server_endpoint": "198.51.100.1:51820",
+                "wg_server_public_key": "c2VydmVy" * 5 + "c2U=",
+            })
+        elif self.path.startswith("/tunnels/") and self.path.endswith("/records"):
+            self.reply(200, {"fqdn": f"{payload['name']}.example.com"})
+        else:
+            self.reply(404, {"detail": "not found"})
+
+    def log_message(self, *args):
+        pass
+
+
+class StandInTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        patcher = mock.patch.object(setup.time, "sleep")
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class PlatformAPITest(StandInTest):
+    def api(self, token=TOKEN, **kwargs):
+        api = setup.PlatformAPI(self.server.url, token, **kwargs)
+        self.addCleanup(api._drop)
+        return api
+
+    def test_5xx_is_retried_until_it_succeeds(self):
+        self.server.failures = [(503, None), (502, None), (504, None)]
+        api = self.api()
+        tunnel, record = api.register("mac-1", "cHVi")
+        self.assertEqual(record["fqdn"], "mac-1.example.com")
+        self.assertEqual(self.sleep.call_count, 3)
+        # Exponential: each wait longer than the one before, jitter included.
+        delays = [c.args[0] for c in self.sleep.call_args_list]
+        self.assertLess(delays[0], delays[2])
+
+    def test_retry_after_is_honoured(self):
+        self.server.failures = [(429, 7)]
+        self.api().post("/tunnels", {"wg_public_key": "cHVi"})
+        self.assertGreaterEqual(self.sleep.call_args.args[0], 7)
+
+    def test_gives_up_after_the_retries(self):
+        self.server.failures = [(503, None)] * 3
+        api = self.api(retries=2)
+        with self.assertRaisesRegex(setup.PlatformError, "gave up after 3 tries"):
+            api.post("/tunnels", {"wg_public_key": "cHVi"})
+
+    def test_a_client_error_is_not_retried(self):
+        api = self.api("wrong-token")
+        with self.assertRaisesRegex(setup.PlatformError, "HTTP 401"):
+            api.post("/tunnels", {"wg_public_key": "cHVi"})
+        self.assertEqual(len(self.server.requests), 1)
+        self.sleep.assert_not_called()
+
+
+class BatchTest(StandInTest):
+    def tempdir(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        return tmp.name
+
+    def run_batch(self, answers, **overrides):
+        tmp = Path(self.tempdir())
+        answers_path = tmp / "fleet.json"
+        answers_path.write_text(json.dumps(answers))
+        args = argparse.Namespace(
+            batch=str(answers_path), out_dir=str(tmp / "nodes"), yolab_dir=tmp,
+            flake_target="yolab-mac", jobs=2, platform_url=self.server.url, overwrite=False,
+        )
+        vars(args).update(overrides)
+        with redirect_stdout(io.StringIO()):
+            code = setup.run_batch(args)
+        return code, Path(args.out_dir)
+
+    def test_configs_are_written_0600_with_their_tunnels(self):
+        self.server.failures = [(503, 1)]
+        code, out = self.run_batch({
+            "tunnel": {"account_token": TOKEN},
+            "nodes": [{"hostname": "mac-1", "swarm": "manager"},
+                      {"hostname": "mac-2"},
+                      {"hostname": "mac-3", "tunnel": False}],
+        })
+        self.assertEqual(code, 0)
+        for host in ("mac-1", "mac-2", "mac-3"):
+            path = out / host / "config.toml"
+            self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o600, host)
+        text = (out / "mac-1" / "config.toml").read_text()
+        self.assertIn('dns_url = "https://mac-1.example.com"', text)
+        self.assertIn('mode = "manager"', text)
+        self.assertIn("[tunnel]\nenabled = false", (out / "mac-3" / "config.toml").read_text())
+        summary = json.loads((out / "summary.json").read_text())
+        self.assertEqual([r["status"] for r in summary], ["written"] * 3)
+
+    def test_failed_nodes_get_no_config_and_are_retried_next_run(self):
+        answers = {"tunnel": {"account_token": TOKEN},
+                   "nodes": [{"hostname": "mac-1"}]}
+        self.server.failures = [(500, None)]
+        tmp = self.tempdir()
+        code, out = self.run_batch(answers, out_dir=os.path.join(tmp, "nodes"))
+        self.assertEqual(code, 1)
+        self.assertFalse((out / "mac-1" / "config.toml").exists())
+        code, out = self.run_batch(answers, out_dir=os.path.join(tmp, "nodes"))
+        self.assertEqual(code, 0)
+        self.assertTrue((out / "mac-1" / "config.toml").exists())
+
+    def test_existing_config_is_tightened_on_overwrite(self):
+        tmp = self.tempdir()
+        path = Path(tmp, "nodes", "mac-1", "config.toml")
+        path.parent.mkdir(parents=True)
+        path.write_text("old")
+        path.chmod(0o644)
+        code, _ = self.run_batch({"nodes": [{"hostname": "mac-1"}]},
+                                 out_dir=os.path.join(tmp, "nodes"), overwrite=True)
+        self.assertEqual(code, 0)
+        self.assertEqual(stat.S_IMODE(path.stat().st_mode), 0o600)
+
+
+class X25519Test(unittest.TestCase):
+    # RFC 7748 §5.2 and §6.1, written out here rather than read from setup.py's
+    # own self-check table, so a typo there cannot make both agree.
+    def test_rfc7748_vectors(self):
+        for scalar, u, out in [
+            ("a546e36bf0527c9d3b16154b82465edd62144c0ac1fc5a18506a2244ba449ac4",
+             "e6db6867583030db3594c1a424b15f7c726624ec26b3353b10a903a6d0ab1c4c",
+             "c3da55379de9c6908e94ea4df28d084f32eccf03491c71f754b4075577a28552"),
+            ("4b66e9d4d1b4673c5ad22691957d6af5c11b6421e0ea01d42ca4169e7918ba0d",
+             "e5210f12786811d3f4b7959d0538ae2c31dbe7106fc03c3efc4cd549c715a493",
+             "95cbde9476e8907d7aade45cb4b873f88b595a68799fa152e6f8f7647aac7957"),
+        ]:
+            self.assertEqual(setup.x25519(bytes.fromhex(scalar), bytes.fromhex(u)).hex(), out)
+
+    def test_rfc7748_iterations(self):
+        k = u = (9).to_bytes(32, "little")
+        for i in range(1, 1001):
+            k, u = setup.x25519(k, u), k
+            if i == 1:
+                self.assertEqual(
+                    k.hex(), "422c8e7a6227d7bca1350b3e2bb7279f7897b87bb6854b783c60e80311ae3079")
+        self.assertEqual(
+            k.hex(), "684cf59ba83309552800ef566f2f4d3c1c3887c49360e3875f2eb94d99532c51")
+
+    def test_rfc7748_diffie_hellman(self):
+        alice = bytes.fromhex("77076d0a7318a57d3c16c17251b26645df4c2f87ebc0992ab177fba51db92c2a")
+        bob = bytes.fromhex("5dab087e624a8a4b79e17f8b83800ee66f3bb1292618b6fd1c2f8b27ff88e0eb")
+        nine = (9).to_bytes(32, "little")
+        alice_pub, bob_pub = setup.x25519(alice, nine), setup.x25519(bob, nine)
+        self.assertEqual(alice_pub.hex(),
+                         "8520f0098930a754748b7ddcb43ef75a0dbf3a0d26381af4eba4a98eaa9b4e6a")
+        self.assertEqual(bob_pub.hex(),
+                         "de9edb7d7b7dc1b4d35b61c2ece435373f8343c85b78674dadfc7e146f882b4f")
+        shared = "4a5d9d5ba4ce2de1728e3bf480350f25e07e21c947d19e3376f09b3c1e161742"
+        self.assertEqual(setup.x25519(alice, bob_pub).hex(), shared)
+        self.assertEqual(setup.x25519(bob, alice_pub).hex(), shared)
+
+    def test_keypairs_are_in_wg_form_and_agree(self):
+        (a_priv, a_pub), (b_priv, b_pub) = setup.generate_wg_keypairs(2)
+        for key in (a_priv, a_pub, b_priv, b_pub):
+            self.assertEqual(len(key), 44)
+            self.assertEqual(len(base64.b64decode(key)), 32)
+        # Clamped as `wg genkey` writes it.
+        raw = base64.b64decode(a_priv)
+        self.assertEqual(raw[0] & 7, 0)
+        self.assertEqual(raw[31] & 0xC0, 0x40)
+        # Each side's public key is what the other needs for the same secret.
+        a_raw, b_raw = base64.b64decode(a_priv), base64.b64decode(b_priv)
+        self.assertEqual(setup.x25519(a_raw, base64.b64decode(b_pub)),
+                         setup.x25519(b_raw, base64.b64decode(a_pub)))
+
+    @unittest.skipUnless(shutil.which("wg"), "wireguard-tools not installed")
+    def test_public_key_matches_wg(self):
+        private, public = setup.generate_wg_keypair()
+        out = subprocess.run(["wg", "pubkey"], input=private, capture_output=True,
+                             text=True, check=True)
+        self.assertEqual(out.stdout.strip(), public)
+
+
+if __name__ == "__main__":
+    unittest.main()
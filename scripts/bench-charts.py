@@ -0,0 +1,465 @@
+#!/usr/bin/env python3
+"""Measure the chart checker without helm or the real catalog.
+
+    python3 scripts/bench-charts.py run [--sizes 100,1000,10000]
+    python3 scripts/bench-charts.py run --save      # record this as the baseline
+    python3 scripts/bench-charts.py capture         # snapshot real renders (needs helm)
+    python3 scripts/bench-charts.py staging [--rounds 5]
+
+`run` times three things separately, on two kinds of fixture:
+
+  parse     check_charts' streaming loader over every chart's rendered YAML
+  check     check_charts.check() over the parsed documents, shell stage included
+  pipeline  check_charts.main() end to end, against a stub helm that returns
+            the fixture instead of rendering
+
+The fixtures are the real catalog's renders, as last snapshotted by `capture`
+into bench-fixtures/, and synthetic catalogs of each --sizes, generated in the
+shape of ours: a gateway pod (wg-register, wireguard, caddy), a Caddyfile
+ConfigMap, Services, a PVC and the pre-delete Job, with the app either in the
+gateway pod or behind a Service of its own and sometimes a database beside it.
+The stub means `pipeline` measures the checker's own overhead — staging,
+scheduling, parsing, rules — and not helm's.
+
+bench-fixtures/ is committed, so `run` needs no helm. Re-run `capture` when a
+chart or the library changes; the renders are deterministic, so the diff is the
+change. Without fixtures, `run` only times the synthetic catalogs and says so.
+
+Results are compared against bench-baseline.json, so a rule that makes the
+checker slower shows up as a percentage against the last `--save`. The committed
+baseline says which Python and machine it came from. Timings only compare on
+like hardware, so on another machine `run --save` first and compare against that.
+
+`staging` builds and tears down every chart's staged tree in each of
+check_charts.py's staging modes and reports wall time, bytes written and
+directory entries created per mode. It needs the packaged library but not a
+working helm render: only `helm package` runs, once.
+
+Byte counts come from /proc/self/io, so they are Linux-only; elsewhere they
+read 0 and only the timings mean anything.
+"""
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG = os.path.join(ROOT, "apps/catalog")
+HERE = os.path.dirname(os.path.abspath(__file__))
+FIXTURES = os.path.join(HERE, "bench-fixtures")
+BASELINE = os.path.join(HERE, "bench-baseline.json")
+
+# A phase this much slower than the baseline is reported as a regression.
+REGRESSION_PCT = 20
+
+# check_charts.py is a script, not a package; importing it from here must not
+# leave a __pycache__ in apps/catalog, where fetch-icons.py would take it for an app.
+sys.dont_write_bytecode = True
+sys.path.insert(0, CATALOG)
+import check_charts  # noqa: E402
+
+
+def io_counters() -> dict[str, int]:
+    try:
+        with open("/proc/self/io") as f:
+            return {k: int(v) for k, v in (line.split(": ") for line in f if line.strip())}
+    except OSError:
+        return {}
+
+
+def count_entries(path: str) -> int:
+    """Directory entries under `path`; a symlinked directory counts once."""
+    n = 0
+    for _, dirs, files in os.walk(path):
+        n += len(dirs) + len(files)
+    return n
+
+
+def chart_dirs() -> list[str]:
+    return sorted(
+        os.path.join(CATALOG, d)
+        for d in os.listdir(CATALOG)
+        if os.path.isfile(os.path.join(CATALOG, d, "Chart.yaml"))
+        and "type: library" not in open(os.path.join(CATALOG, d, "Chart.yaml")).read()
+    )
+
+
+def bench_staging(args: argparse.Namespace) -> int:
+    charts = chart_dirs()
+    version = check_charts.Chart(check_charts.LIBRARY).version
+    print(f"{len(charts)} charts, {args.rounds} rounds each\n")
+    print(f"{'mode':<10} {'per run':>10} {'written':>12} {'entries':>8}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        library = check_charts.Library(check_charts.LIBRARY, version, tmp)
+        library.tgz()  # package outside the timed region
+
+        for mode in check_charts.Stager.MODES:
+            elapsed, written, entries = 0.0, 0, 0
+            for i in range(args.rounds):
+                root = os.path.join(tmp, f"{mode}-{i}")
+                stager = check_charts.Stager(root, library, mode)
+                before, start = io_counters(), time.perf_counter()
+                for chart in charts:
+                    stager.stage(chart)
+                elapsed += time.perf_counter() - start
+                written += io_counters().get("wchar", 0) - before.get("wchar", 0)
+                entries = count_entries(root)
+                # Tearing the tree down is part of the cost the old path paid per chart.
+                start = time.perf_counter()
+                shutil.rmtree(root)
+                elapsed += time.perf_counter() - start
+            print(
+                f"{mode:<10} {elapsed / args.rounds * 1000:>8.1f}ms "
+                f"{written // args.rounds:>10,}B {entries:>8}"
+            )
+    return 0
+
+
+# ─── Fixtures ─────────────────────────────────────────────────────────────────
+
+DIGEST = "@sha256:" + "0" * 64
+# Shared library scripts are byte-identical across charts in the real catalog;
+# the app's own launcher differs per chart. Keep both properties here, or the
+# shell stage's deduplication is measured against the wrong workload.
+WG_REGISTER_SCRIPT = ". /yolab/env 2>/dev/null || true\nexec /usr/local/bin/setup.sh\n"
+YOLAB_ENV_SCRIPT = (
+    "until [ -s /state/wg-state.json ]; do\n  sleep 2\ndone\n"
+    "FQDN=$(jq -r '.fqdn // empty' /state/wg-state.json)\n"
+    "printf 'export YOLAB_FQDN=%s\\n' \"$FQDN\" > /yolab/env\n"
+)
+
+
+def container(name: str, image: str, **extra) -> dict:
+    return {"name": name, "image": f"{image}{DIGEST}", "imagePullPolicy": "IfNotPresent", **extra}
+
+
+def deployment(name: str, spec: dict) -> dict:
+    return {
+        "apiVersion": "apps/v1",
+        "kind": "Deployment",
+        "metadata": {"name": name},
+        "spec": {
+            "replicas": 1,
+            "selector": {"matchLabels": {"app": name}},
+            "template": {"metadata": {"labels": {"app": name}}, "spec": spec},
+        },
+    }
+
+
+def service(name: str, port: int) -> dict:
+    return {
+        "apiVersion": "v1",
+        "kind": "Service",
+        "metadata": {"name": name},
+        "spec": {"selector": {"app": name}, "ports": [{"port": port, "targetPort": port}]},
+    }
+
+
+def synthetic_chart(app: str, rng: random.Random) -> list[dict]:
+    """One chart's rendered documents, shaped like the catalog's."""
+    port = rng.choice([3000, 8000, 8080, 8096, 9000])
+    in_pod = rng.random() < 0.5
+    with_db = rng.random() < 0.4
+    yolab = {"name": "yolab", "mountPath": "/yolab"}
+    data = {"name": "data", "mountPath": "/data", "subPath": f"release/{app}"}
+
+    app_container = container(
+        app, f"example/{app}:1.0",
+        command=["/bin/sh", "-c", f". /yolab/env\nexport APP_URL=\"$YOLAB_URL\"\n"
+                                  f"exec /{app}-entrypoint --port {port}\n"],
+        ports=[{"containerPort": port}],
+        env=[{"name": f"{app.upper()}_{i}", "value": str(rng.random())} for i in range(8)],
+        readinessProbe={"httpGet": {"path": "/", "port": port},
+                        "initialDelaySeconds": 10, "periodSeconds": 10},
+        volumeMounts=[data, yolab],
+    )
+    gateway_spec = {
+        "initContainers": [container(
+            "wg-register", "ghcr.io/demycode/wg-register:main",
+            command=["/bin/sh", "-c", WG_REGISTER_SCRIPT],
+            env=[{"name": "ACCOUNT_TOKEN", "valueFrom": {
+                "secretKeyRef": {"name": "yolab-tunnel-credentials", "key": "token"}}}],
+            volumeMounts=[{"name": "gateway-state", "mountPath": "/state"}, yolab],
+        )],
+        "containers": [
+            container("wireguard", "ghcr.io/demycode/wg-sidecar:main",
+                      securityContext={"privileged": True},
+                      volumeMounts=[{"name": "gateway-state", "mountPath": "/state"}]),
+            container("caddy", "docker.io/library/caddy:2",
+                      ports=[{"containerPort": 80}],
+                      volumeMounts=[{"name": "caddyfile", "mountPath": "/etc/caddy"}, yolab]),
+        ],
+        "volumes": [{"name": "gateway-state", "persistentVolumeClaim": {"claimName": "release-data"}},
+                    {"name": "caddyfile", "configMap": {"name": "caddyfile"}},
+                    {"name": "yolab", "emptyDir": {}},
+                    {"name": "data", "persistentVolumeClaim": {"claimName": "release-data"}}],
+    }
+    docs = []
+    if in_pod:
+        gateway_spec["containers"].append(app_container)
+        upstream = f"localhost:{port}"
+    else:
+        docs.append(deployment(app, {
+            "initContainers": [container(
+                "yolab-env", "ghcr.io/demycode/wg-register:main",
+                command=["/bin/sh", "-c", YOLAB_ENV_SCRIPT],
+                volumeMounts=[{"name": "data", "mountPath": "/state"}, yolab],
+            )],
+            "containers": [app_container],
+            "volumes": [{"name": "yolab", "emptyDir": {}},
+                        {"name": "data", "persistentVolumeClaim": {"claimName": "release-data"}}],
+        }))
+        docs.append(service(app, port))
+        upstream = f"{app}:{port}"
+    if with_db:
+        docs.append(deployment("postgres", {
+            "containers": [container(
+                "postgres", "docker.io/library/postgres:17-alpine",
+                ports=[{"containerPort": 5432}],
+                volumeMounts=[{"name": "data", "mountPath": "/var/lib/postgresql/data"}],
+            )],
+            "volumes": [{"name": "data", "persistentVolumeClaim": {"claimName": "release-data"}}],
+        }))
+        docs.append(service("postgres", 5432))
+
+    caddyfile = (
+        "{\n  auto_https off\n  admin off\n}\n:80 {\n"
+        + "".join(f"  header X-Pad-{i} \"{'x' * rng.randint(8, 64)}\"\n" for i in range(10))
+        + f"  reverse_proxy {upstream}\n}}\n"
+    )
+    return [
+        {"apiVersion": "v1", "kind": "ConfigMap", "metadata": {"name": "caddyfile"},
+         "data": {"Caddyfile": caddyfile}},
+        {"apiVersion": "v1", "kind": "PersistentVolumeClaim", "metadata": {"name": "release-data"},
+         "spec": {"accessModes": ["ReadWriteMany"], "storageClassName": "yolab-cephfs",
+                  "resources": {"requests": {"storage": "1Gi"}}}},
+        deployment("gateway", gateway_spec),
+        service("gateway", 80),
+        *docs,
+        {"apiVersion": "batch/v1", "kind": "Job", "metadata": {
+            "name": "release-uninstall", "annotations": {"helm.sh/hook": "pre-delete"}},
+         "spec": {"template": {"spec": {"restartPolicy": "Never", "containers": [container(
+             "cleanup", "ghcr.io/demycode/wg-register:main",
+             env=[{"name": "ACCOUNT_TOKEN", "valueFrom": {
+                 "secretKeyRef": {"name": "yolab-tunnel-credentials", "key": "token"}}}],
+         )]}}}},
+    ]
+
+
+def as_helm_output(app: str, docs: list[dict]) -> str:
+    """Documents as `helm template` prints them, `# Source:` headers included."""
+    return "".join(
+        f"---\n# Source: {app}/templates/app.yaml\n" + yaml.safe_dump(d, sort_keys=False)
+        for d in docs
+    )
+
+
+def synthetic_catalog(n: int) -> dict[str, str]:
+    rng = random.Random(n)  # the same catalog every run, so runs are comparable
+    return {f"app{i:05d}": as_helm_output(f"app{i:05d}", synthetic_chart(f"app{i:05d}", rng))
+            for i in range(n)}
+
+
+def captured_catalog() -> dict[str, str]:
+    if not os.path.isdir(FIXTURES):
+        return {}
+    return {
+        name[: -len(".yaml")]: open(os.path.join(FIXTURES, name)).read()
+        for name in sorted(os.listdir(FIXTURES))
+        if name.endswith(".yaml")
+    }
+
+
+# ─── Phases ───────────────────────────────────────────────────────────────────
+
+STUB_HELM = """#!/bin/sh
+# Stand-in for helm: `template` returns the fixture the bench put in the chart.
+case "$1" in
+  version) echo v0.0.0-bench ;;
+  package) for a; do [ "$prev" = --destination ] && : > "$a/yolab-common-0.0.0.tgz"; prev=$a; done ;;
+  template) cat "$3/rendered.yaml" ;;
+esac
+"""
+
+
+def time_parse(catalog: dict[str, str]) -> tuple[float, dict[str, list]]:
+    start = time.perf_counter()
+    parsed = {
+        app: check_charts.load_documents(io.StringIO(text), check_charts.RULE_KINDS)
+        for app, text in catalog.items()
+    }
+    return time.perf_counter() - start, parsed
+
+
+def time_check(parsed: dict[str, list]) -> float:
+    start = time.perf_counter()
+    shell = check_charts.ShellSyntax()
+    fail = check_charts.Failures()
+    for app, docs in parsed.items():
+        chart = check_charts.Failures(shell)
+        check_charts.check(app, docs, chart)
+        fail.extend(chart)
+    shell.run(os.cpu_count() or 1)
+    fail.resolve(shell)
+    return time.perf_counter() - start
+
+
+def time_pipeline(catalog: dict[str, str], tmp: str) -> float:
+    bindir = os.path.join(tmp, "bin")
+    os.makedirs(bindir, exist_ok=True)
+    helm = os.path.join(bindir, "helm")
+    with open(helm, "w") as f:
+        f.write(STUB_HELM)
+    os.chmod(helm, os.stat(helm).st_mode | stat.S_IXUSR)
+
+    charts = []
+    root = tempfile.mkdtemp(dir=tmp)
+    for app, text in catalog.items():
+        chart = os.path.join(root, app)
+        os.makedirs(os.path.join(chart, "templates"))
+        with open(os.path.join(chart, "Chart.yaml"), "w") as f:
+            f.write(f"apiVersion: v2\nname: {app}\nversion: 0.1.0\n")
+        with open(os.path.join(chart, "rendered.yaml"), "w") as f:
+            f.write(text)
+        charts.append(chart)
+
+    path = os.environ["PATH"]
+    os.environ["PATH"] = f"{bindir}{os.pathsep}{path}"
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            check_charts.main(["check_charts.py", "--no-cache", *charts])
+        return time.perf_counter() - start
+    finally:
+        os.environ["PATH"] = path
+        shutil.rmtree(root)
+
+
+def bench_run(args: argparse.Namespace) -> int:
+    suites = {}
+    captured = captured_catalog()
+    if captured:
+        suites["captured"] = captured
+    else:
+        print(f"no captured fixtures in {os.path.relpath(FIXTURES, ROOT)}; timing synthetic "
+              f"catalogs only. `capture` makes them (needs helm)\n")
+    for n in args.sizes:
+        suites[f"synthetic-{n}"] = synthetic_catalog(n)
+
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, catalog in suites.items():
+            parse, parsed = time_parse(catalog)
+            results[name] = {
+                "charts": len(catalog),
+                "parse": parse,
+                "check": time_check(parsed),
+                "pipeline": time_pipeline(catalog, tmp),
+            }
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save:
+        with open(args.baseline) as f:
+            saved = json.load(f)
+        baseline = saved.get("results", {})
+        here = (platform.python_version(), platform.machine())
+        if (saved.get("python"), saved.get("machine")) != here:
+            print(f"baseline is from Python {saved.get('python')} on {saved.get('machine')}, "
+                  f"this is {here[0]} on {here[1]}: the percentages compare machines too\n")
+
+    regressions = 0
+    print(f"{'suite':<18} {'charts':>7} {'parse':>10} {'check':>10} {'pipeline':>10}")
+    for name, r in results.items():
+        cells = []
+        for phase in ("parse", "check", "pipeline"):
+            cell = f"{r[phase] * 1000:.0f}ms"
+            was = baseline.get(name, {}).get(phase)
+            if was:
+                pct = (r[phase] - was) / was * 100
+                cell += f" ({pct:+.0f}%)"
+                if pct > args.threshold:
+                    regressions += 1
+            cells.append(cell)
+        print(f"{name:<18} {r['charts']:>7} " + " ".join(f"{c:>10}" for c in cells))
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump({
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "rules": [name for name, _ in check_charts.RULES],
+                "results": results,
+            }, f, indent=2)
+            f.write("\n")
+        print(f"\nbaseline saved to {os.path.relpath(args.baseline, ROOT)}")
+    elif regressions:
+        print(f"\n{regressions} phase(s) more than {args.threshold}% slower than the baseline")
+        return 1
+    return 0
+
+
+def bench_capture(args: argparse.Namespace) -> int:
+    """Render the real catalog once and keep the YAML as fixtures."""
+    charts = chart_dirs()
+    version = check_charts.Chart(check_charts.LIBRARY).version
+    if os.path.isdir(FIXTURES):
+        shutil.rmtree(FIXTURES)
+    os.makedirs(FIXTURES)
+    with tempfile.TemporaryDirectory() as tmp:
+        library = check_charts.Library(check_charts.LIBRARY, version, tmp)
+        stager = check_charts.Stager(os.path.join(tmp, "staged"), library)
+        for chart in charts:
+            app = os.path.basename(chart)
+            rendered, err = check_charts.render(stager.stage(chart))
+            if rendered is None:
+                print(f"skipped {app}: {err.splitlines()[-1] if err else 'helm failed'}")
+                continue
+            with open(os.path.join(FIXTURES, f"{app}.yaml"), "w") as f:
+                f.write(rendered)
+    print(f"captured {len(os.listdir(FIXTURES))} charts into {os.path.relpath(FIXTURES, ROOT)}")
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="bench", required=True)
+    run = sub.add_parser(
+        "run", help="parse / check / pipeline timings, on the captured and synthetic catalogs",
+    )
+    run.add_argument(
+        "--sizes", type=lambda v: [int(n) for n in v.split(",")], default=[100, 1000, 10000],
+        help="synthetic catalog sizes (default: 100,1000,10000)",
+    )
+    run.add_argument("--baseline", default=BASELINE)
+    run.add_argument("--save", action="store_true", help="record these results as the baseline")
+    run.add_argument(
+        "--threshold", type=float, default=REGRESSION_PCT,
+        help=f"percent slower than baseline that counts as a regression (default: {REGRESSION_PCT})",
+    )
+    run.set_defaults(func=bench_run)
+    capture = sub.add_parser(
+        "capture", help="re-snapshot the real catalog's renders into bench-fixtures/ "
+                        "(needs helm)",
+    )
+    capture.set_defaults(func=bench_capture)
+    staging = sub.add_parser("staging", help="copy vs symlink vs hardlink staging")
+    staging.add_argument("--rounds", type=int, default=5)
+    staging.set_defaults(func=bench_staging)
+    args = parser.parse_args()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
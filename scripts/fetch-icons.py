@@ -2,6 +2,10 @@
 """Download a real logo for every catalog app and regenerate the manifest.
 
     nix develop --command python3 scripts/fetch-icons.py
+    python3 scripts/fetch-icons.py --selfhst http://127.0.0.1:8000/selfhst \\
+        --dashboard http://127.0.0.1:8000/dashboard --out-dir /tmp/icons \\
+        --manifest /tmp/icons.ts        # against a local stand-in
+    python3 scripts/fetch-icons.py --offline   # rebuild icons.ts from the cache alone
 
 Run this after adding a chart. Icons are committed and served from the box
 rather than hotlinked: a house with no working internet is exactly when someone
@@ -15,12 +19,40 @@ backgrounds — using it in dark mode would strip the gradient out of Jellyfin
 and the colour out of everything else. Legibility on dark is handled in the UI
 instead, by rendering every logo on a light plate the way a phone home screen
 does.
+
+Every response is kept in a local cache with its ETag and Last-Modified, and
+each later run asks the CDN only whether a logo changed, so adding a chart
+downloads one logo, not sixty.
+
+What is committed is a single sprite sheet with a <symbol> per app: SVGs
+stripped of editor cruft with their coordinates rounded, PNGs downscaled and
+embedded. The Discover and Home pages used to make a request per tile, and over
+a WireGuard tunnel to a Pi each of those was a round trip the page waited on.
+
+The sheet is named after its own content hash, with a gzip copy beside it.
+Caddy serves hashed names as immutable and sends the precompressed copy, so a
+returning browser does not ask for it at all, and a new logo is a new name
+rather than a stale cache.
 """
 
+import argparse
+import base64
+import gzip
+import hashlib
+import http.client
+import io
+import json
+import math
 import os
+import re
 import shutil
+import struct
 import subprocess
 import sys
+import tempfile
+import threading
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
 
 ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 CATALOG = os.path.join(ROOT, "apps/catalog")
@@ -42,56 +74,551 @@ ALIASES = {
 SVG_MAX_BYTES = 40_000
 PNG_MAX_PX = 128
 
+# What an SVG editor leaves in a file that no browser draws: the XML prolog,
+# comments, metadata, and Inkscape/Sketch/Affinity state.
+EDITORS = "inkscape|sodipodi|sketch|serif|dc|cc|rdf"
+SVG_CRUFT = [
+    re.compile(r"<\?xml.*?\?>", re.S),
+    re.compile(r"<!DOCTYPE[^[>]*(\[.*?\])?\s*>", re.S),
+    re.compile(r"<!--.*?-->", re.S),
+    re.compile(r"<(metadata|title|desc)\b[^>]*?(/>|>.*?</\1>)", re.S),
+    re.compile(rf"<({EDITORS}):([\w.-]+)\b[^>]*?(/>|>.*?</\1:\2>)", re.S),
+    re.compile(rf'\s(xmlns:)?({EDITORS})(:[\w.-]+)?="[^"]*"'),
+    re.compile(r'\s(data-name|enable-background)="[^"]*"'),
+]
+NUMBER_RE = re.compile(r"-?(?:\d+\.\d*|\.\d+|\d+)(?:[eE][-+]?\d+)?")
+ATTR_RE = re.compile(r'([\w:.-]+)\s*=\s*("[^"]*"|\'[^\']*\')')
+# Root <svg> attributes that mean nothing on a <symbol>; the rest (fill, style,
+# stroke-*, ...) are presentation and carry over.
+SYMBOL_DROP = {"id", "x", "y", "width", "height", "version", "baseProfile"}
+SPRITE = "sprite.{hash}.svg"
+
+# Per request. Apps are fetched side by side, so a CDN that hangs on one logo
+# costs that app this long, not the whole run.
+TIMEOUT_SECONDS = 20
+MAX_REDIRECTS = 5
+# Both CDNs are jsDelivr. A handful of connections is plenty and stays polite.
+JOBS = 8
+
+CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"),
+    "yolab", "fetch-icons",
+)
+
+
+class IconCache:
+    """Every logo fetched so far, with what is needed to ask whether it changed.
+
+    icons.json maps app -> source URL -> {etag, last_modified, sha256}, and the
+    bodies live under blobs/ by content hash. It also keeps each app's shrunk
+    PNG along with the hash of the body it was made from, so a logo whose source
+    has not changed is not shrunk again.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.blobs = os.path.join(path, "blobs")
+        os.makedirs(self.blobs, exist_ok=True)
+        self.index = os.path.join(path, "icons.json")
+        self.sources: dict[str, dict[str, dict]] = {}
+        self.outputs: dict[str, dict] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.index) as f:
+                data = json.load(f)
+            self.sources, self.outputs = data["sources"], data["outputs"]
+        except (FileNotFoundError, ValueError, KeyError):
+            pass  # first run, or a torn write: everything is simply fetched again
+
+    def entry(self, app_id: str, url: str) -> dict | None:
+        with self._lock:
+            return self.sources.get(app_id, {}).get(url)
+
+    def body(self, entry: dict) -> bytes | None:
+        try:
+            with open(os.path.join(self.blobs, entry["sha256"]), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def _blob(self, body: bytes) -> str:
+        digest = hashlib.sha256(body).hexdigest()
+        blob = os.path.join(self.blobs, digest)
+        if not os.path.exists(blob):
+            with open(blob, "wb") as f:
+                f.write(body)
+        return digest
+
+    def store(self, app_id: str, url: str, body: bytes, etag: str | None,
+              last_modified: str | None) -> None:
+        digest = self._blob(body)
+        with self._lock:
+            self.sources.setdefault(app_id, {})[url] = {
+                "etag": etag, "last_modified": last_modified, "sha256": digest,
+            }
+
+    def forget(self, app_id: str, url: str) -> None:
+        with self._lock:
+            self.sources.get(app_id, {}).pop(url, None)
+
+    def shrunk(self, app_id: str, source: bytes) -> bytes | None:
+        """The PNG made from `source` last time, if there was one."""
+        made = self.outputs.get(app_id)
+        if not made or made.get("source") != hashlib.sha256(source).hexdigest():
+            return None
+        return self.body(made)
+
+    def store_shrunk(self, app_id: str, source: bytes, body: bytes) -> None:
+        self.outputs[app_id] = {
+            "source": hashlib.sha256(source).hexdigest(), "sha256": self._blob(body),
+        }
 
-def fetch(url: str) -> bytes | None:
-    r = subprocess.run(["curl", "-sfL", "--max-time", "20", url], capture_output=True)
-    return r.stdout if r.returncode == 0 and r.stdout else None
+    def save(self, app_ids: list[str]) -> None:
+        # Apps no longer in the catalog drop out, and with them any blob nothing
+        # refers to any more.
+        self.sources = {a: u for a, u in self.sources.items() if a in app_ids and u}
+        self.outputs = {a: o for a, o in self.outputs.items() if a in app_ids}
+        live = {e["sha256"] for urls in self.sources.values() for e in urls.values()}
+        live |= {o.get("sha256") for o in self.outputs.values()}
+        for name in os.listdir(self.blobs):
+            if name not in live:
+                os.remove(os.path.join(self.blobs, name))
+        fd, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({"sources": self.sources, "outputs": self.outputs}, f,
+                      indent=1, sort_keys=True)
+        os.replace(tmp, self.index)
 
 
-def shrink_png(path: str) -> None:
-    if not shutil.which("magick"):
-        return
-    subprocess.run(
-        ["magick", path, "-resize", f"{PNG_MAX_PX}x{PNG_MAX_PX}", "-strip", path],
-        check=False,
+class Fetcher:
+    """GETs over keep-alive connections, one per host per worker thread,
+    conditional on what `cache` already holds.
+
+    A new process and TLS handshake per URL was most of the time spent on a logo
+    that is a few kilobytes. http.client connections are not thread-safe, so
+    each thread keeps its own and reuses it for every app it fetches. Offline,
+    nothing goes out and whatever the cache holds is the answer.
+    """
+
+    def __init__(self, cache: IconCache, offline: bool = False) -> None:
+        self.cache = cache
+        self.offline = offline
+        self.counts = {"fetched": 0, "unchanged": 0, "missing": 0, "failed": 0}
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def _count(self, what: str) -> None:
+        with self._lock:
+            self.counts[what] += 1
+
+    def _connection(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        conns = self._local.__dict__.setdefault("conns", {})
+        conn = conns.get((scheme, netloc))
+        if conn is None:
+            cls = http.client.HTTPSConnection if scheme == "https" else http.client.HTTPConnection
+            conn = conns[(scheme, netloc)] = cls(netloc, timeout=TIMEOUT_SECONDS)
+        return conn
+
+    def _drop(self, scheme: str, netloc: str) -> None:
+        conn = self._local.__dict__.get("conns", {}).pop((scheme, netloc), None)
+        if conn is not None:
+            conn.close()
+
+    def get(self, app_id: str, url: str) -> bytes | None:
+        """The current body at `url`, from the cache when the CDN says it has not
+        changed; None when there is none. Only a 404 or 410 says the logo is gone;
+        any other failure keeps the cached one."""
+        cached = self.cache.entry(app_id, url)
+        if self.offline:
+            return self.cache.body(cached) if cached else None
+        headers = {"User-Agent": "yolab-fetch-icons"}
+        if cached and self.cache.body(cached) is not None:
+            if cached["etag"]:
+                headers["If-None-Match"] = cached["etag"]
+            if cached["last_modified"]:
+                headers["If-Modified-Since"] = cached["last_modified"]
+        else:
+            cached = None
+        resp, body = self._request(url, headers)
+        if resp is None:
+            # Unreachable: keep serving what we had rather than losing the logo.
+            return self.cache.body(cached) if cached else None
+        if resp.status == 304 and cached:
+            self._count("unchanged")
+            return self.cache.body(cached)
+        if resp.status == 200 and body:
+            self._count("fetched")
+            self.cache.store(app_id, url, body, resp.getheader("ETag"),
+                             resp.getheader("Last-Modified"))
+            return body
+        if resp.status in (404, 410):
+            self._count("missing")
+            self.cache.forget(app_id, url)
+            return None
+        # A 5xx or a 429 is the CDN having a bad minute. Dropping the logo for it
+        # would delete the committed file on the next run.
+        self._count("failed")
+        print(f"  {url}: HTTP {resp.status}", file=sys.stderr)
+        return self.cache.body(cached) if cached else None
+
+    def _request(self, url: str, headers: dict):
+        """(response, body) for a GET, following redirects; (None, None) when the
+        server could not be reached at all."""
+        for _ in range(MAX_REDIRECTS + 1):
+            u = urllib.parse.urlsplit(url)
+            path = u.path + (f"?{u.query}" if u.query else "")
+            # A kept-alive connection the server has since closed fails on first
+            # use; that one retry is on a fresh connection, not a second chance
+            # for a request that really failed.
+            for attempt in (0, 1):
+                conn = self._connection(u.scheme, u.netloc)
+                try:
+                    conn.request("GET", path, headers=headers)
+                    resp = conn.getresponse()
+                    body = resp.read()
+                    break
+                except (http.client.RemoteDisconnected, BrokenPipeError,
+                        ConnectionResetError) as e:
+                    self._drop(u.scheme, u.netloc)
+                    if attempt:
+                        print(f"  {url}: {e}", file=sys.stderr)
+                        return None, None
+                except (OSError, http.client.HTTPException) as e:
+                    self._drop(u.scheme, u.netloc)
+                    print(f"  {url}: {e}", file=sys.stderr)
+                    return None, None
+            if resp.will_close:
+                self._drop(u.scheme, u.netloc)
+            if resp.status in (301, 302, 303, 307, 308) and resp.getheader("Location"):
+                url = urllib.parse.urljoin(url, resp.getheader("Location"))
+                continue
+            return resp, body
+        return None, None
+
+
+def fetch_logo(fetcher: Fetcher, selfhst: str, dashboard: str, app_id: str):
+    """(svg, png) for one app, either or both None, trying the sources in the
+    same order as always: an SVG from either CDN, then a PNG when there is no
+    SVG or it is too big to be a real vector even once minified."""
+    name = ALIASES.get(app_id, app_id)
+    svg = fetcher.get(app_id, f"{selfhst}/svg/{name}.svg") or fetcher.get(
+        app_id, f"{dashboard}/svg/{name}.svg"
     )
+    png = None
+    if svg is None or len(minify_svg(svg)) > SVG_MAX_BYTES:
+        png = fetcher.get(app_id, f"{selfhst}/png/{name}.png") or fetcher.get(
+            app_id, f"{dashboard}/png/{name}.png"
+        )
+    return svg, png
+
+
+def _number(m: re.Match, places: int) -> str:
+    text = m.group(0)
+    # Integers are left exactly as written: in a path they may be arc flags run
+    # together with the next number ("015" is 0, 1, 5), which rounding would eat.
+    if "." not in text and "e" not in text.lower():
+        return text
+    out = f"{round(float(text), places):.{places}f}".rstrip("0").rstrip(".")
+    if out.startswith("0."):
+        out = out[1:]
+    elif out.startswith("-0."):
+        out = "-" + out[2:]
+    return "0" if out in ("", "-0", "-") else out
+
+
+def _round_numbers(value: str, places: int) -> str:
+    out, last, prev = [], 0, None
+    for m in NUMBER_RE.finditer(value):
+        sep, number = value[last:m.start()], _number(m, places)
+        # "1.5.5" and "3-0.0004" are two numbers each; once they round to "2.5"
+        # and "30" they would read as one, so put a separator back.
+        if not sep and prev is not None and (
+            number[0].isdigit() or (number[0] == "." and "." not in prev)
+        ):
+            sep = " "
+        out += [sep, number]
+        prev, last = number, m.end()
+    out.append(value[last:])
+    return "".join(out)
+
+
+def minify_svg(svg: bytes) -> bytes:
+    """The same drawing with the editor's leftovers removed and coordinates cut
+    to the precision the icon is ever shown at.
+
+    A logo is drawn at 36 px, so a coordinate to six decimals in a 512-unit box
+    is describing detail a thousand times finer than a pixel. Rounding keeps the
+    error under a ten-thousandth of the view box, which no one can see.
+    """
+    text = svg.decode("utf-8", "replace")
+    for pattern in SVG_CRUFT:
+        text = pattern.sub("", text)
+    box = re.search(r'viewBox="([^"]*)"', text)
+    extent = NUMBER_RE.findall(box.group(1))[2:] if box else []
+    size = max((abs(float(n)) for n in extent), default=0)
+    places = max(0, math.ceil(-math.log10(size / 10_000))) if size else 3
+
+    def shorten(m: re.Match) -> str:
+        name, value = m.group(1), m.group(2)
+        # Arc flags may be packed against the next number; see _number.
+        if name == "d" and re.search(r"[aA]", value):
+            return m.group(0)
+        return f'{name}="{_round_numbers(value, places)}"'
+
+    text = re.sub(r'\b(d|points|transform)="([^"]*)"', shorten, text)
+    if "<text" not in text:
+        # Whitespace between tags only matters inside text, which logos
+        # almost never use.
+        text = re.sub(r">\s+<", "><", text)
+    return text.strip().encode()
+
+
+def shrink_pngs(pngs: dict[str, bytes]) -> dict[str, bytes]:
+    """Every PNG scaled down to at most PNG_MAX_PX and recompressed, in one go.
+
+    Pillow when it is installed (the dev shell has it), else one mogrify over
+    the whole batch rather than a process per file, else the PNGs as they came.
+    A result that came out bigger than what went in is not used.
+    """
+    if not pngs:
+        return {}
+    shrunk: dict[str, bytes] = {}
+    try:
+        from PIL import Image
+    except ImportError:
+        Image = None
+    if Image is not None:
+        for app_id, body in pngs.items():
+            try:
+                with Image.open(io.BytesIO(body)) as img:
+                    img.thumbnail((PNG_MAX_PX, PNG_MAX_PX))
+                    out = io.BytesIO()
+                    img.save(out, "PNG", optimize=True)
+                shrunk[app_id] = out.getvalue()
+            except OSError as e:
+                print(f"  {app_id}.png: {e}", file=sys.stderr)
+    else:
+        tool = (["magick", "mogrify"] if shutil.which("magick")
+                else ["mogrify"] if shutil.which("mogrify") else None)
+        if tool is None:
+            print("  neither Pillow nor ImageMagick found: PNGs left as fetched",
+                  file=sys.stderr)
+        else:
+            with tempfile.TemporaryDirectory() as tmp:
+                paths = {a: os.path.join(tmp, f"{a}.png") for a in pngs}
+                for app_id, path in paths.items():
+                    with open(path, "wb") as f:
+                        f.write(pngs[app_id])
+                subprocess.run(
+                    tool + ["-resize", f"{PNG_MAX_PX}x{PNG_MAX_PX}>", "-strip",
+                            "-define", "png:compression-level=9", *paths.values()],
+                    check=False,
+                )
+                for app_id, path in paths.items():
+                    with open(path, "rb") as f:
+                        shrunk[app_id] = f.read()
+    return {
+        a: shrunk[a] if shrunk.get(a) and len(shrunk[a]) < len(body) else body
+        for a, body in pngs.items()
+    }
+
+
+def _svg_symbol(symbol: str, svg: bytes) -> tuple[str, dict[str, str]]:
+    """One logo as a <symbol>, and the namespaces its content needs declared on
+    the sheet.
+
+    Every icon now shares one document, so an id or class one logo defines
+    could restyle another: `a` is a gradient in half of them. Each is prefixed
+    with the symbol id, along with everything that refers to it.
+    """
+    text = svg.decode()
+    m = re.search(r"<svg\b([^>]*)>(.*)</svg>", text, re.S)
+    if not m:
+        raise ValueError("no <svg> element")
+    attrs = dict(ATTR_RE.findall(m.group(1)))
+    attrs = {k: v[1:-1] for k, v in attrs.items()}
+    body = m.group(2)
+    namespaces = {k: v for k, v in attrs.items() if k.startswith("xmlns:")}
+    if "viewBox" not in attrs:
+        w, h = (re.sub(r"px$", "", attrs.get(k, "")) for k in ("width", "height"))
+        if not (w and h):
+            raise ValueError("no viewBox and no size to make one from")
+        attrs["viewBox"] = f"0 0 {w} {h}"
+    kept = {k: v for k, v in attrs.items()
+            if k not in SYMBOL_DROP and not k.startswith("xmlns")}
+
+    ids = set(re.findall(r'\bid="([^"]+)"', body))
+    classes = {c for v in re.findall(r'\bclass="([^"]*)"', body) + [kept.get("class", "")]
+               for c in v.split()}
+    if ids:
+        alt = "|".join(re.escape(i) for i in sorted(ids, key=len, reverse=True))
+        body = re.sub(rf'\bid="({alt})"', rf'id="{symbol}-\1"', body)
+        body = re.sub(rf"(url\(['\"]?#|href=\"#)({alt})(?=['\")])",
+                      rf"\1{symbol}-\2", body)
+    if classes:
+        def prefix_classes(m: re.Match) -> str:
+            scoped = " ".join(f"{symbol}-{c}" for c in m.group(1).split())
+            return f'class="{scoped}"'
+        body = re.sub(r'\bclass="([^"]*)"', prefix_classes, body)
+        if "class" in kept:
+            kept["class"] = " ".join(f"{symbol}-{c}" for c in kept["class"].split())
+
+    def scope_style(m: re.Match) -> str:
+        css = m.group(2)
+        if classes:
+            alt = "|".join(re.escape(c) for c in sorted(classes, key=len, reverse=True))
+            css = re.sub(rf"\.({alt})(?![\w-])", rf".{symbol}-\1", css)
+        if ids:
+            alt = "|".join(re.escape(i) for i in sorted(ids, key=len, reverse=True))
+            css = re.sub(rf"#({alt})(?=[\s{{,.>\[:+~])", rf"#{symbol}-\1", css)
+            css = re.sub(rf"(url\(['\"]?#)({alt})(?=['\")])", rf"\1{symbol}-\2", css)
+        return m.group(1) + css + m.group(3)
+
+    body = re.sub(r"(<style\b[^>]*>)(.*?)(</style>)", scope_style, body, flags=re.S)
+    head = "".join(f' {k}="{v}"' for k, v in kept.items())
+    return f'<symbol id="{symbol}"{head}>{body}</symbol>', namespaces
+
+
+def _png_symbol(symbol: str, png: bytes) -> str:
+    if png[:8] != b"\x89PNG\r\n\x1a\n" or png[12:16] != b"IHDR":
+        raise ValueError("not a PNG")
+    w, h = struct.unpack(">II", png[16:24])
+    data = base64.b64encode(png).decode()
+    return (f'<symbol id="{symbol}" viewBox="0 0 {w} {h}"><image width="{w}" '
+            f'height="{h}" href="data:image/png;base64,{data}"/></symbol>')
+
+
+def sprite_name(sprite: bytes) -> str:
+    """The sheet's file name: a new sheet gets a new URL, so a browser holding
+    the old one forever is never wrong."""
+    return SPRITE.format(hash=hashlib.sha256(sprite).hexdigest()[:12])
+
+
+def build_sprite(icons: dict[str, tuple[str, bytes]]) -> bytes:
+    """One SVG sheet with a <symbol> per app, from {symbol id: (kind, body)}.
+
+    PNGs go in as embedded images, so the page still makes exactly one request
+    for every logo it shows.
+    """
+    symbols, namespaces = [], {"xmlns:xlink": "http://www.w3.org/1999/xlink"}
+    for symbol, (kind, body) in icons.items():
+        if kind == "png":
+            symbols.append(_png_symbol(symbol, body))
+        else:
+            sym, ns = _svg_symbol(symbol, body)
+            symbols.append(sym)
+            namespaces.update(ns)
+    head = "".join(f' {k}="{v}"' for k, v in sorted(namespaces.items()))
+    return (f'<svg xmlns="http://www.w3.org/2000/svg"{head}>'
+            + "\n".join(symbols) + "</svg>\n").encode()
+
+
+def write_precompressed(path: str, body: bytes) -> bool:
+    """Write `body` to a content-named `path` with a .gz beside it; False when
+    both were there already.
+
+    The name is the content, so an existing file is already right and is not
+    rewritten. gzip only: it is in the standard library, so every run writes the
+    same files, and brotli would save a few KB on a sheet fetched once.
+    """
+    # mtime=0 keeps the .gz byte-identical across runs, so it is not a diff.
+    copies = {path: body, f"{path}.gz": gzip.compress(body, 9, mtime=0)}
+    written = False
+    for p, data in copies.items():
+        if os.path.exists(p):
+            continue
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(p), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmp, 0o644)  # mkstemp's 0600 would not be readable by Caddy
+        os.replace(tmp, p)
+        written = True
+    return written
 
 
 def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--jobs", "-j", type=int, default=JOBS,
+                        help=f"apps fetched at once (default: {JOBS})")
+    parser.add_argument("--selfhst", default=SELFHST, help="selfh.st icons base URL")
+    parser.add_argument("--dashboard", default=DASHBOARD, help="dashboard-icons base URL")
+    parser.add_argument("--out-dir", default=OUT_DIR, help="where the icon files go")
+    parser.add_argument("--manifest", default=MANIFEST, help="the icons.ts to write")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help=f"fetched logos and their validators (default: {CACHE_DIR})")
+    parser.add_argument("--offline", action="store_true",
+                        help="no network: rebuild the icons and icons.ts from the cache")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    out_dir = args.out_dir
+
     ids = sorted(
         d
         for d in os.listdir(CATALOG)
         if os.path.isdir(os.path.join(CATALOG, d)) and d != "yolab-common"
     )
-    os.makedirs(OUT_DIR, exist_ok=True)
-    for old in os.listdir(OUT_DIR):
-        os.remove(os.path.join(OUT_DIR, old))
+    os.makedirs(out_dir, exist_ok=True)
+    cache = IconCache(args.cache_dir)
 
-    found: dict[str, str] = {}
     missing: list[str] = []
 
-    for app_id in ids:
-        name = ALIASES.get(app_id, app_id)
-        svg = fetch(f"{SELFHST}/svg/{name}.svg") or fetch(f"{DASHBOARD}/svg/{name}.svg")
-        png = None
-        if svg is None or len(svg) > SVG_MAX_BYTES:
-            png = fetch(f"{SELFHST}/png/{name}.png") or fetch(
-                f"{DASHBOARD}/png/{name}.png"
-            )
+    # Every app's fallback chain runs on a worker of its own; the sheet is then
+    # assembled in id order, so the output does not depend on which CDN
+    # answered first.
+    fetcher = Fetcher(cache, offline=args.offline)
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        logos = pool.map(
+            lambda app_id: fetch_logo(fetcher, args.selfhst, args.dashboard, app_id), ids
+        )
+        logos = dict(zip(ids, logos))
 
+    icons: dict[str, tuple[str, bytes]] = {}
+    pending: dict[str, bytes] = {}
+    before = 0
+    for app_id in ids:
+        svg, png = logos[app_id]
         if png is not None:
-            path = os.path.join(OUT_DIR, f"{app_id}.png")
-            with open(path, "wb") as f:
-                f.write(png)
-            shrink_png(path)
-            found[app_id] = f"/icons/{app_id}.png"
+            cached = cache.shrunk(app_id, png)
+            if cached is None:
+                pending[app_id] = png
+            else:
+                icons[app_id] = ("png", cached)
+            before += len(png)
         elif svg is not None:
-            path = os.path.join(OUT_DIR, f"{app_id}.svg")
-            with open(path, "wb") as f:
-                f.write(svg)
-            found[app_id] = f"/icons/{app_id}.svg"
+            icons[app_id] = ("svg", minify_svg(svg))
+            before += len(svg)
         else:
             missing.append(app_id)
+    # Only PNGs whose source changed are shrunk, and all of them at once.
+    shrunk = shrink_pngs(pending)
+    for app_id, body in shrunk.items():
+        cache.store_shrunk(app_id, pending[app_id], body)
+        icons[app_id] = ("png", body)
+
+    if not icons:
+        # Offline with an empty cache, or every CDN down: writing this out would
+        # delete every committed logo.
+        print("no logo fetched or cached; leaving the icons as they are",
+              file=sys.stderr)
+        return 1
+
+    found = {app_id: f"icon-{app_id}" for app_id in ids if app_id in icons}
+    # Symbol ids end up in CSS selectors once prefixed onto a logo's own
+    # classes, and an identifier there cannot start with a digit (2fauth).
+    sprite = build_sprite({found[a]: icons[a] for a in found})
+    after = sum(len(body) for _, body in icons.values())
+
+    name = sprite_name(sprite)
+    written = write_precompressed(os.path.join(out_dir, name), sprite)
+    # The sheet and its compressed copies are the only things served from here:
+    # an older sheet, per-app files from before there was one, or a removed
+    # app's logo, go.
+    keep = {name, f"{name}.gz"}
+    for old in os.listdir(out_dir):
+        if old not in keep:
+            os.remove(os.path.join(out_dir, old))
+    cache.save(ids)
 
     lines = [
         "// GENERATED by scripts/fetch-icons.py — do not edit by hand.",
@@ -105,15 +632,28 @@ def main() -> int:
         "// from selfh.st/icons and homarr-labs/dashboard-icons. Apps with no entry",
         "// here — and anything from a user-added repo — fall back to the emoji in",
         "// their Chart.yaml.",
+        "//",
+        "// Every logo is a <symbol> in one sheet, so a page of tiles costs one",
+        "// request rather than one per app. Values are symbol ids in ICON_SPRITE.",
+        "",
+        f'export const ICON_SPRITE = "/icons/{name}";',
         "",
         "export const CATALOG_ICONS: Record<string, string> = {",
     ]
     lines += [f'  "{k}": "{found[k]}",' for k in sorted(found)]
     lines += ["};", ""]
-    with open(MANIFEST, "w") as f:
+    with open(args.manifest, "w") as f:
         f.write("\n".join(lines))
 
-    print(f"icons: {len(found)} of {len(ids)}")
+    resized = sum(shrunk[a] is not pending[a] for a in shrunk)
+    print(f"icons: {len(found)} of {len(ids)}, {before // 1024} KB fetched, "
+          f"{after // 1024} KB optimized, {resized} PNGs shrunk")
+    print(f"sprite: {name}, {len(sprite) // 1024} KB, "
+          f"{'written' if written else 'unchanged'}")
+    if not args.offline:
+        c = fetcher.counts
+        print(f"requests: {c['fetched']} fetched, {c['unchanged']} unchanged, "
+              f"{c['missing']} not found, {c['failed']} failed")
     if missing:
         print("no logo found (emoji fallback):", " ".join(missing))
     return 0
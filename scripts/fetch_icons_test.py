@@ -0,0 +1,347 @@
+#!/usr/bin/env python3
+"""Tests for fetch-icons.py's fetcher, against a stand-in CDN on 127.0.0.1.
+
+The stand-in serves a few logos with an ETag, a Last-Modified, or neither, and
+answers a conditional GET the way jsDelivr does. It records every request, so a
+test can assert what was asked and that an offline run asked nothing at all.
+Whole runs of main() use it too. The SVG minifier and the sheet need no
+server, and fetch_logo's order of sources runs against a fake fetcher.
+
+Run:  python3 scripts/fetch_icons_test.py
+"""
+
+import contextlib
+import http.server
+import importlib.util
+import io
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+spec = importlib.util.spec_from_file_location("fetch_icons", os.path.join(HERE, "fetch-icons.py"))
+fetch_icons = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(fetch_icons)
+
+SVG = b'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 24 24"><path d="M0 0h24v24H0z"/></svg>'
+LAST_MODIFIED = "Wed, 01 Jan 2025 00:00:00 GMT"
+
+
+class StandIn(http.server.ThreadingHTTPServer):
+    """path -> (body, etag, last_modified). Anything else is a 404, and a path
+    in `statuses` answers with that status instead."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), Handler)
+        self.files = {}
+        self.statuses = {}
+        self.requests = []  # (path, headers)
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+
+class Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, as the CDN does
+
+    def do_GET(self):
+        self.server.requests.append((self.path, dict(self.headers)))
+        if self.path in self.server.statuses or self.path not in self.server.files:
+            self.send_response(self.server.statuses.get(self.path, 404))
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body, etag, last_modified = self.server.files[self.path]
+        if (etag and self.headers.get("If-None-Match") == etag) or (
+                last_modified and self.headers.get("If-Modified-Since") == last_modified):
+            self.send_response(304)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        self.send_response(200)
+        if etag:
+            self.send_header("ETag", etag)
+        if last_modified:
+            self.send_header("Last-Modified", last_modified)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def quiet():
+    """What the fetcher says about a failed request, not on the test's output."""
+    return contextlib.redirect_stderr(io.StringIO())
+
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = StandIn()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.server.files = {
+            "/svg/etag.svg": (SVG, '"v1"', None),
+            "/svg/dated.svg": (SVG + b"\n", None, LAST_MODIFIED),
+        }
+
+    def fetch(self, app_id, path, offline=False):
+        """One fresh run, as the script makes: a new cache object over the same
+        directory, saved afterwards."""
+        cache = fetch_icons.IconCache(self.tmp.name)
+        fetcher = fetch_icons.Fetcher(cache, offline=offline)
+        body = fetcher.get(app_id, self.server.url + path)
+        cache.save([app_id])
+        return body, fetcher.counts
+
+    def test_200_is_stored_with_its_validators(self):
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertEqual(body, SVG)
+        self.assertEqual(counts["fetched"], 1)
+        entry = fetch_icons.IconCache(self.tmp.name).entry("etag", self.server.url + "/svg/etag.svg")
+        self.assertEqual(entry["etag"], '"v1"')
+
+    def test_304_on_etag_serves_the_cached_body(self):
+        self.fetch("etag", "/svg/etag.svg")
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertEqual(body, SVG)
+        self.assertEqual(counts, {"fetched": 0, "unchanged": 1, "missing": 0, "failed": 0})
+        _, headers = self.server.requests[-1]
+        self.assertEqual(headers.get("If-None-Match"), '"v1"')
+
+    def test_304_on_last_modified_serves_the_cached_body(self):
+        self.fetch("dated", "/svg/dated.svg")
+        body, counts = self.fetch("dated", "/svg/dated.svg")
+        self.assertEqual(body, SVG + b"\n")
+        self.assertEqual(counts["unchanged"], 1)
+        _, headers = self.server.requests[-1]
+        self.assertEqual(headers.get("If-Modified-Since"), LAST_MODIFIED)
+        self.assertNotIn("If-None-Match", headers)
+
+    def test_changed_logo_replaces_the_cached_one(self):
+        self.fetch("etag", "/svg/etag.svg")
+        self.server.files["/svg/etag.svg"] = (SVG.replace(b"24v24", b"12v12"), '"v2"', None)
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertIn(b"12v12", body)
+        self.assertEqual(counts["fetched"], 1)
+
+    def test_404_forgets_the_cached_logo(self):
+        self.fetch("etag", "/svg/etag.svg")
+        del self.server.files["/svg/etag.svg"]
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertIsNone(body)
+        self.assertEqual(counts["missing"], 1)
+        self.assertIsNone(fetch_icons.IconCache(self.tmp.name).entry(
+            "etag", self.server.url + "/svg/etag.svg"))
+
+    def test_a_server_error_keeps_the_cached_logo(self):
+        self.fetch("etag", "/svg/etag.svg")
+        for status in (503, 429):
+            self.server.statuses["/svg/etag.svg"] = status
+            with quiet():
+                body, counts = self.fetch("etag", "/svg/etag.svg")
+            self.assertEqual(body, SVG, status)
+            self.assertEqual(counts["failed"], 1)
+        # Still cached for the run after.
+        del self.server.statuses["/svg/etag.svg"]
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertEqual((body, counts["unchanged"]), (SVG, 1))
+
+    def test_gone_forgets_like_not_found(self):
+        self.fetch("etag", "/svg/etag.svg")
+        self.server.statuses["/svg/etag.svg"] = 410
+        body, counts = self.fetch("etag", "/svg/etag.svg")
+        self.assertIsNone(body)
+        self.assertEqual(counts["missing"], 1)
+
+    def test_offline_answers_from_the_cache_without_asking(self):
+        self.fetch("etag", "/svg/etag.svg")
+        asked = len(self.server.requests)
+        body, _ = self.fetch("etag", "/svg/etag.svg", offline=True)
+        self.assertEqual(body, SVG)
+        missing, _ = self.fetch("dated", "/svg/dated.svg", offline=True)
+        self.assertIsNone(missing)
+        self.assertEqual(len(self.server.requests), asked)
+
+    def test_unreachable_keeps_the_cached_logo(self):
+        self.fetch("etag", "/svg/etag.svg")
+        url = self.server.url
+        self.server.shutdown()
+        self.server.server_close()
+        cache = fetch_icons.IconCache(self.tmp.name)
+        fetcher = fetch_icons.Fetcher(cache)
+        with quiet():
+            body = fetcher.get("etag", url + "/svg/etag.svg")
+        self.assertEqual(body, SVG)
+
+
+class MinifyTest(unittest.TestCase):
+    def test_editor_leftovers_go_and_drawing_attributes_stay(self):
+        svg = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+               b'<!-- Generator: Sketch -->\n'
+               b'<svg xmlns="http://www.w3.org/2000/svg" '
+               b'xmlns:inkscape="http://www.inkscape.org/namespaces/inkscape" '
+               b'inkscape:version="1.3" data-name="Layer 1" viewBox="0 0 24 24" fill="none">\n'
+               b'  <title>logo</title>\n'
+               b'  <metadata><rdf:RDF/></metadata>\n'
+               b'  <path fill="#0af" d="M0 0h24v24H0z"/>\n'
+               b'</svg>\n')
+        out = fetch_icons.minify_svg(svg).decode()
+        for gone in ("<?xml", "<!--", "inkscape", "data-name", "<title", "<metadata"):
+            self.assertNotIn(gone, out)
+        self.assertEqual(out, '<svg xmlns="http://www.w3.org/2000/svg" '
+                              'viewBox="0 0 24 24" fill="none">'
+                              '<path fill="#0af" d="M0 0h24v24H0z"/></svg>')
+
+    def test_whitespace_inside_text_is_kept(self):
+        svg = b'<svg viewBox="0 0 24 24">\n  <text>a</text> <tspan>b</tspan>\n</svg>'
+        self.assertIn(b"</text> <tspan>", fetch_icons.minify_svg(svg))
+
+    def test_coordinates_round_to_the_view_box(self):
+        svg = (b'<svg viewBox="0 0 24 24"><path d="M1.234567 0.500001L3 4"/>'
+               b'<path d="M0 0a1 1 0 011.234567 1"/></svg>')
+        out = fetch_icons.minify_svg(svg).decode()
+        self.assertIn('d="M1.235 .5L3 4"', out)
+        # An arc's packed flags are left alone, rounding and all.
+        self.assertIn('d="M0 0a1 1 0 011.234567 1"', out)
+
+
+class SpriteTest(unittest.TestCase):
+    GRADIENT = (b'<svg xmlns="http://www.w3.org/2000/svg" id="root" width="24" height="24" '
+                b'viewBox="0 0 24 24" fill="none" class="logo">'
+                b'<style>.a{fill:url(#a)}#b{opacity:.5}</style>'
+                b'<defs><linearGradient id="a"/><linearGradient id="ab" href="#a"/></defs>'
+                b'<path id="b" class="a" fill="url(#ab)" d="M0 0h24v24H0z"/>'
+                b'<use href="#b"/></svg>')
+
+    def test_ids_and_references_are_scoped_to_the_symbol(self):
+        out, _ = fetch_icons._svg_symbol("grafana", self.GRADIENT)
+        for scoped in ('id="grafana-a"', 'id="grafana-ab"', 'id="grafana-b"',
+                       'href="#grafana-a"', 'fill="url(#grafana-ab)"', 'href="#grafana-b"',
+                       'class="grafana-a"', ".grafana-a{fill:url(#grafana-a)}",
+                       "#grafana-b{"):
+            self.assertIn(scoped, out)
+        self.assertNotRegex(out, r'(id="|#)(a|ab|b)\b')
+
+    def test_root_attributes_that_mean_nothing_on_a_symbol_are_dropped(self):
+        out, _ = fetch_icons._svg_symbol("grafana", self.GRADIENT)
+        head = out[:out.index(">") + 1]
+        self.assertEqual(head, '<symbol id="grafana" viewBox="0 0 24 24" fill="none" '
+                               'class="grafana-logo">')
+
+    def test_the_sheet_name_follows_its_content(self):
+        icons = {"grafana": ("svg", self.GRADIENT), "other": ("svg", SVG)}
+        sheet = fetch_icons.build_sprite(icons)
+        self.assertEqual(sheet, fetch_icons.build_sprite(dict(icons)))
+        name = fetch_icons.sprite_name(sheet)
+        self.assertRegex(name, r"^sprite\.[0-9a-f]{12}\.svg$")
+        self.assertEqual(name, fetch_icons.sprite_name(fetch_icons.build_sprite(dict(icons))))
+        icons["other"] = ("svg", SVG.replace(b"24v24", b"12v12"))
+        self.assertNotEqual(fetch_icons.sprite_name(fetch_icons.build_sprite(icons)), name)
+
+
+class FakeFetcher:
+    """url -> body, and the urls asked in order, for fetch_logo's fallbacks."""
+
+    def __init__(self, files):
+        self.files = files
+        self.asked = []
+
+    def get(self, app_id, url):
+        self.asked.append(url)
+        return self.files.get(url)
+
+
+class FetchLogoTest(unittest.TestCase):
+    BIG = SVG.replace(b"h24", b"h1" * (fetch_icons.SVG_MAX_BYTES // 2))
+
+    def logo(self, app_id, files):
+        fetcher = FakeFetcher(files)
+        return fetch_icons.fetch_logo(fetcher, "s", "d", app_id), fetcher.asked
+
+    def test_the_first_source_that_answers_wins(self):
+        both = {"s/svg/app.svg": SVG, "d/svg/app.svg": SVG + b"\n"}
+        self.assertEqual(self.logo("app", both), ((SVG, None), ["s/svg/app.svg"]))
+        only = {"d/svg/app.svg": SVG, "s/png/app.png": b"png"}
+        self.assertEqual(self.logo("app", only),
+                         ((SVG, None), ["s/svg/app.svg", "d/svg/app.svg"]))
+
+    def test_a_png_when_there_is_no_svg(self):
+        files = {"d/png/app.png": b"png"}
+        (svg, png), asked = self.logo("app", files)
+        self.assertEqual((svg, png), (None, b"png"))
+        self.assertEqual(asked, ["s/svg/app.svg", "d/svg/app.svg",
+                                 "s/png/app.png", "d/png/app.png"])
+
+    def test_a_png_too_when_the_svg_is_a_traced_raster(self):
+        files = {"s/svg/app.svg": self.BIG, "s/png/app.png": b"png"}
+        self.assertEqual(self.logo("app", files)[0], (self.BIG, b"png"))
+
+    def test_aliases_are_fetched_under_the_upstream_name(self):
+        (svg, _), asked = self.logo("code-server", {"s/svg/vscode.svg": SVG})
+        self.assertEqual((svg, asked), (SVG, ["s/svg/vscode.svg"]))
+
+
+class MainTest(unittest.TestCase):
+    APPS = ("alpha", "beta", "gamma", "delta", "epsilon")
+
+    def setUp(self):
+        self.server = StandIn()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = tmp.name
+        catalog = os.path.join(self.tmp, "catalog")
+        for app_id in self.APPS + ("yolab-common",):
+            os.makedirs(os.path.join(catalog, app_id))
+        # Half from each CDN, with ids that collide once they share a sheet.
+        for i, app_id in enumerate(self.APPS):
+            body = SVG.replace(b"<path", b'<path id="a" fill="url(#a)"').replace(
+                b"24v24", f"{i + 1}v{i + 1}".encode())
+            self.server.files[f"/{'sd'[i % 2]}/svg/{app_id}.svg"] = (body, f'"{i}"', None)
+        catalog_was = fetch_icons.CATALOG
+        fetch_icons.CATALOG = catalog
+        self.addCleanup(setattr, fetch_icons, "CATALOG", catalog_was)
+
+    def run_main(self, run, *extra):
+        out = os.path.join(self.tmp, run)
+        argv = ["fetch-icons.py", "--jobs", "4",
+                "--selfhst", self.server.url + "/s", "--dashboard", self.server.url + "/d",
+                "--out-dir", os.path.join(out, "icons"),
+                "--manifest", os.path.join(out, "icons.ts"),
+                "--cache-dir", os.path.join(out, "cache"), *extra]
+        with mock.patch.object(sys, "argv", argv), contextlib.redirect_stdout(io.StringIO()):
+            self.assertEqual(fetch_icons.main(), 0)
+        files = {}
+        for name in sorted(os.listdir(os.path.join(out, "icons"))):
+            with open(os.path.join(out, "icons", name), "rb") as f:
+                files[name] = f.read()
+        with open(os.path.join(out, "icons.ts"), "rb") as f:
+            return f.read(), files
+
+    def test_two_runs_write_byte_identical_output(self):
+        manifest, files = self.run_main("one")
+        self.assertEqual(self.run_main("two"), (manifest, files))
+        for app_id in self.APPS:
+            self.assertIn(f'"{app_id}": "icon-{app_id}"'.encode(), manifest)
+        name = fetch_icons.sprite_name(files[min(files)])
+        self.assertEqual(sorted(files), [name, f"{name}.gz"])
+        self.assertIn(f'"/icons/{name}"'.encode(), manifest)
+
+    def test_offline_rebuilds_the_same_output_from_the_cache(self):
+        online = self.run_main("one")
+        asked = len(self.server.requests)
+        self.assertEqual(self.run_main("one", "--offline"), online)
+        self.assertEqual(len(self.server.requests), asked)
+
+
+if __name__ == "__main__":
+    unittest.main()